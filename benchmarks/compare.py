@@ -0,0 +1,36 @@
+"""
+Compare two benchmark JSON results:
+
+    $ python -m benchmarks.compare old.json new.json
+"""
+import sys
+import json
+import argparse
+
+
+def result_key(result: dict) -> tuple:
+    return (result['name'], ) + tuple(sorted(result['params'].items()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('old')
+    parser.add_argument('new')
+    args = parser.parse_args(argv)
+
+    with open(args.old) as f:
+        old = {result_key(r): r for r in json.load(f)['results']}
+    with open(args.new) as f:
+        new = json.load(f)['results']
+
+    for result in new:
+        key = result_key(result)
+        params = ", ".join("{}={}".format(k, v) for k, v in sorted(result['params'].items()))
+        line = "{:<20} {:<50} {:>14.1f} ops/sec".format(result['name'], params, result['ops_per_sec'])
+        if key in old and old[key]['ops_per_sec']:
+            line += " {:>+8.1%}".format(result['ops_per_sec'] / old[key]['ops_per_sec'] - 1)
+        sys.stdout.write(line + "\n")
+
+
+if __name__ == '__main__':
+    main()
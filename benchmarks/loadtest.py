@@ -0,0 +1,190 @@
+"""
+Load test: N worker processes write metrics to Redis while scraper calls Registry.output.
+
+    $ python -m benchmarks.loadtest --redis-url redis://localhost:6379/15 --workers 32 --ops 5000
+
+Database is flushed. After the run counter totals and per-process gauge
+values in Redis are checked against operations issued by workers.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import multiprocessing
+
+import redis
+
+import prometheus_redis_client as prom
+
+
+COUNTER_NAME = 'loadtest_counter'
+HISTOGRAM_NAME = 'loadtest_histogram'
+GAUGE_NAME = 'loadtest_gauge'
+HISTOGRAM_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1]
+
+
+def make_registry(redis_url: str, writer: bool) -> (prom.Registry, dict):
+    registry = prom.Registry(
+        redis=redis.from_url(redis_url),
+        refresher=prom.Refresher(),
+        writer=prom.BackgroundWriter(overflow=prom.BackgroundWriter.BLOCK) if writer else None,
+    )
+    metrics = dict(
+        counter=prom.Counter(COUNTER_NAME, 'Load test counter', registry=registry),
+        histogram=prom.Histogram(
+            HISTOGRAM_NAME, 'Load test histogram', buckets=HISTOGRAM_BUCKETS, registry=registry,
+        ),
+        gauge=prom.Gauge(GAUGE_NAME, 'Load test gauge', registry=registry),
+    )
+    return registry, metrics
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def worker(number: int, args, results: multiprocessing.Queue):
+    registry, metrics = make_registry(args.redis_url, args.writer)
+    rnd = random.Random(number)
+    operations = ['counter', 'histogram', 'gauge']
+    weights = [args.counter_weight, args.histogram_weight, args.gauge_weight]
+    counts = dict.fromkeys(operations, 0)
+    latencies = []
+    gauge_value = 0.0
+
+    start = time.perf_counter()
+    for operation in rnd.choices(operations, weights, k=args.ops):
+        op_start = time.perf_counter()
+        if operation == 'counter':
+            metrics['counter'].inc()
+        elif operation == 'histogram':
+            metrics['histogram'].observe(rnd.random())
+        else:
+            gauge_value = float(rnd.randint(0, 1000))
+            metrics['gauge'].set(gauge_value)
+        latencies.append(time.perf_counter() - op_start)
+        counts[operation] += 1
+
+    # gauge series of every process should exist for check
+    if counts['gauge'] == 0:
+        metrics['gauge'].set(gauge_value)
+        counts['gauge'] += 1
+    if registry.writer is not None:
+        registry.writer.stop()
+    duration = time.perf_counter() - start
+    registry.refresher.cleanup_and_stop()
+
+    results.put(dict(
+        number=number,
+        counts=counts,
+        duration=duration,
+        latencies=latencies,
+        gauge_index=metrics['gauge'].index,
+        gauge_value=gauge_value,
+    ))
+
+
+def scraper(args, stop_event, results: multiprocessing.Queue):
+    registry, _ = make_registry(args.redis_url, False)
+    latencies = []
+    while not stop_event.is_set():
+        start = time.perf_counter()
+        registry.output()
+        latencies.append(time.perf_counter() - start)
+        stop_event.wait(args.scrape_interval)
+    registry.refresher.cleanup_and_stop()
+    results.put(latencies)
+
+
+def check(args, worker_results: list) -> list:
+    """Return list of errors found in Redis values."""
+    client = redis.from_url(args.redis_url)
+    registry, metrics = make_registry(args.redis_url, False)
+    errors = []
+
+    expected_counter = sum(r['counts']['counter'] for r in worker_results)
+    counter_value = int(client.get(metrics['counter'].get_metric_key({})) or 0)
+    if counter_value != expected_counter:
+        errors.append("counter: expected {}, got {}".format(expected_counter, counter_value))
+
+    expected_observations = sum(r['counts']['histogram'] for r in worker_results)
+    count_value = int(client.get(metrics['histogram'].get_metric_key({}, '_count')) or 0)
+    if count_value != expected_observations:
+        errors.append("histogram count: expected {}, got {}".format(expected_observations, count_value))
+
+    for r in worker_results:
+        key = metrics['gauge'].get_metric_key({'gauge_index': r['gauge_index']})
+        value = client.get(key)
+        if value is None or float(value) != r['gauge_value']:
+            errors.append("gauge of worker {}: expected {}, got {}".format(
+                r['number'], r['gauge_value'], value,
+            ))
+    registry.refresher.cleanup_and_stop()
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15', help='database will be flushed')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=2000, help='operations per worker')
+    parser.add_argument('--counter-weight', type=float, default=1)
+    parser.add_argument('--histogram-weight', type=float, default=1)
+    parser.add_argument('--gauge-weight', type=float, default=1)
+    parser.add_argument('--scrape-interval', type=float, default=0.1)
+    parser.add_argument('--writer', action='store_true', help='use BackgroundWriter in workers')
+    parser.add_argument('--output', help='JSON file for results, stdout by default')
+    args = parser.parse_args(argv)
+
+    redis.from_url(args.redis_url).flushdb()
+    context = multiprocessing.get_context('fork')
+    worker_queue, scraper_queue = context.Queue(), context.Queue()
+    stop_event = context.Event()
+
+    scraper_process = context.Process(target=scraper, args=(args, stop_event, scraper_queue))
+    scraper_process.start()
+    start = time.perf_counter()
+    workers = [
+        context.Process(target=worker, args=(number, args, worker_queue))
+        for number in range(args.workers)
+    ]
+    for process in workers:
+        process.start()
+    worker_results = [worker_queue.get() for _ in workers]
+    duration = time.perf_counter() - start
+    for process in workers:
+        process.join()
+    stop_event.set()
+    scrape_latencies = scraper_queue.get()
+    scraper_process.join()
+
+    write_latencies = [latency for r in worker_results for latency in r['latencies']]
+    errors = check(args, worker_results)
+    report = dict(
+        workers=args.workers,
+        operations=len(write_latencies),
+        writer=args.writer,
+        duration=duration,
+        throughput=len(write_latencies) / duration,
+        write_latency_p50=percentile(write_latencies, 0.5),
+        write_latency_p99=percentile(write_latencies, 0.99),
+        scrapes=len(scrape_latencies),
+        scrape_latency_p50=percentile(scrape_latencies, 0.5),
+        scrape_latency_p99=percentile(scrape_latencies, 0.99),
+        errors=errors,
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""In-memory stand-in for Redis client with commands used by prometheus_redis_client."""
+import time
+import threading
+
+
+def _to_bytes(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, float):
+        return repr(value).encode('utf-8')
+    return str(value).encode('utf-8')
+
+
+def _format_float(value: float) -> bytes:
+    result = repr(value)
+    if result.endswith('.0'):
+        result = result[:-2]
+    return result.encode('utf-8')
+
+
+class MemoryPipeline(object):
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.command_stack = []
+
+    def __len__(self):
+        return len(self.command_stack)
+
+    def __getattr__(self, name):
+        method = getattr(self.redis, name)
+
+        def add_command(*args, **kwargs):
+            self.command_stack.append((method, args, kwargs))
+            return self
+        return add_command
+
+    def execute(self):
+        with self.redis.lock:
+            result = [
+                method(*args, **kwargs) for method, args, kwargs in self.command_stack
+            ]
+        self.command_stack = []
+        return result
+
+
+class MemoryRedis(object):
+    """Thread safe Redis stand-in for one process. Keys expire lazily."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.data = {}
+        self.expires = {}
+
+    def pipeline(self, transaction=True):
+        return MemoryPipeline(self)
+
+    def flushdb(self):
+        with self.lock:
+            self.data.clear()
+            self.expires.clear()
+
+    def _get(self, key, default=None):
+        key = _to_bytes(key)
+        expire_at = self.expires.get(key)
+        if expire_at is not None and expire_at <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key, default)
+
+    def _set(self, key, value):
+        self.data[_to_bytes(key)] = value
+
+    def get(self, key):
+        with self.lock:
+            return self._get(key)
+
+    def mget(self, keys, *args):
+        keys = list(keys) + list(args)
+        with self.lock:
+            return [self._get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        with self.lock:
+            self._set(key, _to_bytes(value))
+            self.expires.pop(_to_bytes(key), None)
+            if ex:
+                self.expire(key, ex)
+            return True
+
+    def exists(self, *keys):
+        with self.lock:
+            return sum(1 for key in keys if self._get(key) is not None)
+
+    def delete(self, *keys):
+        with self.lock:
+            deleted = 0
+            for key in keys:
+                if self._get(key) is not None:
+                    deleted += 1
+                self.data.pop(_to_bytes(key), None)
+                self.expires.pop(_to_bytes(key), None)
+            return deleted
+
+    def expire(self, key, seconds):
+        with self.lock:
+            if self._get(key) is None:
+                return False
+            self.expires[_to_bytes(key)] = time.time() + seconds
+            return True
+
+    def incr(self, key, amount=1):
+        return self.incrby(key, amount)
+
+    def incrby(self, key, amount=1):
+        with self.lock:
+            value = int(self._get(key, b'0')) + int(amount)
+            self._set(key, _to_bytes(value))
+            return value
+
+    def incrbyfloat(self, key, amount=1.0):
+        with self.lock:
+            value = float(self._get(key, b'0')) + float(amount)
+            self._set(key, _format_float(value))
+            return value
+
+    def sadd(self, key, *members):
+        with self.lock:
+            current = self._get(key)
+            if current is None:
+                current = set()
+                self._set(key, current)
+            before = len(current)
+            current.update(_to_bytes(m) for m in members)
+            return len(current) - before
+
+    def srem(self, key, *members):
+        with self.lock:
+            current = self._get(key, set())
+            before = len(current)
+            current.difference_update(_to_bytes(m) for m in members)
+            return before - len(current)
+
+    def smembers(self, key):
+        with self.lock:
+            return set(self._get(key, set()))
+
+    def sunion(self, keys, *args):
+        keys = list(keys) if isinstance(keys, (list, tuple)) else [keys]
+        with self.lock:
+            result = set()
+            for key in keys + list(args):
+                result.update(self._get(key, set()))
+            return result
+
+    def hincrby(self, key, field, amount=1):
+        with self.lock:
+            current = self._get(key)
+            if current is None:
+                current = {}
+                self._set(key, current)
+            field = _to_bytes(field)
+            value = int(current.get(field, b'0')) + int(amount)
+            current[field] = _to_bytes(value)
+            return value
+
+    def hincrbyfloat(self, key, field, amount=1.0):
+        with self.lock:
+            current = self._get(key)
+            if current is None:
+                current = {}
+                self._set(key, current)
+            field = _to_bytes(field)
+            value = float(current.get(field, b'0')) + float(amount)
+            current[field] = _format_float(value)
+            return value
+
+    def hgetall(self, key):
+        with self.lock:
+            return dict(self._get(key, {}))
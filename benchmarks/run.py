@@ -0,0 +1,195 @@
+"""
+Benchmarks of metric writes and Registry.output.
+
+Run against local Redis (database is flushed!) or in-memory stand-in:
+
+    $ python -m benchmarks.run --redis-url redis://localhost:6379/15 --output result.json
+    $ python -m benchmarks.run --memory --output result.json
+
+Results are written as JSON, so they can be compared between releases.
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import datetime
+from contextlib import contextmanager
+
+import prometheus_redis_client as prom
+from benchmarks.memory_redis import MemoryRedis
+
+
+@contextmanager
+def make_registry(redis_client):
+    redis_client.flushdb()
+    registry = prom.Registry(redis=redis_client, refresher=prom.Refresher())
+    try:
+        yield registry
+    finally:
+        registry.cleanup_and_stop()
+
+
+def measure(func, iterations: int) -> float:
+    """Return seconds of `iterations` calls of func."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return time.perf_counter() - start
+
+
+def measure_peak_memory(func) -> int:
+    """Return peak of memory allocated while func is called."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def result(name: str, seconds: float, iterations: int, **params) -> dict:
+    return dict(
+        name=name,
+        params=params,
+        iterations=iterations,
+        seconds=seconds,
+        ops_per_sec=iterations / seconds if seconds else None,
+    )
+
+
+def make_metrics(registry, labelnames: list) -> dict:
+    kwargs = dict(labelnames=labelnames, registry=registry)
+    return {
+        'counter': (prom.Counter('bench_counter', 'Counter', **kwargs), 'inc', (1, )),
+        'common_gauge': (prom.CommonGauge('bench_common_gauge', 'CommonGauge', **kwargs), 'set', (1, )),
+        'gauge': (prom.Gauge('bench_gauge', 'Gauge', refresh_enable=False, **kwargs), 'set', (1, )),
+        'summary': (prom.Summary('bench_summary', 'Summary', **kwargs), 'observe', (0.1, )),
+        'histogram': (
+            prom.Histogram('bench_histogram', 'Histogram', buckets=[0.01 * 2 ** i for i in range(10)], **kwargs),
+            'observe', (0.1, ),
+        ),
+        'exponential_histogram': (
+            prom.ExponentialHistogram('bench_exponential_histogram', 'ExponentialHistogram', **kwargs),
+            'observe', (0.1, ),
+        ),
+    }
+
+
+def bench_writes(redis_client, iterations: int) -> list:
+    results = []
+    for with_labels in (False, True):
+        with make_registry(redis_client) as registry:
+            labelnames = ['method', 'path'] if with_labels else []
+            for metric_type, (metric, method, args) in make_metrics(registry, labelnames).items():
+                if with_labels:
+                    func = getattr(metric.labels('GET', '/index'), method)
+                else:
+                    func = getattr(metric, method)
+                seconds = measure(lambda: func(*args), iterations)
+                results.append(result(
+                    'write', seconds, iterations, metric_type=metric_type, labels=with_labels,
+                ))
+    return results
+
+
+def bench_labels(redis_client, iterations: int) -> list:
+    with make_registry(redis_client) as registry:
+        counter = prom.Counter('bench_counter', 'Counter', ['method', 'path'], registry=registry)
+        labels = dict(method='GET', path='/index')
+        return [
+            result(
+                'labels', measure(lambda: counter.labels('GET', '/index'), iterations), iterations,
+                call='labels()',
+            ),
+            result(
+                'labels', measure(lambda: counter.labels('GET', '/index').inc(), iterations), iterations,
+                call='labels().inc()',
+            ),
+            result(
+                'labels', measure(lambda: counter.inc(labels=labels), iterations), iterations,
+                call='inc(labels=...)',
+            ),
+        ]
+
+
+def bench_histogram_buckets(redis_client, iterations: int, bucket_counts: list) -> list:
+    results = []
+    for count in bucket_counts:
+        with make_registry(redis_client) as registry:
+            buckets = [0.001 * 2 ** i for i in range(count)]
+            histogram = prom.Histogram('bench_histogram', 'Histogram', buckets=buckets, registry=registry)
+            # the smallest value increments every bucket
+            seconds = measure(lambda: histogram.observe(0.0001), iterations)
+            results.append(result('histogram_buckets', seconds, iterations, buckets=count))
+    return results
+
+
+def bench_output(redis_client, series_counts: list, repeat: int) -> list:
+    results = []
+    for count in series_counts:
+        with make_registry(redis_client) as registry:
+            counter = prom.Counter('bench_counter', 'Counter', ['id'], registry=registry)
+            chunk = 10000
+            for start in range(0, count, chunk):
+                with registry.batch():
+                    for i in range(start, min(start + chunk, count)):
+                        counter.labels(str(i)).inc()
+            seconds = measure(registry.output, repeat)
+            results.append(result('output', seconds, repeat, series=count))
+            results[-1]['peak_memory_bytes'] = measure_peak_memory(registry.output)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    backend = parser.add_mutually_exclusive_group(required=True)
+    backend.add_argument('--redis-url', help='Redis URL, database will be flushed')
+    backend.add_argument('--memory', action='store_true', help='use in-memory Redis stand-in')
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--buckets', type=int, nargs='+', default=[5, 10, 20, 50, 100])
+    parser.add_argument('--series', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='series counts for output benchmark, for example: 1000 10000 100000 1000000')
+    parser.add_argument('--output-repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='+', choices=['write', 'labels', 'histogram_buckets', 'output'])
+    parser.add_argument('--output', help='JSON file for results, stdout by default')
+    args = parser.parse_args(argv)
+
+    if args.memory:
+        redis_client = MemoryRedis()
+    else:
+        import redis
+        redis_client = redis.from_url(args.redis_url)
+
+    benchmarks = {
+        'write': lambda: bench_writes(redis_client, args.iterations),
+        'labels': lambda: bench_labels(redis_client, args.iterations),
+        'histogram_buckets': lambda: bench_histogram_buckets(redis_client, args.iterations, args.buckets),
+        'output': lambda: bench_output(redis_client, args.series, args.output_repeat),
+    }
+    results = []
+    for name, bench in benchmarks.items():
+        if args.only and name not in args.only:
+            continue
+        results += bench()
+
+    report = dict(
+        meta=dict(
+            backend='memory' if args.memory else 'redis',
+            python=platform.python_version(),
+            platform=platform.platform(),
+            date=datetime.datetime.utcnow().isoformat(),
+        ),
+        results=results,
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == '__main__':
+    main()
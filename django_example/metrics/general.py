@@ -1,4 +1,4 @@
-from prometheus_redis_client import Counter, Histogram
+from prometheus_redis_client import Counter, ExponentialHistogram
 
 count_of_requests = Counter(
     "count_of_requests",
@@ -6,9 +6,10 @@ count_of_requests = Counter(
     labelnames=["viewname", ],
 )
 
-request_latency = Histogram(
+request_latency = ExponentialHistogram(
     "request_latency",
     "Request latency",
     labelnames=["viewname", ],
-    buckets=[0.10, 0.50, 0.100, 0.500],
+    schema=2,
+    render_schema=0,
 )
\ No newline at end of file
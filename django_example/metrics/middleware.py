@@ -1,6 +1,6 @@
 import time
 from metrics import general
-from django.urls import resolve
+from prometheus_redis_client import REGISTRY
 
 
 class MetricsMiddleware(object):
@@ -9,10 +9,13 @@ class MetricsMiddleware(object):
         self.get_response = get_response
 
     def __call__(self, request):
-        viewname = resolve(request.path).view_name
-        general.count_of_requests.labels(viewname=viewname).inc()
-        start_time = time.time()
+        start_time = time.perf_counter()
         try:
             return self.get_response(request)
         finally:
-            general.request_latency.labels(viewname=viewname).observe(time.time() - start_time)
\ No newline at end of file
+            # route is resolved by Django already, send all metrics of request in one pipeline
+            match = request.resolver_match
+            viewname = match.view_name if match is not None else 'unknown'
+            with REGISTRY.batch():
+                general.count_of_requests.labels(viewname=viewname).inc()
+                general.request_latency.labels(viewname=viewname).observe(time.perf_counter() - start_time)
@@ -1,2 +1,5 @@
-from prometheus_redis_client.registry import REGISTRY, Registry, Refresher
-from prometheus_redis_client.metrics import CommonGauge, Counter, Gauge, Histogram, Summary, DEFAULT_GAUGE_INDEX_KEY
\ No newline at end of file
+from prometheus_redis_client.registry import REGISTRY, Registry, RegistryScope, Refresher
+from prometheus_redis_client.metrics import (
+    CommonGauge, Counter, ExponentialHistogram, Gauge, Histogram, Summary, DEFAULT_GAUGE_INDEX_KEY,
+)
+from prometheus_redis_client.writer import BackgroundWriter
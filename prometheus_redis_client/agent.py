@@ -0,0 +1,316 @@
+"""
+Local agent which receives metric write commands by datagrams and sends them to Redis.
+
+Short-lived processes (cron scripts, CLI tools) send commands to agent without
+waiting Redis connection and responses:
+
+    from prometheus_redis_client import Registry, Counter
+    from prometheus_redis_client.agent import AgentWriter
+    registry = Registry(writer=AgentWriter('unix:///tmp/prometheus_redis_agent.sock'))
+    Counter('jobs_total', 'Count of jobs', registry=registry).inc()
+
+Agent merges commands and writes them to Redis in one pipeline per `flush-interval`:
+
+    $ prometheus-redis-agent --redis-url redis://localhost:6379/0 --address unix:///tmp/prometheus_redis_agent.sock
+
+Address is `unix:///path` (Unix datagram socket) or `udp://host:port`.
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import struct
+import logging
+import argparse
+
+from redis import StrictRedis
+
+from prometheus_redis_client.local_metrics import LocalCounter
+from prometheus_redis_client.pipeline import CommandBuffer
+from prometheus_redis_client.registry import Registry
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADDRESS = 'unix:///tmp/prometheus_redis_agent.sock'
+VERSION = 1
+MAX_DATAGRAM = 65000
+
+# argument kinds: 's' string, 'S' list of strings, 'n' number, 'o' number or None
+SCHEMAS = (
+    ('sadd', 'sS'),
+    ('srem', 'sS'),
+    ('delete', 'S'),
+    ('set', 'sno'),
+    ('expire', 'sn'),
+    ('incrby', 'sn'),
+    ('incrbyfloat', 'sn'),
+    ('hincrby', 'ssn'),
+    ('hincrbyfloat', 'ssn'),
+)
+OPCODES = {name: (opcode, schema) for opcode, (name, schema) in enumerate(SCHEMAS)}
+
+UINT8 = struct.Struct('<B')
+UINT16 = struct.Struct('<H')
+INT64 = struct.Struct('<q')
+DOUBLE = struct.Struct('<d')
+
+
+def _encode_string(value) -> bytes:
+    if not isinstance(value, bytes):
+        value = str(value).encode('utf-8')
+    return UINT16.pack(len(value)) + value
+
+
+def _encode_number(value) -> bytes:
+    if value is None:
+        return b'-'
+    if isinstance(value, int):
+        return b'i' + INT64.pack(value)
+    return b'd' + DOUBLE.pack(value)
+
+
+def encode_command(command: tuple) -> bytes:
+    """Pack command to bytes: opcode and arguments by schema of command."""
+    opcode, schema = OPCODES[command[0]]
+    args = command[1:]
+    if schema[-1] == 'S':
+        # strings list is the rest of arguments
+        args = args[:len(schema) - 1] + (args[len(schema) - 1:], )
+    parts = [UINT8.pack(opcode)]
+    for kind, arg in zip(schema, args):
+        if kind == 's':
+            parts.append(_encode_string(arg))
+        elif kind == 'S':
+            parts.append(UINT16.pack(len(arg)))
+            parts += [_encode_string(item) for item in arg]
+        else:
+            parts.append(_encode_number(arg))
+    return b''.join(parts)
+
+
+def encode_datagrams(commands: list, max_size: int = MAX_DATAGRAM) -> list:
+    """Pack commands to datagrams of at most `max_size` bytes (single command can be bigger)."""
+    header = UINT8.pack(VERSION)
+    datagrams, parts, size = [], [header], len(header)
+    for command in commands:
+        data = encode_command(command)
+        if size + len(data) > max_size and len(parts) > 1:
+            datagrams.append(b''.join(parts))
+            parts, size = [header], len(header)
+        parts.append(data)
+        size += len(data)
+    if len(parts) > 1:
+        datagrams.append(b''.join(parts))
+    return datagrams
+
+
+def decode_datagram(data: bytes) -> list:
+    """Return commands of datagram. Raise ValueError if datagram is corrupted."""
+    try:
+        if UINT8.unpack_from(data, 0)[0] != VERSION:
+            raise ValueError("Unknown version of datagram")
+        commands = []
+        offset = UINT8.size
+        while offset < len(data):
+            name, schema = SCHEMAS[UINT8.unpack_from(data, offset)[0]]
+            offset += UINT8.size
+            command = [name]
+            for kind in schema:
+                if kind == 's':
+                    value, offset = _decode_string(data, offset)
+                    command.append(value)
+                elif kind == 'S':
+                    count = UINT16.unpack_from(data, offset)[0]
+                    offset += UINT16.size
+                    for _ in range(count):
+                        value, offset = _decode_string(data, offset)
+                        command.append(value)
+                else:
+                    value, offset = _decode_number(data, offset)
+                    command.append(value)
+            commands.append(tuple(command))
+        return commands
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ValueError("Corrupted datagram: {}".format(e))
+
+
+def _decode_string(data: bytes, offset: int) -> (str, int):
+    length = UINT16.unpack_from(data, offset)[0]
+    offset += UINT16.size
+    if offset + length > len(data):
+        raise IndexError("string out of datagram")
+    return data[offset:offset + length].decode('utf-8'), offset + length
+
+
+def _decode_number(data: bytes, offset: int) -> (object, int):
+    kind = data[offset:offset + 1]
+    offset += 1
+    if kind == b'-':
+        return None, offset
+    if kind == b'i':
+        return INT64.unpack_from(data, offset)[0], offset + INT64.size
+    if kind == b'd':
+        return DOUBLE.unpack_from(data, offset)[0], offset + DOUBLE.size
+    raise IndexError("unknown number kind")
+
+
+def parse_address(address: str) -> (int, object):
+    """Return socket family and address for `unix:///path` or `udp://host:port`."""
+    if address.startswith('unix://'):
+        return socket.AF_UNIX, address[len('unix://'):]
+    if address.startswith('udp://'):
+        host, port = address[len('udp://'):].rsplit(':', 1)
+        return socket.AF_INET, (host, int(port))
+    raise ValueError("Address should be unix:///path or udp://host:port, got {}".format(address))
+
+
+class AgentWriter(object):
+    """
+    Send metric commands to agent by non-blocking datagrams.
+    Commands are dropped if agent does not read them (or is not started).
+    """
+
+    def __init__(self, address: str = DEFAULT_ADDRESS, max_datagram: int = MAX_DATAGRAM):
+        self.family, self.address = parse_address(address)
+        self.max_datagram = max_datagram
+        self.registry = None
+        self._socket = None
+        self._pid = None
+
+    def bind(self, registry):
+        """Set registry and register writer metrics in it."""
+        self.registry = registry
+        self.dropped = LocalCounter(
+            "prometheus_redis_client_agent_dropped_total",
+            "Count of datagrams which are not sent to agent",
+            registry=registry,
+        )
+
+    @property
+    def metrics(self) -> list:
+        return [self.dropped]
+
+    def _get_socket(self) -> socket.socket:
+        # forked process gets own socket
+        if self._pid != os.getpid():
+            self._socket = socket.socket(self.family, socket.SOCK_DGRAM)
+            self._socket.setblocking(False)
+            self._pid = os.getpid()
+        return self._socket
+
+    def put(self, commands: list):
+        sock = self._get_socket()
+        for datagram in encode_datagrams(commands, self.max_datagram):
+            try:
+                sock.sendto(datagram, self.address)
+            except OSError:
+                self.dropped.inc()
+
+    def flush(self):
+        """Datagrams are sent immediately."""
+
+    def stop(self):
+        if self._pid == os.getpid():
+            self._socket.close()
+        self._socket = None
+        self._pid = None
+
+
+class MetricsAgent(object):
+    """Receive commands from datagram socket, merge them and send to Redis of registry."""
+
+    def __init__(self, registry: Registry, address: str = DEFAULT_ADDRESS, flush_interval: float = 1,
+                 max_batch: int = 100000, timeout_granule: float = 1):
+        """
+        :param registry: registry with Redis for write (journal and stream mode of registry are used too).
+        :param flush_interval: seconds to collect commands before send them in one pipeline.
+        :param max_batch: max count of commands in one pipeline.
+        """
+        self.registry = registry
+        self.family, self.address = parse_address(address)
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.timeout_granule = timeout_granule
+        self.socket = None
+        self._should_be_close = False
+
+    def bind(self):
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address)
+        self.socket = socket.socket(self.family, socket.SOCK_DGRAM)
+        self.socket.bind(self.address)
+
+    def close(self):
+        self.socket.close()
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def receive(self, buffer: CommandBuffer, timeout: float):
+        """Wait datagram at most `timeout` seconds and add its commands to buffer."""
+        self.socket.settimeout(max(timeout, 0.001))
+        try:
+            data = self.socket.recv(MAX_DATAGRAM * 4)
+        except socket.timeout:
+            return
+        try:
+            buffer.extend(decode_datagram(data))
+        except ValueError:
+            logger.warning("Skip corrupted datagram", exc_info=True)
+
+    def send(self, buffer: CommandBuffer):
+        if buffer:
+            self.registry.safe_execute(self.registry.send_commands, buffer.commands)
+
+    def run(self):
+        """Receive and send commands until `stop` is called. Socket should be bound."""
+        buffer = CommandBuffer()
+        deadline = None
+        try:
+            while not self._should_be_close:
+                if deadline is None:
+                    timeout = self.timeout_granule
+                else:
+                    timeout = min(deadline - time.monotonic(), self.timeout_granule)
+                self.receive(buffer, timeout)
+                if buffer and deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if buffer and (time.monotonic() >= deadline or len(buffer) >= self.max_batch):
+                    self.send(buffer)
+                    buffer, deadline = CommandBuffer(), None
+        finally:
+            self.send(buffer)
+
+    def stop(self):
+        self._should_be_close = True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--redis-url', default='redis://localhost:6379/0')
+    parser.add_argument('--address', default=DEFAULT_ADDRESS, help='unix:///path or udp://host:port')
+    parser.add_argument('--flush-interval', type=float, default=1, help='seconds between Redis writes')
+    parser.add_argument('--journal-interval', type=float, help='write journal of changed series with this interval')
+    parser.add_argument('--stream', help='append commands to Redis Stream for aggregator')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    registry = Registry(redis=StrictRedis.from_url(args.redis_url), stream=args.stream)
+    if args.journal_interval:
+        registry.enable_journal(args.journal_interval)
+    agent = MetricsAgent(registry, args.address, flush_interval=args.flush_interval)
+    signal.signal(signal.SIGTERM, lambda *_: agent.stop())
+    agent.bind()
+    logger.info("Receive metrics on %s", args.address)
+    try:
+        agent.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        agent.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
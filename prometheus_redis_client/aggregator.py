@@ -0,0 +1,170 @@
+"""
+Aggregator of Redis Stream with metric write commands.
+
+Workers with `Registry(stream=...)` append commands to stream,
+aggregator reads them with consumer group, merges and applies to metric keys:
+
+    $ prometheus-redis-aggregator --redis-url redis://localhost:6379/0
+
+Several aggregators with different consumer names can read one stream.
+Entries which are not acknowledged by consumer `claim-idle` milliseconds
+(aggregator crashed or restarted with other name) are claimed by other aggregator.
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+
+from redis import StrictRedis
+from redis.exceptions import ResponseError
+
+from prometheus_redis_client.journal import Journal
+from prometheus_redis_client.pipeline import CommandBuffer, DEFAULT_STREAM, decode_commands, replay
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GROUP = 'prometheus_redis_client'
+
+
+class StreamAggregator(object):
+
+    def __init__(self, redis: StrictRedis, stream: str = DEFAULT_STREAM, group: str = DEFAULT_GROUP,
+                 consumer: str = None, count: int = 1000, block: int = 1000, error_timeout: float = 1,
+                 journal: Journal = None, claim_idle: int = 60000):
+        """
+        :param consumer: name of consumer in group, host name and pid by default.
+        :param count: max count of stream entries applied in one pipeline.
+        :param block: milliseconds to wait new entries.
+        :param journal: write journal of changed series (see `Registry.enable_journal`).
+        :param claim_idle: milliseconds after which entries not acknowledged
+        by other consumer are claimed and applied by this one.
+        """
+        self.redis = redis
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer or "{}-{}".format(socket.gethostname(), os.getpid())
+        self.count = count
+        self.block = block
+        self.error_timeout = error_timeout
+        self.journal = journal
+        self.claim_idle = claim_idle
+        self._should_be_close = False
+
+    def create_group(self):
+        try:
+            self.redis.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def process(self, pending: bool = False) -> int:
+        """
+        Read entries, apply their commands and acknowledge entries in one transaction.
+        Return count of processed entries.
+        :param pending: read entries delivered to this consumer before but not acknowledged.
+        """
+        response = self.redis.xreadgroup(
+            self.group, self.consumer, {self.stream: '0' if pending else '>'},
+            count=self.count, block=None if pending else self.block,
+        )
+        ids = []
+        buffer = CommandBuffer()
+        for _, entries in response or ():
+            for entry_id, fields in entries:
+                ids.append(entry_id)
+                # fields of deleted pending entry are empty
+                if fields:
+                    buffer.extend(decode_commands(fields[b'c']))
+        if not ids:
+            return 0
+
+        commands = buffer.commands
+        if self.journal is not None:
+            commands = self.journal.annotate(commands)
+        pipeline = self.redis.pipeline()
+        replay(commands, pipeline)
+        pipeline.xack(self.stream, self.group, *ids)
+        pipeline.xdel(self.stream, *ids)
+        pipeline.execute()
+        return len(ids)
+
+    def claim(self) -> int:
+        """
+        Take entries which are not acknowledged by other consumers `claim_idle` milliseconds,
+        they become pending entries of this consumer. Return count of claimed entries.
+        """
+        ids = []
+        for entry in self.redis.xpending_range(self.stream, self.group, min='-', max='+', count=self.count):
+            consumer = entry['consumer']
+            if isinstance(consumer, bytes):
+                consumer = consumer.decode('utf-8')
+            if consumer != self.consumer and entry['time_since_delivered'] >= self.claim_idle:
+                ids.append(entry['message_id'])
+        if not ids:
+            return 0
+        # entries acknowledged or claimed by others meanwhile are skipped by Redis
+        return len(self.redis.xclaim(self.stream, self.group, self.consumer, self.claim_idle, ids, justid=True))
+
+    def process_pending(self):
+        while not self._should_be_close and self.process(pending=True):
+            pass
+
+    def run(self):
+        """Process entries until `stop` is called."""
+        self.create_group()
+        self.process_pending()
+        next_claim = 0
+        while not self._should_be_close:
+            try:
+                if time.monotonic() >= next_claim:
+                    while not self._should_be_close and self.claim():
+                        self.process_pending()
+                    next_claim = time.monotonic() + self.claim_idle / 1000
+                self.process()
+            except Exception:
+                logger.exception("Error while aggregate metrics stream %s", self.stream)
+                time.sleep(self.error_timeout)
+
+    def stop(self):
+        self._should_be_close = True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--redis-url', default='redis://localhost:6379/0')
+    parser.add_argument('--stream', default=DEFAULT_STREAM)
+    parser.add_argument('--group', default=DEFAULT_GROUP)
+    parser.add_argument('--consumer', help='consumer name, host name and pid by default')
+    parser.add_argument('--count', type=int, default=1000, help='max entries in one pipeline')
+    parser.add_argument('--block', type=int, default=1000, help='milliseconds to wait new entries')
+    parser.add_argument('--journal-interval', type=float, help='write journal of changed series with this interval')
+    parser.add_argument('--claim-idle', type=int, default=60000,
+                        help='milliseconds after which entries of other consumers are claimed')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    aggregator = StreamAggregator(
+        StrictRedis.from_url(args.redis_url),
+        stream=args.stream,
+        group=args.group,
+        consumer=args.consumer,
+        count=args.count,
+        block=args.block,
+        journal=Journal(args.journal_interval) if args.journal_interval else None,
+        claim_idle=args.claim_idle,
+    )
+    signal.signal(signal.SIGTERM, lambda *_: aggregator.stop())
+    logger.info("Aggregate stream %s as %s", aggregator.stream, aggregator.consumer)
+    try:
+        aggregator.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,6 @@
 """Module provide base Metric classes."""
 import json
+import time
 import base64
 import logging
 from typing import List
@@ -11,39 +12,51 @@ from prometheus_redis_client.registry import Registry, REGISTRY
 logger = logging.getLogger(__name__)
 
 
+def escape_label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def escape_doc(doc: str) -> str:
+    return doc.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def render_labels(labels: dict) -> str:
+    """Labels in exposition format with sorted keys: '{a="1",b="2"}'."""
+    if not labels:
+        return ""
+    return "{" + ",".join([
+        '{}="{}"'.format(key, escape_label_value(labels[key])) for key in sorted(labels)
+    ]) + "}"
+
+
 class BaseRepresentation(object):
+    __slots__ = ()
 
     def output(self) -> str:
         raise NotImplementedError
 
 
 class MetricRepresentation(BaseRepresentation):
+    __slots__ = ('name', 'labels', 'value', 'labels_str')
 
-    def __init__(self, name, labels, value):
+    def __init__(self, name, labels, value, labels_str: str = None):
+        """
+        :param labels_str: rendered labels, they are rendered from `labels` if None.
+        """
         self.name = name
         self.labels = labels
         self.value = value
+        self.labels_str = labels_str
 
     def output(self) -> str:
-        if self.labels is None:
-            labels_str = ""
-        else:
-            labels_str = ",".join([
-                '{key}=\"{val}\"'.format(
-                    key=key,
-                    val=self.labels[key]
-                ) for key in sorted(self.labels.keys())
-            ])
-            if labels_str:
-                labels_str = "{" + labels_str + "}"
-        return "%(name)s%(labels)s %(value)s" % dict(
-            name=self.name,
-            labels=labels_str,
-            value=self.value
-        )
+        labels_str = self.labels_str
+        if labels_str is None:
+            labels_str = render_labels(self.labels)
+        return "{}{} {}".format(self.name, labels_str, self.value)
 
 
 class DocRepresentation(BaseRepresentation):
+    __slots__ = ('doc', 'name', 'type')
 
     def __init__(self, name: str, type: str, documentation: str):
         self.doc = documentation
@@ -52,7 +65,7 @@ class DocRepresentation(BaseRepresentation):
 
     def output(self):
         return "# HELP {name} {doc}\n# TYPE {name} {type}".format(
-            doc=self.doc,
+            doc=escape_doc(self.doc),
             name=self.name,
             type=self.type,
         )
@@ -97,8 +110,13 @@ class BaseMetric(object):
         self.labelnames = labelnames or []
         self.name = name
         self.registry = registry
+        # packed labels -> (labels, rendered labels) of last collect
+        self._labels_cache = {}
         self.registry.add_metric(self)
 
+    def on_unregister(self):
+        """Called when metric is removed from registry."""
+
     def doc_string(self) -> DocRepresentation:
         return DocRepresentation(
             self.name,
@@ -127,6 +145,18 @@ class BaseMetric(object):
     def unpack_labels(self, labels: str) -> dict:
         return json.loads(base64.b64decode(labels).decode('utf-8'))
 
+    def collect_labels(self, packed_labels: str, cache: dict) -> (dict, str):
+        """
+        Return unpacked and rendered labels, they are reused from previous collect.
+        Used labels are put to `cache` which replaces cache of metric after collect.
+        """
+        item = self._labels_cache.get(packed_labels)
+        if item is None:
+            labels = self.unpack_labels(packed_labels)
+            item = (labels, render_labels(labels))
+        cache[packed_labels] = item
+        return item
+
     def _check_labels(self, labels):
         if set(labels.keys()) != set(self.labelnames):
             raise ValueError("Expect define all labels: {}. Got only: {}".format(
@@ -145,25 +175,84 @@ class BaseMetric(object):
         )
 
 
+def _log_error(breaker, func):
+    suppressed = breaker.log_permit() if breaker is not None else 0
+    if suppressed is None:
+        return
+    if suppressed:
+        logger.exception(
+            "Error while send metric to Redis. Function %s. Similar errors suppressed: %s",
+            func, suppressed,
+        )
+    else:
+        logger.exception("Error while send metric to Redis. Function %s", func)
+
+
+def _skip_write(metric) -> bool:
+    """
+    Return True while circuit breaker of metric registry is open.
+    Buffered writes (batch, writer) do not take the trial write, it is taken when they are sent.
+    """
+    breaker = metric.registry.circuit_breaker
+    if breaker is None:
+        return False
+    if metric.registry.is_buffering():
+        return breaker.skipping()
+    return not breaker.allow()
+
+
 def silent_wrapper(func):
-    """Wrap function for process any Exception and write it to log."""
+    """
+    Wrap metric method for process any Exception and write it to log.
+    Skip call while circuit breaker of metric registry is open.
+    Result of write is reported to circuit breaker by `Registry.send_commands`,
+    buffered writes (batch, writer) are reported when they are sent.
+    """
     @wraps(func)
-    def silent_function(*args, **kwargs):
+    def silent_function(metric, *args, **kwargs):
+        if _skip_write(metric):
+            return
+        instrumentation = metric.registry.instrumentation
+        if instrumentation is not None:
+            start = time.perf_counter()
         try:
-            return func(*args, **kwargs)
+            result = func(metric, *args, **kwargs)
         except Exception:
-            logger.exception("Error while send metric to Redis. Function %s", func)
+            if instrumentation is not None:
+                instrumentation.swallowed_exceptions.inc(labels={"metric_type": metric.type})
+            _log_error(metric.registry.circuit_breaker, func)
+            return
+        finally:
+            if instrumentation is not None:
+                instrumentation.write_duration.observe(
+                    time.perf_counter() - start, labels={"metric_type": metric.type},
+                )
+        return result
 
     return silent_function
 
 
 def async_silent_wrapper(func):
-    """Wrap function for process any Exception and write it to log."""
+    """Async version of `silent_wrapper`."""
     @wraps(func)
-    async def silent_function(*args, **kwargs):
+    async def silent_function(metric, *args, **kwargs):
+        if _skip_write(metric):
+            return
+        instrumentation = metric.registry.instrumentation
+        if instrumentation is not None:
+            start = time.perf_counter()
         try:
-            return await func(*args, **kwargs)
+            result = await func(metric, *args, **kwargs)
         except Exception:
-            logger.exception("Error while send metric to Redis. Function %s", func)
+            if instrumentation is not None:
+                instrumentation.swallowed_exceptions.inc(labels={"metric_type": metric.type})
+            _log_error(metric.registry.circuit_breaker, func)
+            return
+        finally:
+            if instrumentation is not None:
+                instrumentation.write_duration.observe(
+                    time.perf_counter() - start, labels={"metric_type": metric.type},
+                )
+        return result
 
-    return silent_function
\ No newline at end of file
+    return silent_function
@@ -0,0 +1,107 @@
+"""
+Metrics of Celery tasks based on Celery signals.
+
+Writes of task end are sent to Redis in one pipeline. With `background_writer=True`
+writes of registry are collected by background writer and sent to Redis
+once per `flush_interval`, so tasks do not wait Redis requests.
+
+    from prometheus_redis_client.celery_integration import CeleryMetrics
+    CeleryMetrics().install()
+"""
+import time
+import threading
+
+from prometheus_redis_client.helpers import perf_counter_ns
+from prometheus_redis_client.metrics import Counter, Gauge, Histogram
+from prometheus_redis_client.registry import REGISTRY, Registry
+from prometheus_redis_client.writer import BackgroundWriter
+
+
+PUBLISHED_AT_HEADER = 'prometheus_published_at'
+
+
+class CeleryMetrics(object):
+
+    default_buckets = (
+        .005, .01, .025, .05, .075, .1, .25, .5, .75, 1, 2.5, 5, 7.5, 10, 30, 60, 300,
+    )
+
+    def __init__(self, registry: Registry = REGISTRY, prefix: str = 'celery',
+                 buckets: list = default_buckets, flush_interval: float = 1):
+        """
+        :param prefix: prefix of metric names.
+        :param flush_interval: seconds between sending of collected metrics
+        by background writer of `install`.
+        """
+        self.registry = registry
+        self.flush_interval = flush_interval
+        self.tasks = Counter(
+            prefix + '_tasks_total', 'Count of finished tasks by state',
+            labelnames=['task', 'state'], registry=registry,
+        )
+        self.runtime = Histogram(
+            prefix + '_task_runtime_seconds', 'Duration of task execution',
+            labelnames=['task'], buckets=buckets, registry=registry,
+        )
+        self.queue_wait = Histogram(
+            prefix + '_task_queue_wait_seconds', 'Time between task publish and start of execution',
+            labelnames=['task'], buckets=buckets, registry=registry,
+        )
+        self.in_progress = Gauge(
+            prefix + '_tasks_in_progress', 'Count of tasks in progress in worker process',
+            labelnames=['task'], registry=registry,
+        )
+        self._lock = threading.Lock()
+        self._started = {}
+
+    def install(self, background_writer: bool = False):
+        """
+        Connect to Celery signals.
+        :param background_writer: set background writer to registry if it has no writer.
+        Writer is used by all metrics of registry, not only by metrics of Celery.
+        """
+        from celery import signals
+
+        if background_writer and self.registry.writer is None:
+            self.registry.set_writer(BackgroundWriter(flush_interval=self.flush_interval))
+        signals.before_task_publish.connect(self.before_task_publish, weak=False)
+        signals.task_prerun.connect(self.task_prerun, weak=False)
+        signals.task_postrun.connect(self.task_postrun, weak=False)
+        signals.worker_process_init.connect(self.worker_process_init, weak=False)
+        signals.worker_process_shutdown.connect(self.worker_shutdown, weak=False)
+        signals.worker_shutdown.connect(self.worker_shutdown, weak=False)
+
+    def before_task_publish(self, headers=None, **kwargs):
+        # wall clock, because task can be executed on other host
+        if headers is not None:
+            headers.setdefault(PUBLISHED_AT_HEADER, time.time())
+
+    def task_prerun(self, task_id=None, task=None, **kwargs):
+        name = task.name
+        published_at = getattr(task.request, PUBLISHED_AT_HEADER, None)
+        with self.registry.batch():
+            if published_at is not None:
+                self.queue_wait.observe(max(time.time() - float(published_at), 0), labels={'task': name})
+            self.in_progress.inc(1, labels={'task': name})
+        with self._lock:
+            self._started[task_id] = perf_counter_ns()
+
+    def task_postrun(self, task_id=None, task=None, state=None, **kwargs):
+        name = task.name
+        with self._lock:
+            start = self._started.pop(task_id, None)
+        with self.registry.batch():
+            if start is not None:
+                self.runtime.observe((perf_counter_ns() - start) / 1e9, labels={'task': name})
+                self.in_progress.dec(1, labels={'task': name})
+            self.tasks.inc(labels={'task': name, 'state': (state or 'unknown').lower()})
+
+    def worker_process_init(self, **kwargs):
+        # prefork child gets own gauge indexes
+        self.registry.reset_after_fork()
+        self._lock = threading.Lock()
+        self._started = {}
+
+    def worker_shutdown(self, **kwargs):
+        if self.registry.writer is not None:
+            self.registry.writer.flush()
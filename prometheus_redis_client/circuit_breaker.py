@@ -0,0 +1,101 @@
+import time
+import threading
+
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+
+
+class CircuitBreaker(object):
+    """
+    Skip metric writes while Redis is unavailable.
+
+    After `failure_threshold` consecutive errors writes are skipped for `backoff` seconds.
+    Then one write is tried; if it fails the backoff is doubled (up to `max_backoff`).
+    Also limit error logging: one traceback per `log_interval` seconds.
+    Only errors of connection (`failure_exceptions`) are counted, not errors of commands.
+    """
+
+    failure_exceptions = (RedisConnectionError, RedisTimeoutError, OSError)
+
+    default_failure_threshold = 5
+    default_backoff = 1
+    default_max_backoff = 60
+    default_log_interval = 60
+
+    def __init__(self, failure_threshold: int = default_failure_threshold,
+                 backoff: float = default_backoff,
+                 max_backoff: float = default_max_backoff,
+                 log_interval: float = default_log_interval):
+        self.failure_threshold = failure_threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.log_interval = log_interval
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.failures = 0
+        self.current_backoff = self.backoff
+        self.opened_until = 0
+        self.skipped = 0
+        self.suppressed_logs = 0
+        self._last_log_time = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.failures >= self.failure_threshold
+
+    def allow(self) -> bool:
+        """Return False if write should be skipped."""
+        if self.failures < self.failure_threshold:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            if now < self.opened_until:
+                self.skipped += 1
+                return False
+            # try one write, others are skipped until it finished
+            self.opened_until = now + self.current_backoff
+            return True
+
+    def skipping(self) -> bool:
+        """
+        Return True while backoff is not passed. Unlike `allow` it does not take
+        the trial write, so it is used when commands are buffered and sent later.
+        """
+        if self.failures < self.failure_threshold:
+            return False
+        if time.monotonic() < self.opened_until:
+            with self.lock:
+                self.skipped += 1
+            return True
+        return False
+
+    def success(self):
+        if self.failures:
+            with self.lock:
+                self.failures = 0
+                self.current_backoff = self.backoff
+                self.opened_until = 0
+
+    def failure(self):
+        now = time.monotonic()
+        with self.lock:
+            self.failures += 1
+            if self.failures > self.failure_threshold:
+                self.current_backoff = min(self.current_backoff * 2, self.max_backoff)
+            if self.failures >= self.failure_threshold:
+                self.opened_until = now + self.current_backoff
+
+    def log_permit(self):
+        """
+        Return count of suppressed logs since last permitted log
+        or None if error should not be logged now.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if self._last_log_time is not None and now - self._last_log_time < self.log_interval:
+                self.suppressed_logs += 1
+                return None
+            self._last_log_time = now
+            suppressed, self.suppressed_logs = self.suppressed_logs, 0
+            return suppressed
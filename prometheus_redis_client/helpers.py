@@ -1,15 +1,57 @@
 import time
+import inspect
 from typing import Callable
-from functools import wraps
+from functools import partial, wraps
 
+try:
+    from time import perf_counter_ns
+except ImportError:  # python 3.6
+    def perf_counter_ns() -> int:
+        return int(time.perf_counter() * 1e9)
+
+
+class Timer(object):
+    """
+    Measure duration in seconds and pass it to `observe` callback.
+
+    Use as context manager or as decorator of function or coroutine function.
+    Duration is recorded even if exception raised.
+    """
+    __slots__ = ('observe', '_start')
+
+    def __init__(self, observe: Callable):
+        self.observe = observe
+        self._start = None
+
+    def __enter__(self):
+        self._start = perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.observe((perf_counter_ns() - self._start) / 1e9)
+
+    def __call__(self, func):
+        observe = self.observe
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_func_wrapper(*args, **kwargs):
+                start = perf_counter_ns()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    observe((perf_counter_ns() - start) / 1e9)
+            return async_func_wrapper
 
-def timeit(metric_callback: Callable, **labels):
-    def wrapper(func):
         @wraps(func)
         def func_wrapper(*args, **kwargs):
-            start = time.time()
-            result = func(*args, **kwargs)
-            metric_callback(time.time() - start, labels=labels)
-            return result
+            start = perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe((perf_counter_ns() - start) / 1e9)
         return func_wrapper
-    return wrapper
+
+
+def timeit(metric_callback: Callable, **labels):
+    return Timer(partial(metric_callback, labels=labels))
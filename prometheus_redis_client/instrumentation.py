@@ -0,0 +1,80 @@
+"""Metrics about work of the client itself."""
+from prometheus_redis_client.local_metrics import LocalCounter, LocalGauge, LocalHistogram, LocalMetric
+
+
+class Instrumentation(object):
+    """
+    Process memory metrics of write calls, pipelines, refresher and collect.
+    Use `Registry.enable_instrumentation` for register them.
+    """
+
+    prefix = "prometheus_redis_client_"
+
+    pipeline_commands_buckets = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+    def __init__(self, registry):
+        prefix = self.prefix
+        self.write_duration = LocalHistogram(
+            prefix + "write_duration_seconds",
+            "Duration of metric write calls",
+            labelnames=["metric_type"],
+            registry=registry,
+        )
+        self.pipeline_commands = LocalHistogram(
+            prefix + "pipeline_commands",
+            "Count of commands in pipelines sent to Redis",
+            buckets=self.pipeline_commands_buckets,
+            registry=registry,
+        )
+        self.write_errors = LocalCounter(
+            prefix + "write_errors_total",
+            "Count of failed pipelines",
+            registry=registry,
+        )
+        self.swallowed_exceptions = LocalCounter(
+            prefix + "swallowed_exceptions_total",
+            "Count of exceptions caught in metric write calls",
+            labelnames=["metric_type"],
+            registry=registry,
+        )
+        self.skipped_writes = LocalCounter(
+            prefix + "circuit_breaker_skipped_total",
+            "Count of writes skipped by circuit breaker",
+            registry=registry,
+        )
+        self.skipped_writes.set_function(
+            lambda: registry.circuit_breaker.skipped if registry.circuit_breaker else 0,
+        )
+        self.refresh_duration = LocalHistogram(
+            prefix + "refresh_duration_seconds",
+            "Duration of refresher cycle",
+            registry=registry,
+        )
+        self.refresh_lag = LocalGauge(
+            prefix + "refresh_lag_seconds",
+            "Delay of last refresher cycle start",
+            registry=registry,
+        )
+        self.collect_duration = LocalGauge(
+            prefix + "collect_duration_seconds",
+            "Duration of last collect of metric",
+            labelnames=["metric"],
+            registry=registry,
+        )
+        self.series = LocalGauge(
+            prefix + "series",
+            "Count of series of metric in last collect",
+            labelnames=["metric"],
+            registry=registry,
+        )
+
+    def observe_refresh(self, duration: float, lag: float):
+        self.refresh_duration.observe(duration)
+        self.refresh_lag.set(lag)
+
+    def observe_collect(self, metric, duration: float, series: int):
+        if isinstance(metric, LocalMetric):
+            return
+        labels = {"metric": metric.name}
+        self.collect_duration.set(duration, labels=labels)
+        self.series.set(series, labels=labels)
@@ -0,0 +1,203 @@
+"""
+Reading of metric groups and journal of changed series.
+
+Journal is a Redis set per metric group and time interval with members which
+were written (added to group or removed from it) in this interval. Exporter keeps
+snapshot of series values and reads only series changed since previous output.
+"""
+import time
+import threading
+
+from redis.exceptions import WatchError
+
+
+MGET_CHUNK = 10000
+
+
+def read_members(redis, members: list, command: str = 'get') -> list:
+    """Return values of keys by `get` (MGET in chunks) or `hgetall` in one pipeline."""
+    if not members:
+        return []
+    pipeline = redis.pipeline(transaction=False)
+    if command == 'get':
+        for start in range(0, len(members), MGET_CHUNK):
+            pipeline.mget(members[start:start + MGET_CHUNK])
+        return [value for chunk in pipeline.execute() for value in chunk]
+    for member in members:
+        getattr(pipeline, command)(member)
+    return pipeline.execute()
+
+
+def read_expires(redis, members: list) -> list:
+    """Return milliseconds to expire of keys in one pipeline (-1 without expire, -2 for missing key)."""
+    if not members:
+        return []
+    pipeline = redis.pipeline(transaction=False)
+    for member in members:
+        pipeline.pttl(member)
+    return pipeline.execute()
+
+
+def read_group(redis, group_key: str, command: str = 'get') -> (list, list):
+    """Return list of (member, value) of metric group and list of members without value."""
+    members = list(redis.smembers(group_key))
+    result, missing = [], []
+    for member, value in zip(members, read_members(redis, members, command)):
+        if value:
+            result.append((member, value))
+        else:
+            missing.append(member)
+    return result, missing
+
+
+def remove_missing(redis, group_key: str, members: list, keys: list = None):
+    """
+    Remove members without keys from group. Keys are checked again in transaction,
+    because replica may be behind. If some key is created meanwhile then nothing is removed.
+    :param keys: list of keys for every member, member is key itself by default.
+    """
+    keys = keys or [[member] for member in members]
+    with redis.pipeline() as pipeline:
+        try:
+            pipeline.watch(*[key for member_keys in keys for key in member_keys])
+            missing = [
+                member for member, member_keys in zip(members, keys)
+                if not pipeline.exists(*member_keys)
+            ]
+            if not missing:
+                return
+            pipeline.multi()
+            pipeline.srem(group_key, *missing)
+            pipeline.execute()
+        except WatchError:
+            pass
+
+
+class Journal(object):
+    """Add members of group changes to journal set of current interval."""
+
+    default_interval = 15
+    default_keep_intervals = 8
+
+    def __init__(self, interval: float = default_interval, keep_intervals: int = default_keep_intervals):
+        """
+        :param interval: seconds of one journal set.
+        :param keep_intervals: count of intervals while journal set is stored in Redis.
+        """
+        if interval <= 0 or keep_intervals < 3:
+            raise ValueError("interval should be positive and keep_intervals should be at least 3")
+        self.interval = interval
+        self.keep_intervals = keep_intervals
+
+    def current_number(self) -> int:
+        return int(time.time() // self.interval)
+
+    def get_journal_key(self, group_key, number: int) -> str:
+        if isinstance(group_key, bytes):
+            group_key = group_key.decode('utf-8')
+        return "{}_journal:{}".format(group_key, number)
+
+    def annotate(self, commands: list) -> list:
+        """Return commands with journal commands for `sadd` and `srem` of groups."""
+        changed = {}
+        for command in commands:
+            if command[0] in ('sadd', 'srem'):
+                changed.setdefault(command[1], set()).update(command[2:])
+        if not changed:
+            return commands
+
+        number = self.current_number()
+        expire = int(self.interval * self.keep_intervals) + 1
+        result = list(commands)
+        for group_key, members in changed.items():
+            journal_key = self.get_journal_key(group_key, number)
+            result.append(('sadd', journal_key) + tuple(members))
+            result.append(('expire', journal_key, expire))
+        return result
+
+
+class _GroupSnapshot(object):
+    __slots__ = ('lock', 'values', 'expires', 'number', 'synced_at')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        # member -> monotonic time of key expire
+        self.expires = {}
+        self.number = None
+        self.synced_at = None
+
+    def read_expires(self, redis, members: list, now: float):
+        for member, ttl in zip(members, read_expires(redis, members)):
+            if ttl >= 0:
+                self.expires[member] = now + ttl / 1000
+            elif ttl == -2:
+                # removed after value was read, check it on next read
+                self.expires[member] = now
+            else:
+                self.expires.pop(member, None)
+
+
+class JournalSnapshot(object):
+    """
+    Values of metric groups which are updated by journal.
+    Group is read fully on first read, when journal is expired and every `full_resync` seconds.
+    Keys removed by Redis expire are not written to journal, so they are read again
+    when they should expire.
+    """
+
+    default_full_resync = 300
+
+    def __init__(self, registry, journal: Journal, full_resync: float = default_full_resync):
+        self.registry = registry
+        self.journal = journal
+        self.full_resync = full_resync
+        self._lock = threading.Lock()
+        self._groups = {}
+
+    def _get_group(self, group_key: str, command: str) -> _GroupSnapshot:
+        with self._lock:
+            group = self._groups.get((group_key, command))
+            if group is None:
+                group = self._groups[(group_key, command)] = _GroupSnapshot()
+            return group
+
+    def read_group(self, group_key: str, command: str = 'get') -> list:
+        redis = self.registry.read_redis or self.registry.redis
+        group = self._get_group(group_key, command)
+        with group.lock:
+            number = self.journal.current_number()
+            now = time.monotonic()
+            if (
+                group.number is None
+                or number - group.number >= self.journal.keep_intervals - 1
+                or now - group.synced_at >= self.full_resync
+            ):
+                values, missing = read_group(redis, group_key, command)
+                group.values = dict(values)
+                group.expires = {}
+                group.read_expires(redis, list(group.values), now)
+                group.synced_at = now
+            else:
+                # previous interval too, because clocks of hosts differ
+                changed = set(redis.sunion([
+                    self.journal.get_journal_key(group_key, n)
+                    for n in range(group.number - 1, number + 1)
+                ]))
+                changed.update(member for member, expire in group.expires.items() if expire <= now)
+                changed = list(changed)
+                missing, present = [], []
+                for member, value in zip(changed, read_members(redis, changed, command)):
+                    if value:
+                        group.values[member] = value
+                        present.append(member)
+                    else:
+                        group.values.pop(member, None)
+                        group.expires.pop(member, None)
+                        missing.append(member)
+                group.read_expires(redis, present, now)
+            group.number = number
+            values = list(group.values.items())
+        if missing:
+            self.registry.remove_missing(group_key, missing)
+        return values
@@ -0,0 +1,121 @@
+"""
+Metrics which store values in process memory.
+
+Used for client self instrumentation: they do not make Redis requests
+and represent values of current process only.
+"""
+import bisect
+import threading
+
+from prometheus_redis_client.base_metric import BaseMetric, MetricRepresentation
+
+
+class LocalMetric(BaseMetric):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.values = {}
+        self._function = None
+
+    def set_function(self, func: callable):
+        """Calculate value by `func` on collect. Works for metric without labels."""
+        self._function = func
+
+    @staticmethod
+    def labels_key(labels: dict) -> tuple:
+        return tuple(sorted(labels.items()))
+
+    def _labels_key(self, labels: dict) -> tuple:
+        labels = labels or {}
+        self._check_labels(labels)
+        return self.labels_key(labels)
+
+    def collect(self) -> list:
+        if self._function is not None:
+            return [MetricRepresentation(self.name, {}, self._function())]
+        with self.lock:
+            values = list(self.values.items())
+        return [
+            MetricRepresentation(
+                name=self.name,
+                labels=dict(key),
+                value=value,
+            ) for key, value in values
+        ]
+
+    def cleanup(self):
+        pass
+
+    def reset_after_fork(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+
+class LocalCounter(LocalMetric):
+    type = 'counter'
+    wrapped_functions_names = ['inc', ]
+
+    def inc(self, value=1, labels: dict = None):
+        key = self._labels_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+
+class LocalGauge(LocalMetric):
+    type = 'gauge'
+    wrapped_functions_names = ['inc', 'dec', 'set', ]
+
+    def set(self, value, labels: dict = None):
+        key = self._labels_key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, value=1, labels: dict = None):
+        key = self._labels_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def dec(self, value=1, labels: dict = None):
+        self.inc(-value, labels=labels)
+
+
+class LocalHistogram(LocalMetric):
+    type = 'histogram'
+    wrapped_functions_names = ['observe', ]
+
+    default_buckets = (
+        .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10,
+    )
+
+    def __init__(self, *args, buckets: list = default_buckets, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value: float, labels: dict = None):
+        key = self._labels_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # counts of buckets, +Inf bucket and sum
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def collect(self) -> list:
+        with self.lock:
+            values = [(key, list(counts)) for key, counts in self.values.items()]
+
+        result = []
+        for key, counts in values:
+            labels = dict(key)
+            passed = 0
+            for bucket, count in zip(list(self.buckets) + ["+Inf"], counts):
+                passed += count
+                result.append(MetricRepresentation(
+                    self.name + "_bucket", dict(labels, le=bucket), passed,
+                ))
+            result.append(MetricRepresentation(self.name + "_count", labels, passed))
+            result.append(MetricRepresentation(self.name + "_sum", labels, counts[-1]))
+        return result
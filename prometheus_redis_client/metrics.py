@@ -1,41 +1,228 @@
+import os
 import copy
 import json
+import math
+import time
+import socket
+import bisect
+import random
 import collections
 import threading
 from functools import partial
 
 from prometheus_redis_client.base_metric import BaseMetric, MetricRepresentation, silent_wrapper
-from prometheus_redis_client.helpers import timeit
+from prometheus_redis_client.helpers import Timer
 from prometheus_redis_client.registry import Registry, REGISTRY
+from prometheus_redis_client.sketch import DDSketch
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 DEFAULT_GAUGE_INDEX_KEY = 'GLOBAL_GAUGE_INDEX'
+# count of members removed in one pipeline by `clear`
+CLEAR_CHUNK = 1000
+
+_random = random.random
+
+
+def prepare_values(values):
+    """
+    Return sorted values and sum of values.
+    Use numpy if it installed, so numpy arrays are not copied to python lists.
+    """
+    if numpy is not None:
+        sorted_values = numpy.sort(numpy.asarray(values, dtype=float).ravel())
+        return sorted_values, float(sorted_values.sum())
+    sorted_values = sorted(float(v) for v in values)
+    return sorted_values, sum(sorted_values)
+
+
+def count_less_or_equal(sorted_values, bounds: list) -> list:
+    """For each bound return count of values less or equal it."""
+    if numpy is not None:
+        return numpy.searchsorted(sorted_values, bounds, side='right').tolist()
+    return [bisect.bisect_right(sorted_values, b) for b in bounds]
 
 
 class Metric(BaseMetric):
 
     def collect(self) -> list:
-        redis = self.registry.redis
-        group_key = self.get_metric_group_key()
-        members = redis.smembers(group_key)
-
         result = []
-        for metric_key in members:
+        labels_cache = {}
+        for metric_key, value in self.registry.read_group(self.get_metric_group_key()):
             name, packed_labels = self.parse_metric_key(metric_key)
-            labels = self.unpack_labels(packed_labels)
-            value = redis.get(metric_key)
-            if value is None:
-                redis.srem(group_key, metric_key)
-                continue
+            labels, labels_str = self.collect_labels(packed_labels, labels_cache)
             result.append(MetricRepresentation(
                 name=name,
                 labels=labels,
                 value=value.decode('utf-8'),
+                labels_str=labels_str,
             ))
+        self._labels_cache = labels_cache
         return result
 
+    def get_group_keys(self) -> list:
+        """Keys of all groups of metric."""
+        return [self.get_metric_group_key()]
+
+    def series_members(self, labels: dict) -> list:
+        """Return list of (group key, members) of series with labels."""
+        return [(self.get_metric_group_key(), [self.get_metric_key(labels)])]
+
+    def member_keys(self, group_key: str, member: str) -> list:
+        """Keys with values of group member."""
+        return [member]
+
+    def remove(self, *labelvalues):
+        """Remove series with label values (in order of `labelnames`) from Redis."""
+        labels = dict(zip(self.labelnames, labelvalues))
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError("Expect values of labels: {}".format(", ".join(self.labelnames)))
+        return self._remove(labels)
+
+    @silent_wrapper
+    def _remove(self, labels: dict):
+        self.forget_series(labels)
+        pipeline = self.registry.pipeline()
+        for group_key, members in self.series_members(labels):
+            self._delete_members(pipeline, group_key, members)
+        return pipeline.execute()
+
+    def clear(self):
+        """Remove all series of metric from Redis."""
+        return self._clear()
+
+    @silent_wrapper
+    def _clear(self):
+        self.forget_series(None)
+        for group_key in self.get_group_keys():
+            members = [m.decode('utf-8') for m in self.registry.redis.smembers(group_key)]
+            for start in range(0, len(members), CLEAR_CHUNK):
+                pipeline = self.registry.pipeline()
+                self._delete_members(pipeline, group_key, members[start:start + CLEAR_CHUNK])
+                pipeline.execute()
+
+    def _delete_members(self, pipeline, group_key: str, members: list):
+        if not members:
+            return
+        # srem (not delete of group) is written to journal
+        pipeline.srem(group_key, *members)
+        pipeline.delete(*[key for member in members for key in self.member_keys(group_key, member)])
+
+    def forget_series(self, labels):
+        """Forget local state of series with labels (of all series if labels is None)."""
+
     def cleanup(self):
         pass
 
+    def reset_after_fork(self):
+        """Forget state of parent process. Called in child process after fork."""
+        pass
+
+
+class IdleExpireMixin(object):
+    """
+    Remove series which are not written `idle_expire` seconds.
+
+    Expire of series keys is refreshed at most once per `idle_expire / 4` for series,
+    so series is removed after `idle_expire` - `idle_expire * 1.25` seconds without writes.
+    Expired keys are removed from group set on collect.
+    """
+
+    min_expire_times_size = 1024
+
+    def __init__(self, *args, idle_expire: float = None, **kwargs):
+        if idle_expire is not None and idle_expire <= 0:
+            raise ValueError("idle_expire should be positive")
+        super().__init__(*args, **kwargs)
+        self.idle_expire = idle_expire
+        self._expire_lock = threading.Lock()
+        # series -> monotonic time of last expire refresh
+        self._expire_times = {}
+        self._expire_times_limit = self.min_expire_times_size
+
+    def _should_expire(self, series: str) -> bool:
+        if self.idle_expire is None:
+            return False
+        now = time.monotonic()
+        interval = self.idle_expire / 4
+        with self._expire_lock:
+            last = self._expire_times.get(series)
+            if last is not None and now - last < interval:
+                return False
+            self._expire_times[series] = now
+            if len(self._expire_times) > self._expire_times_limit:
+                self._expire_times = {
+                    key: t for key, t in self._expire_times.items() if now - t < interval
+                }
+                self._expire_times_limit = max(self.min_expire_times_size, 2 * len(self._expire_times))
+        return True
+
+    def forget_series(self, labels):
+        # so expire is set again for series created after remove
+        with self._expire_lock:
+            if labels is None:
+                self._expire_times = {}
+            else:
+                # series is throttled by metric key or key of sum
+                self._expire_times.pop(self.get_metric_key(labels), None)
+                self._expire_times.pop(self.get_metric_key(labels, '_sum'), None)
+        super().forget_series(labels)
+
+    def _expire_keys(self, pipeline, *keys):
+        ttl = int(math.ceil(self.idle_expire * 1.25))
+        for key in keys:
+            pipeline.expire(key, ttl)
+
+
+class SamplingMixin(object):
+    """
+    Record only random `sample_rate` part of observations. Recorded observation is counted
+    with weight 1 / sample_rate, so counts, sums and buckets are unbiased estimates.
+    Weight is rounded to integer randomly, so counts stay integer.
+    """
+
+    def __init__(self, *args, sample_rate: float = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.set_sample_rate(sample_rate)
+
+    def set_sample_rate(self, sample_rate: float = None):
+        """Change sample rate at runtime, None for record all observations."""
+        if sample_rate is not None and not 0 < sample_rate <= 1:
+            raise ValueError("sample_rate should be in (0, 1]")
+        self.sample_rate = None if sample_rate is None or sample_rate == 1 else float(sample_rate)
+
+    def _sample_weight(self) -> int:
+        """Return count of observations which observation represents, 0 if it is skipped."""
+        sample_rate = self.sample_rate
+        if sample_rate is None:
+            return 1
+        if _random() >= sample_rate:
+            return 0
+        weight = 1 / sample_rate
+        whole = int(weight)
+        if whole == weight:
+            return whole
+        return whole + (_random() < weight - whole)
+
+
+class TimerMixin(object):
+    """Timing of code for metrics with `observe` method."""
+
+    def time(self, labels: dict = None) -> Timer:
+        """
+        Return timer for use as context manager or decorator (of function or coroutine function).
+        Labels are checked once, so timer of fixed series is cheap on each call.
+        """
+        labels = labels or {}
+        self._check_labels(labels)
+        return Timer(partial(self._observe_checked, labels=labels))
+
+    def timeit(self, **labels) -> Timer:
+        return self.time(labels)
+
 
 class CommonGauge(Metric):
     """Just simple store some value in one key from all processes."""
@@ -70,7 +257,7 @@ class CommonGauge(Metric):
         group_key = self.get_metric_group_key()
         metric_key = self.get_metric_key(labels)
 
-        pipeline = self.registry.redis.pipeline()
+        pipeline = self.registry.pipeline()
         pipeline.sadd(group_key, metric_key)
         pipeline.set(metric_key, value, ex=expire)
         return pipeline.execute()
@@ -89,7 +276,7 @@ class CommonGauge(Metric):
     def _inc(self, value: float, labels: dict, expire: float = None):
         group_key = self.get_metric_group_key()
         metric_key = self.get_metric_key(labels)
-        pipeline = self.registry.redis.pipeline()
+        pipeline = self.registry.pipeline()
         pipeline.sadd(group_key, metric_key)
         pipeline.incrbyfloat(metric_key, float(value))
         if expire:
@@ -97,7 +284,7 @@ class CommonGauge(Metric):
         return pipeline.execute()[1]
 
 
-class Counter(Metric):
+class Counter(IdleExpireMixin, Metric):
     type = 'counter'
     wrapped_functions_names = ['inc', 'set']
 
@@ -120,9 +307,11 @@ class Counter(Metric):
         group_key = self.get_metric_group_key()
         metric_key = self.get_metric_key(labels)
 
-        pipeline = self.registry.redis.pipeline()
+        pipeline = self.registry.pipeline()
         pipeline.sadd(group_key, metric_key)
         pipeline.incrby(metric_key, int(value))
+        if self._should_expire(metric_key):
+            self._expire_keys(pipeline, metric_key)
         return pipeline.execute()[1]
 
     def set(self, value: int = 1, labels=None):
@@ -144,59 +333,357 @@ class Counter(Metric):
         group_key = self.get_metric_group_key()
         metric_key = self.get_metric_key(labels)
 
-        pipeline = self.registry.redis.pipeline()
+        pipeline = self.registry.pipeline()
         pipeline.sadd(group_key, metric_key)
         pipeline.set(metric_key, int(value))
+        if self.idle_expire is not None:
+            # SET removes expire of key
+            self._should_expire(metric_key)
+            self._expire_keys(pipeline, metric_key)
         return pipeline.execute()[1]
 
 
-class Summary(Metric):
+class Summary(SamplingMixin, TimerMixin, IdleExpireMixin, Metric):
     type = 'summary'
-    wrapped_functions_names = ['observe', ]
+    wrapped_functions_names = ['observe', 'observe_many', 'time', ]
+
+    default_relative_accuracy = 0.01
+    default_window_slices = 5
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args,
+                 quantiles: list = None,
+                 relative_accuracy: float = default_relative_accuracy,
+                 window: float = None,
+                 window_slices: int = default_window_slices,
+                 **kwargs):
+        """
+        Construct Summary metric.
+        :param quantiles: list of quantiles (0 <= q <= 1) for calculate. Observations
+        store in per-process sketch and merge to Redis by registry refresher.
+        :param relative_accuracy: relative accuracy of quantiles values.
+        Should be same for all processes.
+        :param window: if set then summary represent only observations of last `window` seconds.
+        Observations store in `window_slices` Redis keys with expire.
+        :param window_slices: count of time slices in window.
+        :param idle_expire: remove series which are not observed `idle_expire` seconds.
+        :param sample_rate: record only this random part of `observe` calls (`observe_many` records all values).
+        """
+        for q in quantiles or []:
+            if not 0 <= q <= 1:
+                raise ValueError("Quantile should be between 0 and 1, got {}".format(q))
+        if window is not None and (window <= 0 or window_slices < 1):
+            raise ValueError("window and window_slices should be positive")
         super().__init__(*args, **kwargs)
-        self.timeit = partial(timeit, metric_callback=self.observe)
+        if 'quantile' in self.labelnames:
+            raise ValueError("'quantile' label is reserved for Summary")
+        self.quantiles = sorted(quantiles or [])
+        self.relative_accuracy = relative_accuracy
+        self.window = window
+        self.window_slices = window_slices
+        self.lock = threading.Lock()
+        self._sketches = {}
+        self._refresher_added = False
+
+    @property
+    def slice_duration(self) -> float:
+        return self.window / self.window_slices
+
+    def get_sketch_group_key(self):
+        return "{}_sketch_group".format(self.name)
+
+    def get_window_group_key(self):
+        return "{}_window_group".format(self.name)
+
+    def get_slice_key(self, window_key: str, slice_number: int):
+        return "{}:{}".format(window_key, slice_number)
+
+    def current_slice(self) -> int:
+        return int(time.time() // self.slice_duration)
 
     def observe(self, value, labels=None):
         labels = labels or {}
         self._check_labels(labels)
-        print('DEBUG:', value, labels)
-        return self._observer(value, labels)
+        return self._observe_checked(value, labels)
+
+    def _observe_checked(self, value, labels: dict):
+        weight = self._sample_weight()
+        if not weight:
+            return
+        if self.window:
+            # sketch and sum of observation come to same slice
+            slice_number = self.current_slice()
+            if self.quantiles:
+                self._observe_sketch([value], labels, weight, slice_number)
+            return self._window_observer(value * weight, labels, slice_number, count=weight)
+        if self.quantiles:
+            self._observe_sketch([value], labels, weight)
+        return self._observer(value * weight, labels, count=weight)
+
+    def observe_many(self, values, labels=None):
+        """Observe iterable (or numpy array) of values with one Redis request."""
+        labels = labels or {}
+        self._check_labels(labels)
+        sorted_values, values_sum = prepare_values(values)
+        if len(sorted_values) == 0:
+            return
+        if self.window:
+            slice_number = self.current_slice()
+            if self.quantiles:
+                self._observe_sketch(sorted_values, labels, 1, slice_number)
+            return self._window_observer(values_sum, labels, slice_number, count=len(sorted_values))
+        if self.quantiles:
+            self._observe_sketch(sorted_values, labels)
+        return self._observer(values_sum, labels, count=len(sorted_values))
 
     @silent_wrapper
-    def _observer(self, value, labels: dict):
+    def _observer(self, value, labels: dict, count: int = 1):
         group_key = self.get_metric_group_key()
         sum_metric_key = self.get_metric_key(labels, "_sum")
         count_metric_key = self.get_metric_key(labels, "_count")
 
-        pipeline = self.registry.redis.pipeline()
+        pipeline = self.registry.pipeline()
         pipeline.sadd(group_key, count_metric_key, sum_metric_key)
         pipeline.incrbyfloat(sum_metric_key, float(value))
-        pipeline.incr(count_metric_key)
+        pipeline.incr(count_metric_key, count)
+        if self._should_expire(sum_metric_key):
+            self._expire_keys(pipeline, sum_metric_key, count_metric_key)
         return pipeline.execute()[1]
 
+    @silent_wrapper
+    def _window_observer(self, value, labels: dict, slice_number: int, count: int = 1):
+        window_key = self.get_metric_key(labels, "_window")
+        slice_key = self.get_slice_key(window_key, slice_number)
+
+        pipeline = self.registry.pipeline()
+        pipeline.sadd(self.get_window_group_key(), window_key)
+        pipeline.hincrbyfloat(slice_key, 'sum', float(value))
+        pipeline.hincrby(slice_key, 'count', count)
+        pipeline.expire(slice_key, self._slice_expire())
+        return pipeline.execute()[1]
+
+    def _slice_expire(self) -> int:
+        # slice should live while it is in window
+        return int(math.ceil(self.window + self.slice_duration))
+
+    def _observe_sketch(self, values, labels: dict, count: int = 1, slice_number: int = None):
+        """Add values to local sketch, in window mode sketches are kept per slice."""
+        if self.window:
+            sketch_key = (self.get_metric_key(labels, "_window"), slice_number)
+        else:
+            sketch_key = self.get_metric_key(labels, "_sketch")
+        with self.lock:
+            sketch = self._sketches.get(sketch_key)
+            if sketch is None:
+                sketch = self._sketches[sketch_key] = DDSketch(self.relative_accuracy)
+            for value in values:
+                sketch.add(float(value), count)
+        if not self._refresher_added:
+            self._refresher_added = True
+            self.registry.refresher.add_refresh_function(self.flush)
+
+    def get_group_keys(self) -> list:
+        return [self.get_metric_group_key(), self.get_sketch_group_key(), self.get_window_group_key()]
+
+    def series_members(self, labels: dict) -> list:
+        if self.window:
+            return [(self.get_window_group_key(), [self.get_metric_key(labels, "_window")])]
+        result = [(self.get_metric_group_key(), [
+            self.get_metric_key(labels, "_sum"), self.get_metric_key(labels, "_count"),
+        ])]
+        if self.quantiles:
+            result.append((self.get_sketch_group_key(), [self.get_metric_key(labels, "_sketch")]))
+        return result
+
+    def member_keys(self, group_key: str, member: str) -> list:
+        if group_key != self.get_window_group_key():
+            return [member]
+        current_slice = self.current_slice()
+        return [
+            self.get_slice_key(member, n)
+            for n in range(current_slice - self.window_slices, current_slice + 1)
+        ]
+
+    def forget_series(self, labels):
+        with self.lock:
+            if labels is None:
+                self._sketches = {}
+            elif self.window:
+                window_key = self.get_metric_key(labels, "_window")
+                self._sketches = {
+                    key: sketch for key, sketch in self._sketches.items() if key[0] != window_key
+                }
+            else:
+                self._sketches.pop(self.get_metric_key(labels, "_sketch"), None)
+        super().forget_series(labels)
+
+    def on_unregister(self):
+        self.registry.refresher.remove_refresh_function(self.flush)
+        self._refresher_added = False
+        self.flush()
+
+    def reset_after_fork(self):
+        # sketches of parent are merged by parent
+        self.lock = threading.Lock()
+        self._sketches = {}
+        self._refresher_added = False
+
+    @silent_wrapper
+    def flush(self):
+        """Merge local sketches to Redis."""
+        with self.lock:
+            sketches, self._sketches = self._sketches, {}
+        if not sketches:
+            return
+        pipeline = self.registry.pipeline()
+        if self.window:
+            pipeline.sadd(self.get_window_group_key(), *{window_key for window_key, _ in sketches})
+        else:
+            pipeline.sadd(self.get_sketch_group_key(), *sketches.keys())
+        for sketch_key, sketch in sketches.items():
+            if self.window:
+                # sketch is merged to slice of its observations
+                sketch_key = self.get_slice_key(*sketch_key)
+            for field, count in sketch.bins.items():
+                pipeline.hincrby(sketch_key, field, count)
+            if self.window:
+                pipeline.expire(sketch_key, self._slice_expire())
+            elif self.idle_expire is not None:
+                # flush is made once per refresh period, so expire is not throttled
+                self._expire_keys(pipeline, sketch_key)
+        return pipeline.execute()
+
+    def collect(self) -> list:
+        if self.window:
+            return self._collect_window()
+        result = super().collect()
+        if self.quantiles:
+            result += self._collect_quantiles()
+        return result
+
+    def _quantile_representations(self, labels: dict, sketch: DDSketch) -> list:
+        return [
+            MetricRepresentation(
+                name=self.name,
+                labels=dict(labels, quantile=q),
+                value=value,
+            ) for q, value in zip(self.quantiles, sketch.quantiles(self.quantiles))
+        ]
+
+    def _collect_quantiles(self) -> list:
+        result = []
+        for sketch_key, fields in self.registry.read_group(self.get_sketch_group_key(), 'hgetall'):
+            _, packed_labels = self.parse_metric_key(sketch_key)
+            sketch = DDSketch(self.relative_accuracy)
+            sketch.merge_fields(fields)
+            result += self._quantile_representations(
+                self.unpack_labels(packed_labels), sketch,
+            )
+        return result
+
+    def _collect_window(self) -> list:
+        """Merge live slices of every labels set."""
+        redis = self.registry.read_redis or self.registry.redis
+        group_key = self.get_window_group_key()
+        current_slice = self.current_slice()
+        live_slices = range(current_slice - self.window_slices + 1, current_slice + 1)
+
+        result, missing, missing_keys = [], [], []
+        for window_key in redis.smembers(group_key):
+            window_key = window_key.decode('utf-8')
+            pipeline = redis.pipeline()
+            for slice_number in live_slices:
+                pipeline.hgetall(self.get_slice_key(window_key, slice_number))
+            slices = [fields for fields in pipeline.execute() if fields]
+            if not slices:
+                missing.append(window_key)
+                missing_keys.append([self.get_slice_key(window_key, n) for n in live_slices])
+                continue
+
+            sum_value, count_value = 0.0, 0
+            sketch = DDSketch(self.relative_accuracy)
+            for fields in slices:
+                sum_value += float(fields.pop(b'sum', 0))
+                count_value += int(fields.pop(b'count', 0))
+                sketch.merge_fields(fields)
+
+            _, packed_labels = window_key.split(':', maxsplit=1)
+            labels = self.unpack_labels(packed_labels)
+            result.append(MetricRepresentation(
+                name=self.name + "_sum", labels=labels, value=sum_value,
+            ))
+            result.append(MetricRepresentation(
+                name=self.name + "_count", labels=labels, value=count_value,
+            ))
+            if self.quantiles:
+                result += self._quantile_representations(labels, sketch)
+        if missing:
+            self.registry.remove_missing(group_key, missing, missing_keys)
+        return result
+
+    def cleanup(self):
+        self.flush()
+
+
+class _GaugeValue(object):
+    """Local value of one gauge series and operations not sent to Redis yet."""
+    __slots__ = ('value', 'pending', 'writing')
+
+    def __init__(self):
+        self.value = 0.0
+        # list of ('set', value) and ('inc', value), in order of calls
+        self.pending = []
+        # only one thread sends operations of series, so they come to Redis in order
+        self.writing = False
+
+    def change(self, operation: str, value: float):
+        if operation == 'set':
+            self.value = value
+            self.pending = [(operation, value)]
+        else:
+            self.value += value
+            if self.pending and self.pending[-1][0] == 'inc':
+                self.pending[-1] = ('inc', self.pending[-1][1] + value)
+            else:
+                self.pending.append((operation, value))
+
 
 class Gauge(Metric):
     type = 'gauge'
-    wrapped_functions_names = ['inc', 'set', ]
+    wrapped_functions_names = ['inc', 'dec', 'set', 'local_inc', ]
 
     default_expire = 60
+    default_lock_shards = 16
 
     def __init__(self, *args,
                  expire=default_expire,
                  refresh_enable=True,
                  gauge_index_key: str = DEFAULT_GAUGE_INDEX_KEY,
+                 lock_shards: int = default_lock_shards,
+                 max_series: int = None,
                  **kwargs):
+        """
+        :param lock_shards: count of locks for local values.
+        Redis requests are sent outside of locks.
+        :param max_series: max count of series in local state of process. Least recently
+        changed series is removed from local state, it is not refreshed and expires in Redis.
+        """
+        if max_series is not None and max_series < 1:
+            raise ValueError("max_series should be positive")
         super().__init__(*args, **kwargs)
         self.gauge_index_key = gauge_index_key
         self.refresh_enable = refresh_enable
+        self.max_series = max_series
         self._refresher_added = False
-        self.lock = threading.Lock()
-        self.gauge_values = collections.defaultdict(lambda: 0.0)
+        self._index_lock = threading.Lock()
+        self._lru_lock = threading.Lock()
+        self._locks = [threading.Lock() for _ in range(lock_shards)]
+        self.gauge_values = self._make_values()
         self.expire = expire
         self.index = None
 
+    def _make_values(self) -> dict:
+        return collections.OrderedDict() if self.max_series else {}
+
     def add_refresher(self):
         if self.refresh_enable and not self._refresher_added:
             self.registry.refresher.add_refresh_function(
@@ -204,11 +691,29 @@ class Gauge(Metric):
             )
             self._refresher_added = True
 
-    def _set_internal(self, key: str, value: float):
-        self.gauge_values[key] = value
+    def _lock_for(self, key: str) -> threading.Lock:
+        return self._locks[hash(key) % len(self._locks)]
+
+    def _get_value(self, labels: dict) -> (str, _GaugeValue):
+        labels = dict(labels, gauge_index=self.get_gauge_index())
+        metric_key = self.get_metric_key(labels)
+        if self.max_series:
+            return metric_key, self._get_lru_value(metric_key)
+        state = self.gauge_values.get(metric_key)
+        if state is None:
+            state = self.gauge_values.setdefault(metric_key, _GaugeValue())
+        return metric_key, state
 
-    def _inc_internal(self, key: str, value: float):
-        self.gauge_values[key] += value
+    def _get_lru_value(self, metric_key: str) -> _GaugeValue:
+        with self._lru_lock:
+            state = self.gauge_values.get(metric_key)
+            if state is not None:
+                self.gauge_values.move_to_end(metric_key)
+                return state
+            state = self.gauge_values[metric_key] = _GaugeValue()
+            while len(self.gauge_values) > self.max_series:
+                self.gauge_values.popitem(last=False)
+            return state
 
     def inc(self, value: float, labels: dict = None):
         labels = labels or {}
@@ -220,112 +725,279 @@ class Gauge(Metric):
         self._check_labels(labels)
         return self._inc(-value, labels)
 
-    @silent_wrapper
     def _inc(self, value: float, labels: dict):
-        with self.lock:
-            group_key = self.get_metric_group_key()
-            labels['gauge_index'] = self.get_gauge_index()
-            metric_key = self.get_metric_key(labels)
+        return self._change('inc', float(value), labels, send=True)
 
-            pipeline = self.registry.redis.pipeline()
-            pipeline.sadd(group_key, metric_key)
-            pipeline.incrbyfloat(metric_key, float(value))
-            pipeline.expire(metric_key, self.expire)
-            self._inc_internal(metric_key, float(value))
-            result = pipeline.execute()
-
-        self.add_refresher()
-        return result
+    def local_inc(self, value: float, labels: dict = None):
+        """
+        Change local value without Redis request. It is sent with next write
+        of series (in same process) or by refresher.
+        """
+        labels = labels or {}
+        self._check_labels(labels)
+        self._change('inc', float(value), labels, send=False)
 
     def set(self, value: float, labels:dict = None):
         labels = labels or {}
         self._check_labels(labels)
         return self._set(value, labels)
 
-    @silent_wrapper
     def _set(self, value: float, labels: dict):
-        with self.lock:
-            group_key = self.get_metric_group_key()
-            labels['gauge_index'] = self.get_gauge_index()
-            metric_key = self.get_metric_key(labels)
-
-            pipeline = self.registry.redis.pipeline()
-            pipeline.sadd(group_key, metric_key)
-            pipeline.set(
-                metric_key,
-                float(value),
-                ex=self.expire,
-            )
-            self._set_internal(metric_key, float(value))
-            result = pipeline.execute()
+        return self._change('set', float(value), labels, send=True)
+
+    def _change(self, operation: str, value: float, labels: dict, send: bool):
+        """
+        Change local value even if circuit breaker is open,
+        so it is sent by refresher when Redis is available again.
+        """
+        if self.index is None and self._init_index() is None:
+            return
+        metric_key, state = self._get_value(labels)
+        with self._lock_for(metric_key):
+            state.change(operation, value)
         self.add_refresher()
-        return result
+        if send:
+            return self._send(metric_key, state)
+
+    @silent_wrapper
+    def _init_index(self):
+        return self.get_gauge_index()
+
+    @silent_wrapper
+    def _send(self, metric_key: str, state: _GaugeValue):
+        """Send pending operations of series if other thread does not send them."""
+        with self._lock_for(metric_key):
+            if state.writing:
+                return
+            state.writing = True
+        return self._write(metric_key, state)
+
+    def _write(self, metric_key: str, state: _GaugeValue):
+        """
+        Send pending operations of series while other threads add them.
+        Redis requests are made outside of lock.
+        """
+        lock = self._lock_for(metric_key)
+        group_key = self.get_metric_group_key()
+        result = None
+        try:
+            while True:
+                with lock:
+                    operations, state.pending = state.pending, []
+                    if not operations:
+                        state.writing = False
+                        return result
+                pipeline = self.registry.pipeline()
+                pipeline.sadd(group_key, metric_key)
+                for operation, value in operations:
+                    if operation == 'set':
+                        pipeline.set(metric_key, value, ex=self.expire)
+                    else:
+                        pipeline.incrbyfloat(metric_key, value)
+                        pipeline.expire(metric_key, self.expire)
+                result = pipeline.execute()
+        except BaseException:
+            # local value is sent by next refresh
+            with lock:
+                state.writing = False
+            raise
+
+    def reset_index(self):
+        """Forget gauge index and values of parent process, so child process gets own series."""
+        self._index_lock = threading.Lock()
+        self._locks = [threading.Lock() for _ in self._locks]
+        self.gauge_values = self._make_values()
+        self.index = None
+        self._refresher_added = False
+
+    def reset_after_fork(self):
+        self.reset_index()
+
+    def on_unregister(self):
+        self.registry.refresher.remove_refresh_function(self.refresh_values)
+        self._refresher_added = False
 
     def get_gauge_index(self):
         if self.index is None:
-            self.index = self.make_gauge_index()
+            with self._index_lock:
+                if self.index is None:
+                    self.index = self.make_gauge_index()
         return self.index
 
     def make_gauge_index(self):
-        index = self.registry.redis.incr(
-            self.gauge_index_key,
-        )
+        if self.registry.redis is None:
+            # registry sends writes to agent, index is unique without Redis
+            index = "{}:{}".format(socket.gethostname(), os.getpid())
+        else:
+            index = self.registry.redis.incr(
+                self.gauge_index_key,
+            )
         self.registry.refresher.add_refresh_function(
             self.refresh_values,
         )
         return index
 
+    @silent_wrapper
     def refresh_values(self):
-        with self.lock:
-            for key, value in self.gauge_values.items():
-                self.registry.redis.set(
-                    key, value, ex=self.expire,
-                )
+        """Send all local values in one pipeline. Series which are sent by other threads are skipped."""
+        claimed = []
+        for key, state in list(self.gauge_values.items()):
+            with self._lock_for(key):
+                if state.writing:
+                    continue
+                state.writing = True
+                state.pending = []
+                claimed.append((key, state, state.value))
+        if not claimed:
+            return
 
-    def cleanup(self):
-        with self.lock:
-            group_key = self.get_metric_group_key()
-            keys = list(self.gauge_values.keys())
-            if len(keys) == 0:
-                return
-            pipeline = self.registry.redis.pipeline()
-            pipeline.srem(group_key, *keys)
-            pipeline.delete(*keys)
+        try:
+            pipeline = self.registry.pipeline()
+            pipeline.sadd(self.get_metric_group_key(), *[key for key, _, _ in claimed])
+            for key, _, value in claimed:
+                pipeline.set(key, value, ex=self.expire)
             pipeline.execute()
+        except BaseException:
+            for key, state, _ in claimed:
+                with self._lock_for(key):
+                    state.writing = False
+            raise
+
+        changed = []
+        for key, state, _ in claimed:
+            with self._lock_for(key):
+                if state.pending:
+                    changed.append((key, state))
+                else:
+                    state.writing = False
+        # operations added while refresh, their callers have not sent them
+        for key, state in changed:
+            self._write(key, state)
 
+    def series_members(self, labels: dict) -> list:
+        # series of other processes are refreshed by them
+        if self.index is None:
+            return []
+        return super().series_members(dict(labels, gauge_index=self.index))
 
-class Histogram(Metric):
+    def forget_series(self, labels):
+        if labels is None:
+            self.gauge_values = self._make_values()
+        elif self.index is not None:
+            with self._lru_lock:
+                self.gauge_values.pop(self.get_metric_key(dict(labels, gauge_index=self.index)), None)
+
+    @silent_wrapper
+    def _clear(self):
+        """Remove series of current process."""
+        keys = list(self.gauge_values.keys())
+        self.forget_series(None)
+        pipeline = self.registry.pipeline()
+        self._delete_members(pipeline, self.get_metric_group_key(), keys)
+        return pipeline.execute()
+
+    def cleanup(self):
+        group_key = self.get_metric_group_key()
+        keys = list(self.gauge_values.keys())
+        if len(keys) == 0:
+            return
+        pipeline = self.registry.pipeline()
+        pipeline.srem(group_key, *keys)
+        pipeline.delete(*keys)
+        pipeline.execute()
+
+
+class Histogram(SamplingMixin, TimerMixin, IdleExpireMixin, Metric):
     type = 'histogram'
-    wrapped_functions_names = ['observe', ]
+    wrapped_functions_names = ['observe', 'observe_many', 'time', ]
 
     def __init__(self, *args, buckets: list, **kwargs):
         super().__init__(*args, **kwargs)
         self.buckets = sorted(buckets, reverse=True)
-        self.timeit = partial(timeit, metric_callback=self.observe)
 
     def observe(self, value, labels=None):
         labels = labels or {}
         self._check_labels(labels)
-        return self._a_observe(value, labels)
+        return self._observe_checked(value, labels)
+
+    def _observe_checked(self, value, labels: dict):
+        if self.sample_rate is None:
+            return self._a_observe(value, labels)
+        weight = self._sample_weight()
+        if not weight:
+            return
+        return self._observe_many(
+            {bucket: weight for bucket in self.buckets if value <= bucket},
+            float(value) * weight, weight, labels,
+        )
 
     @silent_wrapper
     def _a_observe(self, value: float, labels):
         group_key = self.get_metric_group_key()
         sum_key = self.get_metric_key(labels, '_sum')
         counter_key = self.get_metric_key(labels, '_count')
-        pipeleine = self.registry.redis.pipeline()
+        pipeleine = self.registry.pipeline()
         for bucket in self.buckets:
             if value > bucket:
                 break
-            labels['le'] = bucket
-            bucket_key = self.get_metric_key(labels, '_bucket')
+            bucket_key = self.get_metric_key(dict(labels, le=bucket), '_bucket')
             pipeleine.sadd(group_key, bucket_key)
             pipeleine.incr(bucket_key)
         pipeleine.sadd(group_key, sum_key, counter_key)
         pipeleine.incr(counter_key)
         pipeleine.incrbyfloat(sum_key, float(value))
+        self._expire_series(pipeleine, labels, sum_key, counter_key)
         return pipeleine.execute()
 
+    def observe_many(self, values, labels=None):
+        """Observe iterable (or numpy array) of values with one Redis request."""
+        labels = labels or {}
+        self._check_labels(labels)
+        sorted_values, values_sum = prepare_values(values)
+        if len(sorted_values) == 0:
+            return
+        buckets = self.buckets[::-1]
+        counts = count_less_or_equal(sorted_values, buckets)
+        return self._observe_many(
+            dict(zip(buckets, counts)), values_sum, len(sorted_values), labels,
+        )
+
+    @silent_wrapper
+    def _observe_many(self, bucket_counts: dict, values_sum: float, count: int, labels: dict):
+        group_key = self.get_metric_group_key()
+        sum_key = self.get_metric_key(labels, '_sum')
+        counter_key = self.get_metric_key(labels, '_count')
+        pipeline = self.registry.pipeline()
+        for bucket, bucket_count in bucket_counts.items():
+            if bucket_count == 0:
+                continue
+            bucket_key = self.get_metric_key(dict(labels, le=bucket), '_bucket')
+            pipeline.sadd(group_key, bucket_key)
+            pipeline.incr(bucket_key, bucket_count)
+        pipeline.sadd(group_key, sum_key, counter_key)
+        pipeline.incr(counter_key, count)
+        pipeline.incrbyfloat(sum_key, values_sum)
+        self._expire_series(pipeline, labels, sum_key, counter_key)
+        return pipeline.execute()
+
+    def series_members(self, labels: dict) -> list:
+        return [(self.get_metric_group_key(), [
+            self.get_metric_key(labels, '_sum'), self.get_metric_key(labels, '_count'),
+        ] + [
+            self.get_metric_key(dict(labels, le=bucket), '_bucket') for bucket in self.buckets
+        ])]
+
+    def _expire_series(self, pipeline, labels: dict, sum_key: str, counter_key: str):
+        if not self._should_expire(sum_key):
+            return
+        bucket_keys = [
+            self.get_metric_key(dict(labels, le=bucket), '_bucket') for bucket in self.buckets
+        ]
+        for bucket_key in bucket_keys:
+            # create empty buckets, so all keys of series expire together
+            pipeline.incr(bucket_key, 0)
+        self._expire_keys(pipeline, sum_key, counter_key, *bucket_keys)
+
     def _get_missing_metric_values(self, redis_metric_values):
         missing_metrics_values = set(
             json.dumps({"le": b}) for b in self.buckets
@@ -385,3 +1057,181 @@ class Histogram(Metric):
             )
 
         return redis_metrics + missing_values
+
+
+class ExponentialHistogram(SamplingMixin, TimerMixin, IdleExpireMixin, Metric):
+    """
+    Histogram with exponential buckets computed from observed value.
+
+    Bucket `i` contains values from (base ** (i - 1), base ** i], where base = 2 ** (2 ** -schema).
+    Only non empty buckets are stored in one Redis hash for labels set.
+    At collect time buckets are rendered as classic `le` buckets with `render_schema` resolution.
+    """
+
+    type = 'histogram'
+    wrapped_functions_names = ['observe', 'observe_many', 'time', ]
+
+    min_schema = -4
+    max_schema = 8
+    default_schema = 3
+
+    def __init__(self, *args,
+                 schema: int = default_schema,
+                 render_schema: int = None,
+                 zero_threshold: float = 0.0,
+                 **kwargs):
+        """
+        Construct ExponentialHistogram metric.
+        :param schema: resolution of stored buckets, from -4 to 8. Each power of 2
+        is divided into 2 ** schema buckets.
+        :param render_schema: resolution of `le` buckets in output, should be less or equal `schema`.
+        :param zero_threshold: values with absolute value less or equal it are counted in zero bucket.
+        :param sample_rate: record only this random part of `observe` calls (`observe_many` records all values).
+        """
+        if render_schema is None:
+            render_schema = schema
+        for s in (schema, render_schema):
+            if not self.min_schema <= s <= self.max_schema:
+                raise ValueError("Schema should be between {} and {}, got {}".format(
+                    self.min_schema, self.max_schema, s,
+                ))
+        if render_schema > schema:
+            raise ValueError("render_schema can not be greater than schema")
+        super().__init__(*args, **kwargs)
+        if 'le' in self.labelnames:
+            raise ValueError("'le' label is reserved for Histogram")
+        self.schema = schema
+        self.render_schema = render_schema
+        self.zero_threshold = zero_threshold
+        self._scale = 2 ** schema
+
+    def bucket_field(self, value: float) -> str:
+        """
+        Positive bucket `pN` contains values in (base ** (N - 1), base ** N],
+        negative bucket `nN` contains values in (-base ** N, -base ** (N - 1)],
+        so upper edges of buckets are inclusive like `le` of output.
+        """
+        if abs(value) <= self.zero_threshold:
+            return 'z'
+        if value > 0:
+            return 'p' + str(int(math.ceil(math.log2(value) * self._scale)))
+        return 'n' + str(int(math.floor(math.log2(-value) * self._scale)) + 1)
+
+    def observe(self, value, labels=None):
+        labels = labels or {}
+        self._check_labels(labels)
+        return self._observe_checked(value, labels)
+
+    def _observe_checked(self, value, labels: dict):
+        value = float(value)
+        if not math.isfinite(value):
+            # infinite value and NaN have no bucket
+            return
+        if self.sample_rate is None:
+            return self._observe(value, labels)
+        weight = self._sample_weight()
+        if not weight:
+            return
+        return self._observe_many({self.bucket_field(value): weight}, value * weight, weight, labels)
+
+    @silent_wrapper
+    def _observe(self, value: float, labels: dict):
+        metric_key = self.get_metric_key(labels)
+        pipeline = self.registry.pipeline()
+        pipeline.sadd(self.get_metric_group_key(), metric_key)
+        pipeline.hincrby(metric_key, self.bucket_field(value), 1)
+        pipeline.hincrbyfloat(metric_key, 'sum', value)
+        pipeline.hincrby(metric_key, 'count', 1)
+        if self._should_expire(metric_key):
+            self._expire_keys(pipeline, metric_key)
+        return pipeline.execute()
+
+    def observe_many(self, values, labels=None):
+        """Observe iterable (or numpy array) of values with one Redis request."""
+        labels = labels or {}
+        self._check_labels(labels)
+        sorted_values, values_sum = prepare_values(values)
+        if not math.isfinite(values_sum):
+            # skip infinite values and NaN like `observe`
+            sorted_values = [value for value in sorted_values if math.isfinite(value)]
+            values_sum = float(sum(sorted_values))
+        if len(sorted_values) == 0:
+            return
+        bucket_counts = collections.Counter(
+            self.bucket_field(value) for value in sorted_values
+        )
+        return self._observe_many(bucket_counts, values_sum, len(sorted_values), labels)
+
+    @silent_wrapper
+    def _observe_many(self, bucket_counts: dict, values_sum: float, count: int, labels: dict):
+        metric_key = self.get_metric_key(labels)
+        pipeline = self.registry.pipeline()
+        pipeline.sadd(self.get_metric_group_key(), metric_key)
+        for field, bucket_count in bucket_counts.items():
+            pipeline.hincrby(metric_key, field, bucket_count)
+        pipeline.hincrbyfloat(metric_key, 'sum', values_sum)
+        pipeline.hincrby(metric_key, 'count', count)
+        if self._should_expire(metric_key):
+            self._expire_keys(pipeline, metric_key)
+        return pipeline.execute()
+
+    def _render_buckets(self, fields: dict) -> list:
+        """Return list of (le, cumulative count) pairs for stored buckets."""
+        factor = 2 ** (self.schema - self.render_schema)
+        base = 2 ** (2.0 ** -self.render_schema)
+        zero, positive, negative = 0, collections.Counter(), collections.Counter()
+        for field, count in fields.items():
+            if field == 'z':
+                zero += count
+                continue
+            # downscale index: ceil(index / factor)
+            index = -(-int(field[1:]) // factor)
+            if field[0] == 'p':
+                positive[index] += count
+            else:
+                negative[index] += count
+
+        buckets, passed = [], 0
+        for index in sorted(negative, reverse=True):
+            passed += negative[index]
+            buckets.append((-base ** (index - 1), passed))
+        if zero or not (negative or positive):
+            passed += zero
+            buckets.append((self.zero_threshold, passed))
+        for index in sorted(positive):
+            passed += positive[index]
+            buckets.append((base ** index, passed))
+        return buckets
+
+    def collect(self) -> list:
+        result = []
+        for metric_key, raw_fields in self.registry.read_group(self.get_metric_group_key(), 'hgetall'):
+            fields = {
+                key.decode('utf-8'): value for key, value in raw_fields.items()
+            }
+            sum_value = fields.pop('sum', b'0').decode('utf-8')
+            count_value = int(fields.pop('count', 0))
+            _, packed_labels = self.parse_metric_key(metric_key)
+            labels = self.unpack_labels(packed_labels)
+
+            buckets = self._render_buckets({
+                field: int(value) for field, value in fields.items()
+            })
+            for le, count in buckets:
+                result.append(MetricRepresentation(
+                    name=self.name + "_bucket",
+                    labels=dict(labels, le=le),
+                    value=count,
+                ))
+            result.append(MetricRepresentation(
+                name=self.name + "_bucket",
+                labels=dict(labels, le="+Inf"),
+                value=count_value,
+            ))
+            result.append(MetricRepresentation(
+                name=self.name + "_sum", labels=labels, value=sum_value,
+            ))
+            result.append(MetricRepresentation(
+                name=self.name + "_count", labels=labels, value=count_value,
+            ))
+        return result
@@ -0,0 +1,195 @@
+"""
+WSGI and ASGI middleware with metrics of HTTP requests.
+
+Increment of requests in progress is sent at the start of request,
+other metric writes of request are sent in one pipeline at the end of request.
+Middleware also serves metrics of registry on `metrics_path`.
+"""
+import asyncio
+import threading
+import time
+
+from prometheus_redis_client.helpers import perf_counter_ns
+from prometheus_redis_client.metrics import Counter, Gauge, Histogram
+from prometheus_redis_client.registry import REGISTRY, Registry
+
+
+UNKNOWN_ROUTE = 'unknown'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def wsgi_route(environ: dict) -> str:
+    """Route template of Flask (werkzeug) request."""
+    request = environ.get('werkzeug.request')
+    rule = getattr(request, 'url_rule', None)
+    return getattr(rule, 'rule', None) or UNKNOWN_ROUTE
+
+
+def asgi_route(scope: dict) -> str:
+    """Route template of Starlette request."""
+    route = scope.get('route')
+    return getattr(route, 'path', None) or UNKNOWN_ROUTE
+
+
+class RequestMetrics(object):
+    """Metrics of HTTP requests and cached output of registry."""
+
+    default_buckets = (
+        .005, .01, .025, .05, .075, .1, .25, .5, .75, 1, 2.5, 5, 7.5, 10,
+    )
+
+    def __init__(self, registry: Registry = REGISTRY, prefix: str = 'http',
+                 buckets: list = default_buckets, metrics_path: str = '/metrics',
+                 cache_ttl: float = 1):
+        """
+        :param prefix: prefix of metric names.
+        :param metrics_path: path of metrics endpoint, None for disable endpoint.
+        :param cache_ttl: seconds while output of registry is cached.
+        """
+        self.registry = registry
+        self.metrics_path = metrics_path
+        self.cache_ttl = cache_ttl
+        self.requests = Counter(
+            prefix + '_requests_total', 'Count of HTTP requests',
+            labelnames=['method', 'route', 'status'], registry=registry,
+        )
+        self.latency = Histogram(
+            prefix + '_request_duration_seconds', 'Duration of HTTP requests',
+            labelnames=['method', 'route'], buckets=buckets, registry=registry,
+        )
+        self.in_progress = Gauge(
+            prefix + '_requests_in_progress', 'Count of HTTP requests in progress',
+            labelnames=['method'], registry=registry,
+        )
+        self._cache_lock = threading.Lock()
+        self._cache = (0, b'')
+
+    def start(self, method: str) -> int:
+        self.in_progress.inc(1, labels={'method': method})
+        return perf_counter_ns()
+
+    def finish(self, start: int, method: str, route: str, status: int):
+        duration = (perf_counter_ns() - start) / 1e9
+        with self.registry.batch():
+            self.requests.inc(labels={'method': method, 'route': route, 'status': str(status)})
+            self.latency.observe(duration, labels={'method': method, 'route': route})
+            self.in_progress.dec(1, labels={'method': method})
+
+    def output(self) -> bytes:
+        """Output of registry, cached for `cache_ttl` seconds."""
+        with self._cache_lock:
+            created, body = self._cache
+            if time.monotonic() - created >= self.cache_ttl:
+                body = self.registry.output().encode('utf-8')
+                self._cache = (time.monotonic(), body)
+            return body
+
+
+class WSGIMiddleware(object):
+
+    def __init__(self, app, route_resolver=wsgi_route, **kwargs):
+        """
+        :param route_resolver: function(environ) which return route template.
+        It is called after application, so route matched by framework can be used.
+        :param kwargs: arguments of `RequestMetrics`.
+        """
+        self.app = app
+        self.route_resolver = route_resolver
+        self.metrics = RequestMetrics(**kwargs)
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') == self.metrics.metrics_path:
+            body = self.metrics.output()
+            start_response('200 OK', [
+                ('Content-Type', CONTENT_TYPE),
+                ('Content-Length', str(len(body))),
+            ])
+            return [body]
+
+        method = environ.get('REQUEST_METHOD', 'GET')
+        start = self.metrics.start(method)
+        status = [500]
+
+        def metric_start_response(status_line, headers, exc_info=None):
+            status[0] = int(status_line.split(' ', 1)[0])
+            return start_response(status_line, headers, exc_info)
+
+        def finish():
+            self.metrics.finish(start, method, self.route_resolver(environ), status[0])
+
+        try:
+            result = self.app(environ, metric_start_response)
+        except BaseException:
+            finish()
+            raise
+        return _ClosingIterator(result, finish)
+
+
+class _ClosingIterator(object):
+    """Call `callback` after response body is sent (on close)."""
+
+    def __init__(self, iterable, callback):
+        self.iterable = iterable
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.callback()
+
+
+class ASGIMiddleware(object):
+
+    def __init__(self, app, route_resolver=asgi_route, **kwargs):
+        """
+        :param route_resolver: function(scope) which return route template.
+        It is called after application, so route matched by framework can be used.
+        :param kwargs: arguments of `RequestMetrics`.
+
+        Redis requests are made in default executor, unless registry has background writer.
+        """
+        self.app = app
+        self.route_resolver = route_resolver
+        self.metrics = RequestMetrics(**kwargs)
+
+    async def _run(self, func, *args):
+        if self.metrics.registry.writer is not None:
+            return func(*args)
+        return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        if scope.get('path') == self.metrics.metrics_path:
+            body = await self._run(self.metrics.output)
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', CONTENT_TYPE.encode('utf-8')),
+                    (b'content-length', str(len(body)).encode('utf-8')),
+                ],
+            })
+            await send({'type': 'http.response.body', 'body': body})
+            return
+
+        method = scope.get('method', 'GET')
+        start = await self._run(self.metrics.start, method)
+        status = 500
+
+        async def metric_send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, metric_send)
+        finally:
+            await self._run(self.metrics.finish, start, method, self.route_resolver(scope), status)
@@ -0,0 +1,137 @@
+"""Deferred pipelines which record metric write commands."""
+import json
+import collections
+
+
+DEFAULT_STREAM = 'prometheus_redis_client_stream'
+
+
+class DeferredPipeline(object):
+    """
+    Pipeline-like object which record Redis commands.
+
+    Command is a tuple `(command_name, key, *args)` which can be replayed
+    on real Redis pipeline. On `execute` recorded commands are passed to `callback`.
+    """
+    __slots__ = ('commands', 'callback')
+
+    def __init__(self, callback):
+        self.commands = []
+        self.callback = callback
+
+    def __len__(self):
+        return len(self.commands)
+
+    def sadd(self, name, *values):
+        self.commands.append(('sadd', name) + values)
+
+    def srem(self, name, *values):
+        self.commands.append(('srem', name) + values)
+
+    def delete(self, *names):
+        self.commands.append(('delete', ) + names)
+
+    def set(self, name, value, ex=None):
+        self.commands.append(('set', name, value, ex))
+
+    def expire(self, name, time):
+        self.commands.append(('expire', name, time))
+
+    def incr(self, name, amount: int = 1):
+        self.incrby(name, amount)
+
+    def incrby(self, name, amount: int = 1):
+        self.commands.append(('incrby', name, amount))
+
+    def incrbyfloat(self, name, amount: float = 1.0):
+        self.commands.append(('incrbyfloat', name, amount))
+
+    def hincrby(self, name, key, amount: int = 1):
+        self.commands.append(('hincrby', name, key, amount))
+
+    def hincrbyfloat(self, name, key, amount: float = 1.0):
+        self.commands.append(('hincrbyfloat', name, key, amount))
+
+    def execute(self):
+        return self.callback(self.commands)
+
+
+def replay(commands, pipeline):
+    """Put recorded commands to Redis pipeline."""
+    for command in commands:
+        getattr(pipeline, command[0])(*command[1:])
+    return pipeline
+
+
+def encode_commands(commands: list) -> str:
+    """Pack commands to compact string for Redis Stream entry."""
+    return json.dumps(commands, separators=(',', ':'))
+
+
+def decode_commands(data) -> list:
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return [tuple(command) for command in json.loads(data)]
+
+
+class CommandBuffer(object):
+    """
+    Collect commands of many metric operations and merge them.
+
+    Increments of same key (or hash field) are summed, `sadd` to same set are
+    joined and last `expire` of key wins. Other commands (`set`, `srem`, `delete`)
+    stop merging for their keys, so the result is same as sequential execution.
+    """
+
+    key_merged_commands = ('incrby', 'incrbyfloat', 'expire', 'sadd')
+    field_merged_commands = ('hincrby', 'hincrbyfloat')
+
+    def __init__(self):
+        self.commands = []
+        self._slots = {}
+        self._key_slots = collections.defaultdict(list)
+        self._members = {}
+
+    def __len__(self):
+        return len(self.commands)
+
+    def extend(self, commands: list) -> list:
+        for command in commands:
+            self.add(command)
+        return [None] * len(commands)
+
+    def add(self, command: tuple):
+        name = command[0]
+        if name in self.key_merged_commands:
+            slot = command[:2]
+        elif name in self.field_merged_commands:
+            slot = command[:3]
+        else:
+            keys = command[1:] if name == 'delete' else command[1:2]
+            for key in keys:
+                self._invalidate(key)
+            self.commands.append(command)
+            return
+
+        index = self._slots.get(slot)
+        if index is None:
+            self._slots[slot] = len(self.commands)
+            self._key_slots[command[1]].append(slot)
+            if name == 'sadd':
+                self._members[len(self.commands)] = set(command[2:])
+            self.commands.append(command)
+        elif name == 'sadd':
+            members = self._members[index]
+            new_members = tuple(m for m in command[2:] if m not in members)
+            if new_members:
+                members.update(new_members)
+                self.commands[index] += new_members
+        elif name == 'expire':
+            self.commands[index] = command
+        else:
+            merged = self.commands[index]
+            self.commands[index] = merged[:-1] + (merged[-1] + command[-1], )
+
+    def _invalidate(self, key):
+        for slot in self._key_slots.pop(key, ()):
+            del self._slots[slot]
@@ -1,8 +1,19 @@
+import os
 import time
+import logging
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 from redis import StrictRedis
 
+from prometheus_redis_client.circuit_breaker import CircuitBreaker
+from prometheus_redis_client.journal import Journal, JournalSnapshot, read_group, remove_missing
+from prometheus_redis_client.pipeline import CommandBuffer, DeferredPipeline, encode_commands, replay
+
+
+logger = logging.getLogger(__name__)
+
 
 class Refresher(object):
 
@@ -13,6 +24,8 @@ class Refresher(object):
         self._start_thread_lock = threading.Lock()
         self.refresh_period = refresh_period
         self.timeout_granule = timeout_granule
+        # callback(duration, lag) called after each refresh cycle
+        self.on_cycle = None
         self._clean()
 
     def _clean(self):
@@ -26,6 +39,10 @@ class Refresher(object):
             self._refresh_functions.append(func)
         self.start_if_not()
 
+    def remove_refresh_function(self, func: callable):
+        with self._refresh_functions_lock:
+            self._refresh_functions = [f for f in self._refresh_functions if f != func]
+
     def start_if_not(self):
         with self._start_thread_lock:
             if self._refresh_enable:
@@ -39,70 +56,420 @@ class Refresher(object):
             self._refresh_cycle_thread.join()
         self._clean()
 
+    def reset_after_fork(self):
+        """Forget refresh functions and thread of parent process."""
+        self._refresh_functions_lock = threading.Lock()
+        self._start_thread_lock = threading.Lock()
+        self._clean()
+
     def refresh_cycle(self):
         """Check `close` flag every `timeout_granule` and refresh after `refresh_period`."""
         current_time_passed = 0
+        scheduled_time = time.monotonic() + self.refresh_period
         while True:
             current_time_passed += self.timeout_granule
             if self._should_be_close:
                 return
             if current_time_passed >= self.refresh_period:
                 current_time_passed = 0
+                start_time = time.monotonic()
                 with self._refresh_functions_lock:
 
                     for refresh_func in self._refresh_functions:
                         refresh_func()
+                finish_time = time.monotonic()
+                if self.on_cycle is not None:
+                    self.on_cycle(finish_time - start_time, max(start_time - scheduled_time, 0))
+                scheduled_time = finish_time + self.refresh_period
             time.sleep(self.timeout_granule)
 
 
 class Registry(object):
 
-    def __init__(self, redis: StrictRedis = None, refresher: Refresher = None):
-        self._metrics = []
+    def __init__(self, redis: StrictRedis = None, refresher: Refresher = None, writer=None,
+                 circuit_breaker: CircuitBreaker = None, instrumentation: bool = False,
+                 stream: str = None, collect_workers: int = None, read_redis: StrictRedis = None):
+        """
+        :param circuit_breaker: skip writes while Redis is unavailable.
+        By default CircuitBreaker with default settings is used.
+        :param instrumentation: export metrics about client work (stored in process memory).
+        :param stream: append write commands to this Redis Stream instead of
+        metric keys. Commands are applied by `prometheus_redis_client.aggregator`.
+        :param collect_workers: collect metrics in `output` concurrently by this count of threads.
+        :param read_redis: client of Redis replica for `output`. Writes are sent to `redis`.
+        """
+        # name -> metric, in order of registration
+        self._metrics = {}
+        self._metrics_lock = threading.RLock()
+        self._local = threading.local()
         self.redis = None
-        self.refresher = refresher or Refresher()
+        self.read_redis = read_redis
+        self.writer = None
+        self.instrumentation = None
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.refresher = None
+        self.stream = None
+        self.stream_maxlen = None
+        self.set_stream(stream)
+        self.journal = None
+        self.snapshot = None
+        self.collect_workers = None
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+        self.set_collect_workers(collect_workers)
+        self.set_refresher(refresher or Refresher())
         self.set_redis(redis)
+        self.set_writer(writer)
+        if instrumentation:
+            self.enable_instrumentation()
 
     def output(self) -> str:
         all_metric = []
-        for metric in self._metrics:
-            all_metric.append(metric.doc_string())
-            ms = metric.collect()
-            all_metric += sorted([
-                p for p in ms
-            ], key=lambda x: x.output())
-        return "\n".join((
-            m.output() for m in all_metric
-        ))
+        with self._metrics_lock:
+            metrics = list(self._metrics.values())
+        executor = self._get_executor() if len(metrics) > 1 else None
+        if executor is not None:
+            collected = executor.map(self._collect, metrics)
+        else:
+            collected = map(self._collect, metrics)
+        for metric, ms in zip(metrics, collected):
+            all_metric.append(metric.doc_string().output())
+            all_metric += sorted([p.output() for p in ms])
+        return "\n".join(all_metric)
+
+    def _collect(self, metric) -> list:
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            return metric.collect()
+        start = time.perf_counter()
+        ms = metric.collect()
+        instrumentation.observe_collect(metric, time.perf_counter() - start, len(ms))
+        return ms
+
+    def read_group(self, group_key: str, command: str = 'get') -> list:
+        """
+        Return list of (member, value) of metric group, values are read by `command`.
+        Members without value are removed from group.
+        """
+        if self.snapshot is not None:
+            return self.snapshot.read_group(group_key, command)
+        values, missing = read_group(self.read_redis or self.redis, group_key, command)
+        if missing:
+            self.remove_missing(group_key, missing)
+        return values
+
+    def remove_missing(self, group_key: str, members: list, keys: list = None):
+        """
+        Remove members without keys from group on primary Redis.
+        Keys are checked on primary if values were read from replica.
+        """
+        if self.read_redis is None:
+            self.redis.srem(group_key, *members)
+        else:
+            remove_missing(self.redis, group_key, members, keys)
+
+    def _get_executor(self):
+        """Return thread pool for collect. It is created again in forked process."""
+        if not self.collect_workers:
+            return None
+        with self._executor_lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    self.collect_workers, thread_name_prefix='prometheus_redis_client_collect',
+                )
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def set_collect_workers(self, collect_workers: int):
+        """
+        Collect metrics in `output` concurrently by `collect_workers` threads,
+        Redis connection pool is shared by threads. Set None for sequential collect.
+        """
+        with self._executor_lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=False)
+            self._executor = None
+            self.collect_workers = collect_workers if collect_workers and collect_workers > 1 else None
 
     def add_metric(self, *metrics):
-        already_added = set([
-            m.name for m in self._metrics
-        ])
-        new_metrics = set([
-            m.name for m in metrics
-        ])
-        doubles = already_added.intersection(new_metrics)
-        if doubles:
-            raise ValueError("Metrics {} already added".format(
-                ", ".join(doubles),
+        with self._metrics_lock:
+            doubles = [m.name for m in metrics if m.name in self._metrics]
+            if doubles:
+                raise ValueError("Metrics {} already added".format(
+                    ", ".join(doubles),
+                ))
+
+            for m in metrics:
+                self._metrics[m.name] = m
+
+    def get(self, name: str):
+        """Return registered metric by name or None."""
+        return self._metrics.get(name)
+
+    def get_or_create(self, cls, name: str, documentation: str, labelnames: list = None, **kwargs):
+        """
+        Return registered metric with `name` or create it. Thread safe.
+        :raise ValueError: metric with `name` has other type or label names.
+        """
+        with self._metrics_lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                return cls(name, documentation, labelnames, registry=self, **kwargs)
+        if type(metric) is not cls or list(metric.labelnames) != list(labelnames or []):
+            raise ValueError("Metric {} already added with type {} and labels {}".format(
+                name, type(metric).__name__, ", ".join(metric.labelnames),
             ))
+        return metric
 
+    def unregister(self, *metrics):
+        """
+        Remove metrics from registry, they are not exported and refreshed anymore.
+        Series of metrics stay in Redis.
+        """
+        with self._metrics_lock:
+            for m in metrics:
+                if self._metrics.get(m.name) is m:
+                    del self._metrics[m.name]
         for m in metrics:
-            self._metrics.append(m)
+            m.on_unregister()
+
+    def scope(self, namespace: str) -> 'RegistryScope':
+        """Return scope of registry where metric names are prefixed by `namespace`."""
+        return RegistryScope(self, namespace)
+
+    def pipeline(self) -> DeferredPipeline:
+        """Return pipeline for metric write commands."""
+        batch = getattr(self._local, 'batch', None)
+        if batch is not None:
+            return DeferredPipeline(batch.extend)
+        return DeferredPipeline(self.execute_commands)
+
+    def execute_commands(self, commands: list) -> list:
+        """Send commands to Redis or put them to background writer queue."""
+        if self.writer is not None:
+            self.writer.put(commands)
+            return [None] * len(commands)
+        return self.send_commands(commands)
+
+    def send_commands(self, commands: list) -> list:
+        """Write commands to Redis and report result to circuit breaker."""
+        instrumentation = self.instrumentation
+        breaker = self.circuit_breaker
+        if instrumentation is not None:
+            instrumentation.pipeline_commands.observe(len(commands))
+        try:
+            pipeline = self.redis.pipeline()
+            if self.journal is not None and self.stream is None:
+                commands = self.journal.annotate(commands)
+            if self.stream is not None:
+                pipeline.xadd(self.stream, {'c': encode_commands(commands)}, maxlen=self.stream_maxlen)
+                pipeline.execute()
+                result = [None] * len(commands)
+            else:
+                replay(commands, pipeline)
+                result = pipeline.execute()
+        except Exception as e:
+            if breaker is not None and isinstance(e, breaker.failure_exceptions):
+                breaker.failure()
+            if instrumentation is not None:
+                instrumentation.write_errors.inc()
+            raise
+        if breaker is not None:
+            breaker.success()
+        return result
+
+    @contextmanager
+    def batch(self):
+        """
+        Collect write commands of all metrics in current thread
+        and execute them in one pipeline on exit.
+        Can be used as decorator. Nested batches are joined with outer batch.
+        """
+        if getattr(self._local, 'batch', None) is not None:
+            yield self._local.batch
+            return
+        buffer = self._local.batch = CommandBuffer()
+        try:
+            yield buffer
+        finally:
+            self._local.batch = None
+            if buffer:
+                if self.writer is not None:
+                    # circuit breaker is checked when writer sends commands
+                    self.writer.put(buffer.commands)
+                else:
+                    self.safe_execute(self.send_commands, buffer.commands)
+
+    def is_buffering(self) -> bool:
+        """Return True if write commands of current thread are not sent to Redis immediately."""
+        return self.writer is not None or getattr(self._local, 'batch', None) is not None
+
+    def allow_write(self) -> bool:
+        """Return False if circuit breaker skips write (takes trial write of open breaker)."""
+        return self.circuit_breaker is None or self.circuit_breaker.allow()
+
+    def safe_execute(self, func, commands: list) -> bool:
+        """
+        Call `func(commands)` if circuit breaker allows it and log errors.
+        Return False if commands are not written.
+        """
+        if not self.allow_write():
+            return False
+        return self.execute_logged(func, commands)
+
+    def execute_logged(self, func, commands: list) -> bool:
+        """Call `func(commands)` and log errors. Return False if it is failed."""
+        breaker = self.circuit_breaker
+        try:
+            func(commands)
+        except Exception:
+            suppressed = breaker.log_permit() if breaker is not None else 0
+            if suppressed is not None:
+                logger.exception(
+                    "Error while send metrics to Redis. Similar errors suppressed: %s", suppressed,
+                )
+            return False
+        return True
 
     def set_redis(self, redis):
         self.redis = redis
 
+    def set_read_redis(self, read_redis):
+        """
+        Set client of Redis replica (for example `Sentinel.slave_for(...)`) for read metrics
+        in `output`. Set None for read from `redis`.
+        """
+        self.read_redis = read_redis
+
+    def set_stream(self, stream: str, maxlen: int = None):
+        """
+        Append write commands to Redis Stream `stream`. Set None for write metric keys directly.
+        :param maxlen: approximate max length of stream, old entries are removed
+        even if aggregator has not read them.
+        """
+        self.stream = stream
+        self.stream_maxlen = maxlen
+
+    def enable_journal(self, interval: float = Journal.default_interval,
+                       keep_intervals: int = Journal.default_keep_intervals,
+                       full_resync: float = JournalSnapshot.default_full_resync):
+        """
+        Write journal of changed series and use it in `output`: only changed series are read
+        from Redis, other values are taken from snapshot of previous output.
+        All processes which write metrics should enable journal with same `interval`.
+        :param full_resync: seconds between full read of metrics.
+        """
+        self.journal = Journal(interval, keep_intervals)
+        self.snapshot = JournalSnapshot(self, self.journal, full_resync)
+
     def set_refresher(self, refresher: Refresher):
         self.refresher = refresher
+        if self.instrumentation is not None:
+            refresher.on_cycle = self.instrumentation.observe_refresh
+
+    def enable_instrumentation(self):
+        """Register metrics about client work in registry."""
+        from prometheus_redis_client.instrumentation import Instrumentation
+        if self.instrumentation is None:
+            self.instrumentation = Instrumentation(self)
+            self.refresher.on_cycle = self.instrumentation.observe_refresh
+
+    def set_circuit_breaker(self, circuit_breaker: CircuitBreaker):
+        """Set None for disable circuit breaker."""
+        self.circuit_breaker = circuit_breaker
+
+    def set_writer(self, writer):
+        """
+        Set `prometheus_redis_client.writer.BackgroundWriter` for send metrics
+        from background thread. Set None for send metrics synchronously.
+        """
+        if self.writer is not None:
+            self.writer.stop()
+            self.unregister(*self.writer.metrics)
+        self.writer = writer
+        if writer is not None:
+            writer.bind(self)
+
+    def reset_after_fork(self):
+        """
+        Call in child process after fork (for example in Celery `worker_process_init`
+        or with `os.register_at_fork(after_in_child=REGISTRY.reset_after_fork)`).
+        Child process gets own gauge indexes and refresher thread.
+        """
+        self._local = threading.local()
+        self._executor_lock = threading.Lock()
+        self._executor = None
+        if self.refresher:
+            self.refresher.reset_after_fork()
+        for metric in list(self._metrics.values()):
+            metric.reset_after_fork()
 
     def cleanup_and_stop(self):
         if self.refresher:
             self.refresher.cleanup_and_stop()
-        for metric in self._metrics:
+        for metric in list(self._metrics.values()):
             metric.cleanup()
-        self._metrics = []
+        if self.writer is not None:
+            self.writer.stop()
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.reset()
+        self.writer = None
+        self.instrumentation = None
+        self.stream = None
+        self.stream_maxlen = None
+        self.set_collect_workers(None)
+        self.journal = None
+        self.snapshot = None
+        self.read_redis = None
+        self._metrics = {}
+
+
+class RegistryScope(object):
+    """
+    Metrics of registry with names (and so Redis keys) prefixed by namespace,
+    for example metrics of one plugin or tenant. Scope tracks own metrics,
+    so they can be unregistered together.
+    """
+
+    def __init__(self, registry: Registry, namespace: str):
+        self.registry = registry
+        self.namespace = namespace
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def full_name(self, name: str) -> str:
+        return "{}_{}".format(self.namespace, name)
+
+    def get(self, name: str):
+        """Return metric of scope by name without namespace or None."""
+        return self._metrics.get(name)
+
+    def get_or_create(self, cls, name: str, documentation: str, labelnames: list = None, **kwargs):
+        metric = self.registry.get_or_create(cls, self.full_name(name), documentation, labelnames, **kwargs)
+        with self._lock:
+            self._metrics[name] = metric
+        return metric
+
+    def scope(self, namespace: str) -> 'RegistryScope':
+        """Return nested scope, its namespace is joined with namespace of this scope."""
+        return RegistryScope(self.registry, self.full_name(namespace))
+
+    def metrics(self) -> list:
+        return list(self._metrics.values())
+
+    def unregister(self, *metrics):
+        with self._lock:
+            self._metrics = {
+                name: m for name, m in self._metrics.items() if m not in metrics
+            }
+        self.registry.unregister(*metrics)
+
+    def unregister_all(self):
+        """Unregister all metrics created in scope."""
+        with self._lock:
+            metrics, self._metrics = list(self._metrics.values()), {}
+        self.registry.unregister(*metrics)
 
 
 REGISTRY = Registry()
@@ -0,0 +1,375 @@
+"""
+Per-host aggregation of metric writes in shared memory.
+
+Worker processes of host put increments of metric keys to table in mmap file
+instead of Redis. One process of host (elected by file lock) sends aggregated
+values to Redis once per `flush_interval`, so count of Redis writes depends on
+count of hosts, not count of workers:
+
+    from prometheus_redis_client import REGISTRY
+    from prometheus_redis_client.shared_memory import SharedMemoryWriter
+    REGISTRY.set_writer(SharedMemoryWriter('/dev/shm/prometheus_redis_client'))
+
+Works on POSIX systems only (`fcntl` locks).
+"""
+import os
+import json
+import mmap
+import time
+import zlib
+import fcntl
+import struct
+import logging
+import threading
+
+from prometheus_redis_client.local_metrics import LocalCounter, LocalHistogram
+from prometheus_redis_client.pipeline import CommandBuffer
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PRCSHM01'
+# magic, slots, key size, stripes
+HEADER = struct.Struct('<8sIII')
+# count of used slots of stripe
+COUNT = struct.Struct('<I')
+# state, key length, value
+SLOT = struct.Struct('<BxHd')
+FREE, USED, CLEARED = 0, 1, 2
+
+# modes of slot change
+ADD, REPLACE, CLEAR = 0, 1, 2
+
+ADD_COMMANDS = ('incrby', 'incrbyfloat', 'hincrby', 'hincrbyfloat')
+INT_COMMANDS = ('incrby', 'hincrby')
+
+
+class SharedTable(object):
+    """
+    Hash table with fixed count of slots in mmap file.
+
+    Slot contains key (JSON of command without value) and float value.
+    Slots are divided into `stripes` by hash of stripe key, every stripe has own lock:
+    `fcntl` record lock between processes and thread lock inside process.
+    Slots of one stripe key are changed atomically.
+    """
+
+    def __init__(self, path: str, slots: int, key_size: int, stripes: int):
+        self.path = path
+        self.slots_per_stripe = slots // stripes
+        self.stripes = stripes
+        self.key_size = key_size
+        self.slot_size = SLOT.size + key_size
+        self.slots_offset = HEADER.size + COUNT.size * stripes
+        self.size = self.slots_offset + self.slot_size * self.slots_per_stripe * stripes
+        # offsets of bytes locked by fcntl, they are not related to data
+        self.flush_lock_offset = stripes
+        self.election_lock_offset = stripes + 1
+        self.init_lock_offset = stripes + 2
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._flush_lock = threading.Lock()
+        self._fd = None
+        self._mmap = None
+        self._open()
+
+    def _open(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, self.init_lock_offset)
+        try:
+            created = os.fstat(self._fd).st_size == 0
+            if created:
+                os.ftruncate(self._fd, self.size)
+            self._mmap = mmap.mmap(self._fd, self.size)
+            header = HEADER.pack(MAGIC, self.slots_per_stripe * self.stripes, self.key_size, self.stripes)
+            if created:
+                self._mmap[:HEADER.size] = header
+            elif self._mmap[:HEADER.size] != header:
+                raise ValueError("File {} has table with other parameters".format(self.path))
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, self.init_lock_offset)
+
+    def close(self):
+        self._mmap.close()
+        os.close(self._fd)
+
+    def _lock(self, offset: int):
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, offset)
+
+    def _unlock(self, offset: int):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, offset)
+
+    def try_elect(self) -> bool:
+        """Take election lock if it is free. Lock is held until process exits or `resign`."""
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, self.election_lock_offset)
+        except OSError:
+            return False
+        return True
+
+    def resign(self):
+        self._unlock(self.election_lock_offset)
+
+    def put(self, stripe_key: bytes, slots: list) -> bool:
+        """
+        Change slots of stripe key: list of (key, value, mode), where mode is
+        ADD (add value to slot), REPLACE (replace value) or CLEAR (skip slot until take).
+        Return False if stripe is full, slots before the failed one are changed.
+        """
+        if any(len(key) > self.key_size for key, _, _ in slots):
+            return False
+        stripe = zlib.crc32(stripe_key) % self.stripes
+        with self._locks[stripe]:
+            self._lock(stripe)
+            try:
+                for key, value, mode in slots:
+                    if not self._put_slot(stripe, key, value, mode):
+                        return False
+                return True
+            finally:
+                self._unlock(stripe)
+
+    def _put_slot(self, stripe: int, key: bytes, value: float, mode: int) -> bool:
+        buffer = self._mmap
+        start = zlib.crc32(key) % self.slots_per_stripe
+        stripe_offset = self.slots_offset + stripe * self.slots_per_stripe * self.slot_size
+        for i in range(self.slots_per_stripe):
+            offset = stripe_offset + (start + i) % self.slots_per_stripe * self.slot_size
+            state, key_length, current = SLOT.unpack_from(buffer, offset)
+            key_offset = offset + SLOT.size
+            if state == FREE:
+                if mode == CLEAR:
+                    return True
+                SLOT.pack_into(buffer, offset, USED, len(key), value)
+                buffer[key_offset:key_offset + len(key)] = key
+                count_offset = HEADER.size + COUNT.size * stripe
+                COUNT.pack_into(buffer, count_offset, COUNT.unpack_from(buffer, count_offset)[0] + 1)
+                return True
+            if key_length == len(key) and buffer[key_offset:key_offset + key_length] == key:
+                if mode == CLEAR:
+                    SLOT.pack_into(buffer, offset, CLEARED, key_length, 0)
+                elif mode == ADD and state == USED:
+                    SLOT.pack_into(buffer, offset, USED, key_length, current + value)
+                else:
+                    SLOT.pack_into(buffer, offset, USED, key_length, value)
+                return True
+        return mode == CLEAR
+
+    def take(self) -> list:
+        """Return (key, value) of all used slots and clear table."""
+        result = []
+        buffer = self._mmap
+        stripe_size = self.slots_per_stripe * self.slot_size
+        for stripe in range(self.stripes):
+            count_offset = HEADER.size + COUNT.size * stripe
+            if not COUNT.unpack_from(buffer, count_offset)[0]:
+                continue
+            stripe_offset = self.slots_offset + stripe * stripe_size
+            with self._locks[stripe]:
+                self._lock(stripe)
+                try:
+                    for offset in range(stripe_offset, stripe_offset + stripe_size, self.slot_size):
+                        state, key_length, value = SLOT.unpack_from(buffer, offset)
+                        if state == USED:
+                            key_offset = offset + SLOT.size
+                            result.append((bytes(buffer[key_offset:key_offset + key_length]), value))
+                    buffer[stripe_offset:stripe_offset + stripe_size] = bytes(stripe_size)
+                    COUNT.pack_into(buffer, count_offset, 0)
+                finally:
+                    self._unlock(stripe)
+        return result
+
+    def lock_flush(self):
+        self._flush_lock.acquire()
+        self._lock(self.flush_lock_offset)
+
+    def unlock_flush(self):
+        self._unlock(self.flush_lock_offset)
+        self._flush_lock.release()
+
+
+def _slot_key(*parts) -> bytes:
+    return json.dumps(parts, separators=(',', ':')).encode('utf-8')
+
+
+def slot_operations(command: tuple) -> list:
+    """
+    Return list of (stripe key, slots) for command or None if it can not be aggregated.
+    Slots of Redis key are in one stripe, so `set` replaces increments before it.
+    """
+    name = command[0]
+    if name in ('incrby', 'incrbyfloat', 'expire'):
+        mode = ADD if name in ADD_COMMANDS else REPLACE
+        return [(command[1].encode('utf-8'), [(_slot_key(*command[:2]), command[2], mode)])]
+    if name in ADD_COMMANDS:
+        key = _slot_key(*command[:-1])
+        return [(key, [(key, command[-1], ADD)])]
+    if name == 'sadd':
+        return [(key, [(key, 1, REPLACE)]) for key in (_slot_key(name, command[1], m) for m in command[2:])]
+    if name == 'set':
+        _, redis_key, value, ex = command
+        return [(redis_key.encode('utf-8'), [
+            (_slot_key('incrby', redis_key), 0, CLEAR),
+            (_slot_key('incrbyfloat', redis_key), 0, CLEAR),
+            (_slot_key('expire', redis_key), 0, CLEAR) if ex is None else
+            (_slot_key('expire', redis_key), ex, REPLACE),
+            (_slot_key('set', redis_key), value, REPLACE),
+        ])]
+    return None
+
+
+def table_commands(items: list) -> list:
+    """
+    Return commands for (slot key, value) of table.
+    `set` commands are the first (increments in table are made after them), `expire` commands are the last.
+    """
+    buffer = CommandBuffer()
+    sets, expires = [], []
+    for key, value in items:
+        command = tuple(json.loads(key.decode('utf-8')))
+        if command[0] == 'set':
+            sets.append(command + (int(value) if value.is_integer() else value, None))
+        elif command[0] == 'expire':
+            expires.append(command + (int(value), ))
+        elif command[0] == 'sadd':
+            buffer.add(command)
+        else:
+            buffer.add(command + (int(value) if command[0] in INT_COMMANDS else value, ))
+    return sets + buffer.commands + expires
+
+
+class SharedMemoryWriter(object):
+    """
+    Aggregate metric writes of all processes of host in shared memory table.
+
+    Increments, `sadd`, `expire` and `set` are put to table, `set` replaces increments of key
+    before it. Other commands (`srem`, `delete` of `remove` and `clear`) are sent by process
+    itself after table flush, so they are applied in order of calls.
+    Commands which have no place in table are sent directly.
+    """
+
+    default_slots = 16384
+    default_key_size = 256
+    default_stripes = 64
+
+    def __init__(self, path: str, slots: int = default_slots, key_size: int = default_key_size,
+                 stripes: int = default_stripes, flush_interval: float = 1):
+        """
+        :param path: path of table file, it should be same for all processes of host
+        (for example in /dev/shm). Table parameters should be same too.
+        :param slots: count of slots (series, buckets and group members) in table.
+        :param key_size: max size of slot key (command name, Redis key and hash field) in bytes.
+        :param stripes: count of locks of table.
+        :param flush_interval: seconds between sending of table to Redis by elected process.
+        """
+        if stripes < 1 or slots < stripes:
+            raise ValueError("stripes should be positive and slots should be at least stripes")
+        self.path = path
+        self.slots = slots
+        self.key_size = key_size
+        self.stripes = stripes
+        self.flush_interval = flush_interval
+        self.registry = None
+        self.table = None
+        self.elected = False
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._stop_event = None
+
+    def bind(self, registry):
+        """Set registry for send commands and register writer metrics in it."""
+        self.registry = registry
+        self.direct = LocalCounter(
+            "prometheus_redis_client_shared_direct_total",
+            "Count of metric commands sent directly because shared table is full",
+            registry=registry,
+        )
+        self.flush_duration = LocalHistogram(
+            "prometheus_redis_client_shared_flush_duration_seconds",
+            "Duration of sending shared table to Redis",
+            registry=registry,
+        )
+
+    @property
+    def metrics(self) -> list:
+        return [self.direct, self.flush_duration]
+
+    def start_if_not(self):
+        """Open table and start flusher thread. Open them again in forked process."""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # fcntl locks of parent are not inherited
+            self.table = SharedTable(self.path, self.slots, self.key_size, self.stripes)
+            self.elected = False
+            self._stop_event = threading.Event()
+            self._thread = threading.Thread(target=self.flush_cycle, daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def put(self, commands: list):
+        self.start_if_not()
+        items = []
+        for command in commands:
+            operations = slot_operations(command)
+            if operations is None:
+                # order of other commands matters, send them after aggregated increments
+                self.flush(commands)
+                return
+            items.append((command, operations))
+
+        direct = []
+        for i, (command, operations) in enumerate(items):
+            for stripe_key, slots in operations:
+                if self.table.put(stripe_key, slots):
+                    continue
+                if command[0] == 'set':
+                    # increments after `set` should not come to Redis before it
+                    rest = [command for command, _ in items[i:]]
+                    self.direct.inc(len(direct) + len(rest))
+                    self.flush(direct + rest)
+                    return
+                direct.append(command)
+                break
+        if direct:
+            self.direct.inc(len(direct))
+            self.registry.safe_execute(self.registry.send_commands, direct)
+
+    def flush(self, commands: list = None):
+        """Send table to Redis (with `commands` after it) in one pipeline."""
+        self.start_if_not()
+        start = time.perf_counter()
+        self.table.lock_flush()
+        try:
+            commands = table_commands(self.table.take()) + list(commands or [])
+            if commands:
+                self.registry.safe_execute(self.registry.send_commands, commands)
+        finally:
+            self.table.unlock_flush()
+            self.flush_duration.observe(time.perf_counter() - start)
+
+    def flush_cycle(self):
+        stop_event = self._stop_event
+        while not stop_event.wait(self.flush_interval):
+            if not self.elected:
+                self.elected = self.table.try_elect()
+            if self.elected:
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Error while flush shared table %s", self.path)
+
+    def stop(self):
+        """Stop flusher thread and send table to Redis."""
+        if self._pid != os.getpid():
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self.flush()
+        if self.elected:
+            self.table.resign()
+            self.elected = False
+        self.table.close()
+        self._pid = None
@@ -0,0 +1,86 @@
+"""Mergeable quantile sketch used by Summary quantiles."""
+import math
+
+
+class DDSketch(object):
+    """
+    Quantile sketch with relative accuracy guarantee (DDSketch).
+
+    Values are mapped to logarithmic bins, so two sketches with the same
+    `relative_accuracy` merge by summing counts of equal bins. It allows to
+    store sketch in Redis hash and merge it with HINCRBY.
+    """
+
+    zero_field = 'z'
+    positive_prefix = 'p'
+    negative_prefix = 'n'
+
+    def __init__(self, relative_accuracy: float = 0.01, min_value: float = 1e-9):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy should be between 0 and 1")
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.count = 0
+
+    def __len__(self):
+        return len(self.bins)
+
+    def field(self, value: float) -> str:
+        """Return name of the bin for value."""
+        if abs(value) < self.min_value:
+            return self.zero_field
+        index = int(math.ceil(math.log(abs(value)) / self._log_gamma))
+        if value > 0:
+            return self.positive_prefix + str(index)
+        return self.negative_prefix + str(index)
+
+    def add(self, value: float, count=1):
+        field = self.field(value)
+        self.bins[field] = self.bins.get(field, 0) + count
+        self.count += count
+
+    def merge_fields(self, fields: dict):
+        """Merge bins in Redis hash format (field -> count) into sketch."""
+        for field, count in fields.items():
+            if isinstance(field, bytes):
+                field = field.decode('utf-8')
+            count = float(count)
+            if count.is_integer():
+                count = int(count)
+            self.bins[field] = self.bins.get(field, 0) + count
+            self.count += count
+
+    def _bin_value(self, field: str) -> float:
+        if field == self.zero_field:
+            return 0.0
+        value = 2 * self.gamma ** int(field[1:]) / (self.gamma + 1)
+        if field[0] == self.negative_prefix:
+            return -value
+        return value
+
+    def _ordered_bins(self):
+        return sorted(
+            self.bins.items(),
+            key=lambda item: self._bin_value(item[0]),
+        )
+
+    def quantiles(self, quantiles) -> list:
+        """Return estimates of quantiles; `None` for empty sketch."""
+        if self.count <= 0:
+            return [None for _ in quantiles]
+        ordered = self._ordered_bins()
+        result = []
+        for q in quantiles:
+            rank = q * (self.count - 1)
+            passed = 0
+            value = self._bin_value(ordered[-1][0])
+            for field, count in ordered:
+                passed += count
+                if passed > rank:
+                    value = self._bin_value(field)
+                    break
+            result.append(value)
+        return result
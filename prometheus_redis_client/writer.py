@@ -0,0 +1,177 @@
+"""Background sending of metric commands to Redis."""
+import os
+import time
+import queue
+import threading
+
+from prometheus_redis_client.local_metrics import LocalCounter, LocalGauge, LocalHistogram
+from prometheus_redis_client.pipeline import CommandBuffer
+
+
+class BackgroundWriter(object):
+    """
+    Put commands of metric operations to bounded queue.
+    Writer thread takes them from queue and send to Redis in merged pipelines.
+    """
+
+    DROP_NEWEST = 'drop_newest'
+    DROP_OLDEST = 'drop_oldest'
+    BLOCK = 'block'
+
+    overflow_policies = (DROP_NEWEST, DROP_OLDEST, BLOCK)
+
+    default_maxsize = 10000
+    default_max_batch = 1000
+
+    _stop_item = None
+
+    def __init__(self, maxsize: int = default_maxsize,
+                 overflow: str = DROP_NEWEST,
+                 max_batch: int = default_max_batch,
+                 timeout_granule: float = 1,
+                 flush_interval: float = 0):
+        """
+        :param maxsize: max count of metric operations in queue.
+        :param overflow: what to do if queue is full: 'drop_newest' (skip new operation),
+        'drop_oldest' (remove the oldest operation from queue) or 'block' (wait free place).
+        :param max_batch: max count of operations merged to one pipeline.
+        :param flush_interval: seconds to collect operations before send them in one pipeline.
+        By default operations are sent as soon as writer thread takes them.
+        """
+        if overflow not in self.overflow_policies:
+            raise ValueError("overflow should be one of: {}".format(
+                ", ".join(self.overflow_policies),
+            ))
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.max_batch = max_batch
+        self.timeout_granule = timeout_granule
+        self.flush_interval = flush_interval
+        self.registry = None
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self.queue = None
+
+    def bind(self, registry):
+        """Set registry for send commands and register writer metrics in it."""
+        self.registry = registry
+        self.queue_size = LocalGauge(
+            "prometheus_redis_client_writer_queue_size",
+            "Count of metric operations in writer queue",
+            registry=registry,
+        )
+        self.queue_size.set_function(self.qsize)
+        self.dropped = LocalCounter(
+            "prometheus_redis_client_writer_dropped_total",
+            "Count of metric operations dropped because writer queue is full or they are not sent to Redis",
+            registry=registry,
+        )
+        self.flush_duration = LocalHistogram(
+            "prometheus_redis_client_writer_flush_duration_seconds",
+            "Duration of sending batch of metric operations to Redis",
+            registry=registry,
+        )
+
+    @property
+    def metrics(self) -> list:
+        return [self.queue_size, self.dropped, self.flush_duration]
+
+    def qsize(self) -> int:
+        return self.queue.qsize() if self.queue is not None else 0
+
+    def start_if_not(self):
+        """Start writer thread. Restart it in forked process."""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.maxsize)
+            self._thread = threading.Thread(target=self.write_cycle, daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def put(self, commands: list):
+        self.start_if_not()
+        try:
+            self.queue.put_nowait(commands)
+            return
+        except queue.Full:
+            pass
+
+        if self.overflow == self.BLOCK:
+            self.queue.put(commands)
+            return
+        if self.overflow == self.DROP_OLDEST:
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(commands)
+            except queue.Full:
+                pass
+        self.dropped.inc()
+
+    def flush(self):
+        """Wait until all operations in queue are sent."""
+        if self._pid == os.getpid():
+            self.queue.join()
+
+    def stop(self):
+        """Send all operations from queue and stop writer thread."""
+        if self._pid != os.getpid():
+            return
+        self.queue.put(self._stop_item)
+        self._thread.join()
+        self._pid = None
+
+    def _get_batch(self) -> (CommandBuffer, int, bool):
+        """Return merged commands, count of taken queue items and stop flag."""
+        buffer = CommandBuffer()
+        taken, stop = 0, False
+        block, timeout = True, self.timeout_granule
+        deadline = None
+        while taken < self.max_batch:
+            try:
+                item = self.queue.get(block=block, timeout=timeout)
+            except queue.Empty:
+                break
+            taken += 1
+            if item is self._stop_item:
+                stop = True
+                break
+            buffer.extend(item)
+            if self.flush_interval:
+                # wait operations until interval after the first one is passed
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+            else:
+                block = False
+        return buffer, taken, stop
+
+    def write_cycle(self):
+        while True:
+            buffer, taken, stop = self._get_batch()
+            try:
+                if buffer and not self.send(buffer.commands):
+                    # skipped by circuit breaker or failed
+                    self.dropped.inc(taken - stop)
+            finally:
+                for _ in range(taken):
+                    self.queue.task_done()
+            if stop:
+                return
+
+    def send(self, commands: list) -> bool:
+        """Send commands to Redis. Return False if they are not written."""
+        start = time.perf_counter()
+        try:
+            return self.registry.safe_execute(self.registry.send_commands, commands)
+        finally:
+            self.flush_duration.observe(time.perf_counter() - start)
@@ -1,4 +1,4 @@
-from distutils.core import setup
+from setuptools import setup
 
 setup(
     name='prometheus_redis_client',
@@ -9,5 +9,11 @@ setup(
     author_email='belousov.aka.alfa@gmail.com',
     url='https://github.com/belousovalex/prometheus_redis_client',
     install_requires=['redis>=3.2.1,<5.0.0', ],
+    entry_points={
+        'console_scripts': [
+            'prometheus-redis-aggregator = prometheus_redis_client.aggregator:main',
+            'prometheus-redis-agent = prometheus_redis_client.agent:main',
+        ],
+    },
     license='Apache 2',
 )
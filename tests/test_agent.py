@@ -0,0 +1,86 @@
+import os
+import socket
+import threading
+
+import pytest
+
+import prometheus_redis_client as prom
+from prometheus_redis_client.agent import (
+    AgentWriter, MetricsAgent, decode_datagram, encode_datagrams,
+)
+
+from .helpers import MetricEnvironment
+
+
+class TestCodec(object):
+
+    def test_encode_decode(self):
+        commands = [
+            ('sadd', 'group', 'a', 'b'),
+            ('srem', 'group', 'c'),
+            ('delete', 'a', 'b'),
+            ('set', 'a', 1.5, None),
+            ('set', 'b', 2, 60),
+            ('expire', 'a', 10),
+            ('incrby', 'a', -3),
+            ('incrbyfloat', 'a', 0.25),
+            ('hincrby', 'h', 'p1', 2),
+            ('hincrbyfloat', 'h', 'sum', 1.5),
+        ]
+        datagrams = encode_datagrams(commands)
+        assert len(datagrams) == 1
+        assert decode_datagram(datagrams[0]) == commands
+
+    def test_split(self):
+        commands = [('incrby', 'key_{}'.format(i), i) for i in range(100)]
+        datagrams = encode_datagrams(commands, max_size=200)
+        assert len(datagrams) > 1
+        assert all(len(datagram) <= 200 for datagram in datagrams)
+        assert [c for d in datagrams for c in decode_datagram(d)] == commands
+
+    def test_corrupted(self):
+        datagram = encode_datagrams([('incrby', 'a', 1)])[0]
+        with pytest.raises(ValueError):
+            decode_datagram(datagram[:-2])
+        with pytest.raises(ValueError):
+            decode_datagram(b'\x09' + datagram[1:])
+
+
+class TestAgent(object):
+
+    def test_agent(self, tmp_path):
+        address = 'unix://{}'.format(tmp_path / 'agent.sock')
+        with MetricEnvironment() as redis:
+            agent = MetricsAgent(prom.REGISTRY, address, flush_interval=0.05, timeout_granule=0.05)
+            agent.bind()
+            thread = threading.Thread(target=agent.run)
+            thread.start()
+            try:
+                registry = prom.Registry(writer=AgentWriter(address))
+                counter = prom.Counter("test_counter", "Counter documentation", registry=registry)
+                histogram = prom.Histogram(
+                    "test_histogram", "Histogram documentation", buckets=[1], registry=registry,
+                )
+                gauge = prom.Gauge("test_gauge", "Gauge documentation", registry=registry)
+                for _ in range(10):
+                    counter.inc()
+                histogram.observe(0.5)
+                gauge.set(3)
+            finally:
+                agent.stop()
+                thread.join()
+                agent.close()
+                registry.cleanup_and_stop()
+
+            assert int(redis.get("test_counter:e30=")) == 10
+            assert int(redis.get("test_histogram_count:e30=")) == 1
+            gauge_index = "{}:{}".format(socket.gethostname(), os.getpid())
+            assert float(redis.get(gauge.get_metric_key({'gauge_index': gauge_index}))) == 3
+
+    def test_agent_is_not_started(self, tmp_path):
+        writer = AgentWriter('unix://{}'.format(tmp_path / 'agent.sock'))
+        registry = prom.Registry(writer=writer)
+        counter = prom.Counter("test_counter", "Counter documentation", registry=registry)
+        assert counter.inc() is None
+        assert writer.dropped.collect()[0].output() == 'prometheus_redis_client_agent_dropped_total 1'
+        registry.cleanup_and_stop()
@@ -0,0 +1,86 @@
+import pytest
+from redis.exceptions import ResponseError
+
+from .helpers import MetricEnvironment
+import prometheus_redis_client as prom
+from prometheus_redis_client.aggregator import StreamAggregator
+
+
+def skip_without_streams(redis):
+    try:
+        redis.xlen('test_stream')
+    except ResponseError:
+        pytest.skip("Redis Streams are not supported")
+
+
+class TestStreamAggregator(object):
+
+    def test_aggregate(self):
+        with MetricEnvironment() as redis:
+            skip_without_streams(redis)
+            prom.REGISTRY.set_stream('test_stream')
+            aggregator = StreamAggregator(redis, stream='test_stream', block=10)
+            aggregator.create_group()
+
+            counter = prom.Counter("test_counter", "Counter Documentation", ['name'])
+            histogram = prom.Histogram("test_histogram", "Histogram Documentation", buckets=[1, 2])
+            counter.labels('a').inc()
+            counter.labels('a').inc(2)
+            with prom.REGISTRY.batch():
+                counter.labels('b').inc()
+                histogram.observe(1.5)
+
+            # workers do not change metric keys
+            assert redis.get(counter.get_metric_key({'name': 'a'})) is None
+            assert redis.xlen('test_stream') == 3
+
+            assert aggregator.process() == 3
+            assert aggregator.process() == 0
+            assert redis.xlen('test_stream') == 0
+            assert redis.xpending('test_stream', aggregator.group)['pending'] == 0
+
+            assert prom.REGISTRY.output() == (
+                "# HELP test_counter Counter Documentation\n"
+                "# TYPE test_counter counter\n"
+                "test_counter{name=\"a\"} 3\n"
+                "test_counter{name=\"b\"} 1\n"
+                "# HELP test_histogram Histogram Documentation\n"
+                "# TYPE test_histogram histogram\n"
+                "test_histogram_bucket{le=\"1\"} 0\n"
+                "test_histogram_bucket{le=\"2\"} 1\n"
+                "test_histogram_count 1\n"
+                "test_histogram_sum 1.5"
+            )
+
+    def test_pending(self):
+        with MetricEnvironment() as redis:
+            skip_without_streams(redis)
+            prom.REGISTRY.set_stream('test_stream')
+            aggregator = StreamAggregator(redis, stream='test_stream', consumer='test', block=10)
+            aggregator.create_group()
+            aggregator.create_group()
+
+            counter = prom.Counter("test_counter", "Counter Documentation")
+            counter.inc()
+            # entry delivered but aggregator died before apply
+            redis.xreadgroup(aggregator.group, 'test', {'test_stream': '>'})
+            assert aggregator.process() == 0
+            assert aggregator.process(pending=True) == 1
+            assert int(redis.get(counter.get_metric_key({}))) == 1
+
+    def test_claim(self):
+        with MetricEnvironment() as redis:
+            skip_without_streams(redis)
+            prom.REGISTRY.set_stream('test_stream')
+            aggregator = StreamAggregator(redis, stream='test_stream', consumer='test', block=10, claim_idle=0)
+            aggregator.create_group()
+
+            counter = prom.Counter("test_counter", "Counter Documentation")
+            counter.inc()
+            # entry delivered to crashed aggregator with other name
+            redis.xreadgroup(aggregator.group, 'crashed', {'test_stream': '>'})
+            assert aggregator.process(pending=True) == 0
+            assert aggregator.claim() == 1
+            assert aggregator.process(pending=True) == 1
+            assert int(redis.get(counter.get_metric_key({}))) == 1
+            assert aggregator.claim() == 0
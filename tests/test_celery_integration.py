@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+
+from .helpers import MetricEnvironment
+import prometheus_redis_client as prom
+from prometheus_redis_client.celery_integration import CeleryMetrics, PUBLISHED_AT_HEADER
+
+
+class TestCeleryMetrics(object):
+
+    def test_task_signals(self):
+        with MetricEnvironment() as redis:
+            prom.REGISTRY.set_writer(prom.BackgroundWriter(flush_interval=0.05))
+            metrics = CeleryMetrics()
+
+            headers = {}
+            metrics.before_task_publish(headers=headers)
+            headers[PUBLISHED_AT_HEADER] -= 0.5
+            task = SimpleNamespace(name='tasks.add', request=SimpleNamespace(**headers))
+
+            for task_id, state in (('1', 'SUCCESS'), ('2', 'FAILURE'), ('3', 'SUCCESS')):
+                metrics.task_prerun(task_id=task_id, task=task)
+                metrics.task_postrun(task_id=task_id, task=task, state=state)
+            metrics.worker_shutdown()
+
+            assert int(redis.get(metrics.tasks.get_metric_key({'task': 'tasks.add', 'state': 'success'}))) == 2
+            assert int(redis.get(metrics.tasks.get_metric_key({'task': 'tasks.add', 'state': 'failure'}))) == 1
+            assert int(redis.get(metrics.runtime.get_metric_key({'task': 'tasks.add'}, '_count'))) == 3
+            assert int(redis.get(metrics.queue_wait.get_metric_key({'task': 'tasks.add', 'le': 0.25}, '_bucket')) or 0) == 0
+            assert int(redis.get(metrics.queue_wait.get_metric_key({'task': 'tasks.add', 'le': 0.75}, '_bucket'))) == 3
+            assert float(redis.get(metrics.in_progress.get_metric_key(
+                {'task': 'tasks.add', 'gauge_index': metrics.in_progress.index},
+            ))) == 0
+
+    def test_worker_process_init(self):
+        with MetricEnvironment() as redis:
+            metrics = CeleryMetrics()
+            task = SimpleNamespace(name='tasks.add', request=SimpleNamespace())
+            metrics.task_prerun(task_id='1', task=task)
+            metrics.task_postrun(task_id='1', task=task, state='SUCCESS')
+            parent_index = metrics.in_progress.index
+
+            # prefork child
+            metrics.worker_process_init()
+            assert metrics.in_progress.index is None
+            metrics.task_prerun(task_id='2', task=task)
+            metrics.task_postrun(task_id='2', task=task, state='SUCCESS')
+            assert metrics.in_progress.index != parent_index
+
+    def test_in_progress(self):
+        with MetricEnvironment() as redis:
+            metrics = CeleryMetrics()
+            task = SimpleNamespace(name='tasks.add', request=SimpleNamespace())
+            metrics.task_prerun(task_id='1', task=task)
+            metric_key = metrics.in_progress.get_metric_key(
+                {'task': 'tasks.add', 'gauge_index': metrics.in_progress.index},
+            )
+            assert float(redis.get(metric_key)) == 1
+            metrics.task_postrun(task_id='1', task=task, state='SUCCESS')
+            assert float(redis.get(metric_key)) == 0
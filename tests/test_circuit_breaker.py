@@ -0,0 +1,157 @@
+import time
+from unittest.mock import patch
+
+import pytest
+
+import prometheus_redis_client as prom
+from prometheus_redis_client.circuit_breaker import CircuitBreaker
+
+from .helpers import MetricEnvironment
+
+
+class TestCircuitBreaker(object):
+
+    @patch("prometheus_redis_client.circuit_breaker.time.monotonic")
+    def test_backoff(self, mock_time):
+        mock_time.return_value = 100
+        breaker = CircuitBreaker(failure_threshold=2, backoff=1, max_backoff=3)
+
+        breaker.failure()
+        assert breaker.allow()
+        breaker.failure()
+        assert breaker.is_open
+        assert not breaker.allow()
+        assert breaker.skipped == 1
+
+        # one try after backoff
+        mock_time.return_value = 101
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.failure()
+
+        # backoff is doubled
+        mock_time.return_value = 102.5
+        assert not breaker.allow()
+        mock_time.return_value = 103
+        assert breaker.allow()
+        breaker.failure()
+        assert breaker.current_backoff == 3
+
+        mock_time.return_value = 106
+        assert breaker.allow()
+        breaker.success()
+        assert not breaker.is_open
+        assert breaker.allow()
+        assert breaker.current_backoff == 1
+
+    @patch("prometheus_redis_client.circuit_breaker.time.monotonic")
+    def test_log_permit(self, mock_time):
+        mock_time.return_value = 100
+        breaker = CircuitBreaker(log_interval=10)
+        assert breaker.log_permit() == 0
+        assert breaker.log_permit() is None
+        assert breaker.log_permit() is None
+        mock_time.return_value = 110
+        assert breaker.log_permit() == 2
+
+    @patch('prometheus_redis_client.base_metric.logger.exception')
+    def test_skip_writes(self, mock_logger):
+        with MetricEnvironment() as redis:
+            prom.REGISTRY.set_circuit_breaker(CircuitBreaker(failure_threshold=3))
+            try:
+                counter = prom.Counter("test_counter", "Counter documentation")
+
+                def raised_exception_func(*args, **kwargs):
+                    raise ConnectionError()
+
+                with patch("prometheus_redis_client.REGISTRY.redis.pipeline") as mock:
+                    mock.side_effect = raised_exception_func
+                    for _ in range(10):
+                        counter.inc()
+
+                assert mock.call_count == 3
+                assert mock_logger.call_count == 1
+                assert prom.REGISTRY.circuit_breaker.skipped == 7
+
+                # writes are skipped until backoff timeout
+                counter.inc()
+                assert redis.get("test_counter:e30=") is None
+            finally:
+                prom.REGISTRY.set_circuit_breaker(CircuitBreaker())
+
+    @patch('prometheus_redis_client.registry.logger.exception')
+    def test_batch_failures(self, mock_logger):
+        with MetricEnvironment():
+            prom.REGISTRY.set_circuit_breaker(CircuitBreaker(failure_threshold=3))
+            try:
+                counter = prom.Counter("test_counter", "Counter documentation")
+
+                def raised_exception_func(*args, **kwargs):
+                    raise ConnectionError()
+
+                with patch("prometheus_redis_client.REGISTRY.redis.pipeline") as mock:
+                    mock.side_effect = raised_exception_func
+                    for _ in range(10):
+                        with prom.REGISTRY.batch():
+                            counter.inc()
+
+                # buffered writes are not counted as success
+                assert mock.call_count == 3
+                assert prom.REGISTRY.circuit_breaker.is_open
+            finally:
+                prom.REGISTRY.set_circuit_breaker(CircuitBreaker())
+
+    @pytest.mark.parametrize("mode", ["batch", "writer"])
+    @patch('prometheus_redis_client.registry.logger.exception')
+    @patch('prometheus_redis_client.base_metric.logger.exception')
+    def test_recovery_of_buffered_writes(self, mock_metric_logger, mock_logger, mode):
+        with MetricEnvironment() as redis:
+            prom.REGISTRY.set_circuit_breaker(CircuitBreaker(failure_threshold=2, backoff=0.1))
+            writer = prom.BackgroundWriter() if mode == "writer" else None
+            prom.REGISTRY.set_writer(writer)
+            try:
+                counter = prom.Counter("test_counter", "Counter documentation")
+
+                def write():
+                    with prom.REGISTRY.batch():
+                        counter.inc()
+                    if writer is not None:
+                        writer.flush()
+
+                def raised_exception_func(*args, **kwargs):
+                    raise ConnectionError()
+
+                with patch("prometheus_redis_client.REGISTRY.redis.pipeline") as mock:
+                    mock.side_effect = raised_exception_func
+                    for _ in range(5):
+                        write()
+                assert prom.REGISTRY.circuit_breaker.is_open
+
+                # Redis is available again
+                time.sleep(0.15)
+                write()
+                assert not prom.REGISTRY.circuit_breaker.is_open
+                assert int(redis.get("test_counter:e30=")) == 1
+                if writer is not None:
+                    # failed batches, later writes are skipped before they are put to queue
+                    assert writer.dropped.collect()[0].value == 2
+            finally:
+                prom.REGISTRY.set_writer(None)
+                prom.REGISTRY.set_circuit_breaker(CircuitBreaker())
+
+    @patch('prometheus_redis_client.base_metric.logger.exception')
+    def test_command_errors(self, mock_logger):
+        with MetricEnvironment() as redis:
+            prom.REGISTRY.set_circuit_breaker(CircuitBreaker(failure_threshold=2))
+            try:
+                counter = prom.Counter("test_counter", "Counter documentation")
+                # value is rejected by Redis, connection is fine
+                redis.set("test_counter:e30=", "text")
+                for _ in range(5):
+                    counter.inc()
+                assert not prom.REGISTRY.circuit_breaker.is_open
+                redis.delete("test_counter:e30=")
+                counter.inc()
+                assert int(redis.get("test_counter:e30=")) == 1
+            finally:
+                prom.REGISTRY.set_circuit_breaker(CircuitBreaker())
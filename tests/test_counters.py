@@ -59,6 +59,25 @@ class TestCounter(object):
             assert counter.labels(**labels).inc(3) == 5
             assert int(redis.get(metric_key)) == 5
 
+    def test_escaping(self):
+        with MetricEnvironment():
+            counter = prom.Counter(
+                name="test_counter",
+                documentation="Counter\\documentation\nsecond line",
+                labelnames=["path"],
+            )
+            counter.labels('a"b\\c\nd').inc()
+
+            expected = (
+                "# HELP test_counter Counter\\\\documentation\\nsecond line\n"
+                "# TYPE test_counter counter\n"
+                'test_counter{path="a\\"b\\\\c\\nd"} 1'
+            )
+            assert prom.REGISTRY.output() == expected
+            # rendered labels are reused by next output
+            assert len(counter._labels_cache) == 1
+            assert prom.REGISTRY.output() == expected
+
     @patch('prometheus_redis_client.base_metric.logger.exception')
     def test_silent_mode(self, mock_logger):
         """
@@ -107,4 +126,67 @@ class TestCounter(object):
                 "# HELP test_counter1 Counter documentation\n"
                 "# TYPE test_counter1 counter\n"
                 "test_counter1 10"
-            )
\ No newline at end of file
+            )
+    def test_idle_expire(self):
+        with MetricEnvironment() as redis:
+            counter = prom.Counter(
+                "test_counter",
+                "Counter documentation",
+                ['name'],
+                idle_expire=40,
+            )
+            with patch.object(prom.REGISTRY, 'send_commands', wraps=prom.REGISTRY.send_commands) as send:
+                counter.labels('a').inc()
+                counter.labels('a').inc()
+                counter.labels('b').inc()
+            commands = [c[0] for call in send.call_args_list for c in call[0][0]]
+            # expire is refreshed once per series
+            assert commands.count('expire') == 2
+
+            metric_key = counter.get_metric_key({'name': 'a'})
+            assert 40 <= redis.ttl(metric_key) <= 50
+
+            # series expired
+            redis.delete(metric_key)
+            assert prom.REGISTRY.output() == (
+                "# HELP test_counter Counter documentation\n"
+                "# TYPE test_counter counter\n"
+                "test_counter{name=\"b\"} 1"
+            )
+            assert redis.smembers(counter.get_metric_group_key()) == {
+                counter.get_metric_key({'name': 'b'}).encode('utf-8'),
+            }
+
+            with pytest.raises(ValueError):
+                prom.Counter("test_counter2", "Counter documentation", idle_expire=0)
+
+    def test_idle_expire_after_remove(self):
+        with MetricEnvironment() as redis:
+            counter = prom.Counter("test_counter", "Counter documentation", ['name'], idle_expire=100)
+            metric_key = counter.get_metric_key({'name': 'a'})
+            counter.labels('a').inc()
+            counter.remove('a')
+            counter.labels('a').inc()
+            assert redis.ttl(metric_key) > 0
+
+            counter.clear()
+            counter.labels('a').inc()
+            assert redis.ttl(metric_key) > 0
+
+    def test_remove_and_clear(self):
+        with MetricEnvironment() as redis:
+            counter = prom.Counter("test_counter", "Counter documentation", ["host", "url"])
+            for host in ('a', 'b', 'c'):
+                counter.labels(host, '/').inc()
+            group_key = counter.get_metric_group_key()
+
+            counter.remove('a', '/')
+            assert redis.get(counter.get_metric_key({'host': 'a', 'url': '/'})) is None
+            assert len(redis.smembers(group_key)) == 2
+            with pytest.raises(ValueError):
+                counter.remove('a')
+
+            counter.clear()
+            assert redis.smembers(group_key) == set()
+            assert redis.keys('test_counter*') == []
+
@@ -0,0 +1,151 @@
+import pytest
+
+from .helpers import MetricEnvironment
+import prometheus_redis_client as prom
+
+
+class TestExponentialHistogram(object):
+
+    def test_interface_without_labels(self):
+        with MetricEnvironment() as redis:
+
+            histogram = prom.ExponentialHistogram(
+                name="test_histogram",
+                documentation="Histogram documentation",
+                schema=0,
+            )
+
+            histogram.observe(3)
+            histogram.observe(0.3)
+            histogram.observe(4)
+
+            group_key = histogram.get_metric_group_key()
+            assert redis.smembers(group_key) == {b'test_histogram:e30='}
+            assert redis.hgetall('test_histogram:e30=') == {
+                b'p-1': b'1',
+                b'p2': b'2',
+                b'sum': b'7.3',
+                b'count': b'3',
+            }
+
+            assert prom.REGISTRY.output() == (
+                '# HELP test_histogram Histogram documentation\n'
+                '# TYPE test_histogram histogram\n'
+                'test_histogram_bucket{le="+Inf"} 3\n'
+                'test_histogram_bucket{le="0.5"} 1\n'
+                'test_histogram_bucket{le="4.0"} 3\n'
+                'test_histogram_count 3\n'
+                'test_histogram_sum 7.3'
+            )
+
+    def test_interface_with_labels(self):
+        with MetricEnvironment():
+
+            histogram = prom.ExponentialHistogram(
+                name="test_histogram",
+                documentation="Histogram documentation",
+                labelnames=["host"],
+                schema=2,
+                render_schema=0,
+            )
+
+            with pytest.raises(ValueError):
+                histogram.observe(1)
+
+            histogram.labels(host="local").observe(-1.5)
+            histogram.labels(host="local").observe(0)
+            histogram.labels(host="local").observe(1.1)
+            histogram.labels(host="local").observe(1.9)
+
+            assert prom.REGISTRY.output() == (
+                '# HELP test_histogram Histogram documentation\n'
+                '# TYPE test_histogram histogram\n'
+                'test_histogram_bucket{host="local",le="+Inf"} 4\n'
+                'test_histogram_bucket{host="local",le="-1.0"} 1\n'
+                'test_histogram_bucket{host="local",le="0.0"} 2\n'
+                'test_histogram_bucket{host="local",le="2.0"} 4\n'
+                'test_histogram_count{host="local"} 4\n'
+                'test_histogram_sum{host="local"} 1.5'
+            )
+
+    def test_negative_values(self):
+        with MetricEnvironment():
+
+            histogram = prom.ExponentialHistogram(
+                name="test_histogram",
+                documentation="Histogram documentation",
+                schema=0,
+            )
+
+            for value in (-4, -3, -2, -1, 1, 2):
+                histogram.observe(value)
+
+            assert prom.REGISTRY.output() == (
+                '# HELP test_histogram Histogram documentation\n'
+                '# TYPE test_histogram histogram\n'
+                'test_histogram_bucket{le="+Inf"} 6\n'
+                'test_histogram_bucket{le="-1.0"} 4\n'
+                'test_histogram_bucket{le="-2.0"} 3\n'
+                'test_histogram_bucket{le="-4.0"} 1\n'
+                'test_histogram_bucket{le="1.0"} 5\n'
+                'test_histogram_bucket{le="2.0"} 6\n'
+                'test_histogram_count 6\n'
+                'test_histogram_sum -7'
+            )
+
+    def test_not_finite_values(self):
+        with MetricEnvironment() as redis:
+
+            histogram = prom.ExponentialHistogram(
+                name="test_histogram",
+                documentation="Histogram documentation",
+                schema=0,
+            )
+
+            histogram.observe(float('inf'))
+            histogram.observe(float('nan'))
+            histogram.observe_many([float('inf'), 2, float('-inf'), float('nan')])
+            histogram.observe_many([float('inf')])
+
+            assert redis.hgetall('test_histogram:e30=') == {
+                b'p1': b'1',
+                b'sum': b'2',
+                b'count': b'1',
+            }
+
+    def test_wrong_schema(self):
+        with MetricEnvironment():
+            with pytest.raises(ValueError, match=r"Schema should be between -4 and 8"):
+                prom.ExponentialHistogram(
+                    name="test_histogram",
+                    documentation="Histogram documentation",
+                    schema=9,
+                )
+            with pytest.raises(ValueError, match=r"render_schema can not be greater than schema"):
+                prom.ExponentialHistogram(
+                    name="test_histogram",
+                    documentation="Histogram documentation",
+                    schema=1,
+                    render_schema=2,
+                )
+
+    def test_observe_many(self):
+        with MetricEnvironment():
+
+            histogram = prom.ExponentialHistogram(
+                name="test_histogram",
+                documentation="Histogram documentation",
+                schema=0,
+            )
+
+            histogram.observe_many([3, 0.3, 4])
+
+            assert prom.REGISTRY.output() == (
+                '# HELP test_histogram Histogram documentation\n'
+                '# TYPE test_histogram histogram\n'
+                'test_histogram_bucket{le="+Inf"} 3\n'
+                'test_histogram_bucket{le="0.5"} 1\n'
+                'test_histogram_bucket{le="4.0"} 3\n'
+                'test_histogram_count 3\n'
+                'test_histogram_sum 7.3'
+            )
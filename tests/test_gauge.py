@@ -1,10 +1,12 @@
 import time
+import threading
 from unittest.mock import patch
 
 import pytest
 import base64
 
 from .helpers import MetricEnvironment
+from prometheus_redis_client.circuit_breaker import CircuitBreaker
 import prometheus_redis_client as prom
 
 
@@ -136,3 +138,137 @@ class TestGauge(object):
                 "# TYPE test_gauge gauge\n"
                 "test_gauge{gauge_index=\"%s\"} 12.3"
             ) % gauge_index
+
+    def test_reuse_labels(self):
+        with MetricEnvironment() as redis:
+            gauge = prom.Gauge(
+                "test_gauge",
+                "Gauge Documentation",
+                ['name'],
+                expire=4,
+            )
+
+            child = gauge.labels(name='test')
+            child.set(1)
+            child.inc(2)
+
+            gauge_index = int(redis.get(prom.DEFAULT_GAUGE_INDEX_KEY))
+            assert prom.REGISTRY.output() == (
+                "# HELP test_gauge Gauge Documentation\n"
+                "# TYPE test_gauge gauge\n"
+                "test_gauge{gauge_index=\"%s\",name=\"test\"} 3"
+            ) % gauge_index
+
+    def test_threads(self):
+        with MetricEnvironment() as redis:
+            gauge = prom.Gauge(
+                "test_gauge",
+                "Gauge Documentation",
+                ['name'],
+            )
+
+            def worker():
+                for _ in range(100):
+                    gauge.labels(name='test').inc(1)
+
+            threads = [threading.Thread(target=worker) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            metric_key = gauge.get_metric_key({'name': 'test', 'gauge_index': gauge.index})
+            assert float(redis.get(metric_key)) == 800
+            assert gauge.gauge_values[metric_key].value == 800
+
+    def test_write_in_progress(self):
+        with MetricEnvironment() as redis:
+            gauge = prom.Gauge(
+                "test_gauge",
+                "Gauge Documentation",
+                refresh_enable=False,
+            )
+            gauge.set(1)
+            metric_key = gauge.get_metric_key({'gauge_index': gauge.index})
+            state = gauge.gauge_values[metric_key]
+
+            # other thread is sending value of series
+            state.writing = True
+            gauge.set(5)
+            gauge.inc(2)
+            assert float(redis.get(metric_key)) == 1
+
+            gauge._write(metric_key, state)
+            assert float(redis.get(metric_key)) == 7
+            assert state.writing is False
+            assert state.pending == []
+
+            # refresh sends local value
+            redis.delete(metric_key)
+            gauge.refresh_values()
+            assert float(redis.get(metric_key)) == 7
+
+    def test_remove_and_clear(self):
+        with MetricEnvironment() as redis:
+            gauge = prom.Gauge("test_gauge", "Gauge Documentation", ['name'])
+            gauge.labels('a').set(1)
+            gauge.labels('b').set(2)
+            group_key = gauge.get_metric_group_key()
+            key_a = gauge.get_metric_key({'name': 'a', 'gauge_index': gauge.index})
+
+            gauge.remove('a')
+            assert key_a not in gauge.gauge_values
+            assert redis.get(key_a) is None
+            assert len(redis.smembers(group_key)) == 1
+            # removed series is not refreshed
+            gauge.refresh_values()
+            assert redis.get(key_a) is None
+
+            gauge.clear()
+            assert len(gauge.gauge_values) == 0
+            assert redis.smembers(group_key) == set()
+
+    def test_max_series(self):
+        with MetricEnvironment() as redis:
+            gauge = prom.Gauge("test_gauge", "Gauge Documentation", ['name'], max_series=2)
+            gauge.labels('a').set(1)
+            gauge.labels('b').set(2)
+            gauge.labels('a').inc(1)
+            gauge.labels('c').set(3)
+
+            # 'b' is least recently changed
+            assert [gauge.unpack_labels(gauge.parse_metric_key(key.encode())[1])['name']
+                    for key in gauge.gauge_values] == ['a', 'c']
+            redis.flushdb()
+            gauge.refresh_values()
+            assert len(redis.smembers(gauge.get_metric_group_key())) == 2
+
+            with pytest.raises(ValueError):
+                prom.Gauge("test_gauge_2", "Gauge Documentation", max_series=0)
+
+
+    @patch('prometheus_redis_client.base_metric.logger.exception')
+    def test_local_value_with_open_circuit_breaker(self, mock_logger):
+        with MetricEnvironment() as redis:
+            prom.REGISTRY.set_circuit_breaker(CircuitBreaker(failure_threshold=1, backoff=60))
+            try:
+                gauge = prom.Gauge("test_gauge", "Gauge Documentation")
+                gauge.set(0)
+
+                def raised_exception_func(*args, **kwargs):
+                    raise ConnectionError()
+
+                with patch("prometheus_redis_client.REGISTRY.redis.pipeline") as mock:
+                    mock.side_effect = raised_exception_func
+                    for _ in range(5):
+                        gauge.inc(1)
+                assert mock.call_count == 1
+
+                # local value is changed while writes are skipped and sent by refresher
+                (metric_key, state), = gauge.gauge_values.items()
+                assert state.value == 5
+                prom.REGISTRY.circuit_breaker.reset()
+                gauge.refresh_values()
+                assert float(redis.get(metric_key)) == 5
+            finally:
+                prom.REGISTRY.set_circuit_breaker(CircuitBreaker())
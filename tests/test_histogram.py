@@ -1,3 +1,4 @@
+import asyncio
 from unittest.mock import patch
 
 import pytest
@@ -139,6 +140,55 @@ class TestHistogram(object):
                 histogram.observe(1)
             assert mock_logger.called
 
+    def test_time(self):
+        with MetricEnvironment() as redis:
+            histogram = prom.Histogram(
+                name="test_histogram",
+                documentation="Histogram documentation",
+                buckets=[1, 60],
+            )
+
+            with histogram.time():
+                pass
+
+            with pytest.raises(ZeroDivisionError):
+                with histogram.time():
+                    1 / 0
+
+            @histogram.time()
+            async def coroutine_func():
+                await asyncio.sleep(0.01)
+                return 'result'
+
+            loop = asyncio.new_event_loop()
+            try:
+                assert loop.run_until_complete(coroutine_func()) == 'result'
+            finally:
+                loop.close()
+
+            assert int(redis.get(histogram.get_metric_key({}, '_count'))) == 3
+            assert int(redis.get(histogram.get_metric_key({'le': 1}, '_bucket'))) == 3
+            assert float(redis.get(histogram.get_metric_key({}, '_sum'))) >= 0.01
+
+    def test_idle_expire(self):
+        with MetricEnvironment() as redis:
+            histogram = prom.Histogram(
+                name="test_histogram",
+                documentation="Histogram documentation",
+                buckets=[1, 2],
+                idle_expire=40,
+            )
+            histogram.observe(1.5)
+
+            for key in (
+                histogram.get_metric_key({}, '_sum'),
+                histogram.get_metric_key({}, '_count'),
+                histogram.get_metric_key({'le': 1}, '_bucket'),
+                histogram.get_metric_key({'le': 2}, '_bucket'),
+            ):
+                assert 40 <= redis.ttl(key) <= 50
+            assert int(redis.get(histogram.get_metric_key({'le': 1}, '_bucket'))) == 0
+
     def test_timeit_wrapper(self):
         """Test `timeit` wrapper for Histogram metric."""
 
@@ -168,3 +218,88 @@ class TestHistogram(object):
                 'test_histogram_count 1\n'
                 'test_histogram_sum 0.01'
             )
+
+    @pytest.mark.parametrize("without_numpy", [False, True])
+    def test_observe_many(self, without_numpy):
+        with MetricEnvironment():
+
+            histogram = prom.Histogram(
+                name="test_histogram",
+                documentation="Histogram documentation",
+                labelnames=["host"],
+                buckets=[1, 20, 25.5],
+            )
+
+            numpy = None if without_numpy else prom.metrics.numpy
+            with patch("prometheus_redis_client.metrics.numpy", numpy):
+                histogram.labels(host="local").observe_many([25.4, 3, 0.5, 100])
+                histogram.labels(host="local").observe_many([])
+
+            assert prom.REGISTRY.output() == (
+                '# HELP test_histogram Histogram documentation\n'
+                '# TYPE test_histogram histogram\n'
+                'test_histogram_bucket{host="local",le="1"} 1\n'
+                'test_histogram_bucket{host="local",le="20"} 2\n'
+                'test_histogram_bucket{host="local",le="25.5"} 3\n'
+                'test_histogram_bucket{le="1"} 0\n'
+                'test_histogram_bucket{le="20"} 0\n'
+                'test_histogram_bucket{le="25.5"} 0\n'
+                'test_histogram_count 0\n'
+                'test_histogram_count{host="local"} 4\n'
+                'test_histogram_sum 0\n'
+                'test_histogram_sum{host="local"} 128.9'
+            )
+
+    def test_reuse_labels(self):
+        with MetricEnvironment():
+
+            histogram = prom.Histogram(
+                name="test_histogram",
+                documentation="Histogram documentation",
+                labelnames=["host"],
+                buckets=[1],
+            )
+
+            child = histogram.labels(host="local")
+            child.observe(0.5)
+            child.observe(0.5)
+
+            assert 'test_histogram_count{host="local"} 2' in prom.REGISTRY.output()
+
+    def test_remove(self):
+        with MetricEnvironment() as redis:
+            histogram = prom.Histogram("test_histogram", "Histogram documentation", ['name'], buckets=[1, 2])
+            histogram.labels('a').observe(1)
+            histogram.labels('b').observe(3)
+
+            histogram.remove('a')
+            for _, keys in histogram.series_members({'name': 'a'}):
+                assert redis.exists(*keys) == 0
+            assert sorted(redis.smembers(histogram.get_metric_group_key())) == sorted([
+                histogram.get_metric_key({'name': 'b'}, '_sum').encode('utf-8'),
+                histogram.get_metric_key({'name': 'b'}, '_count').encode('utf-8'),
+            ])
+
+    def test_sample_rate(self):
+        with MetricEnvironment():
+            histogram = prom.Histogram(
+                "test_histogram", "Histogram documentation", buckets=[1, 2], sample_rate=0.4,
+            )
+            # sampled with weight 3, skipped, sampled with weight 2
+            with patch('prometheus_redis_client.metrics._random', side_effect=[0.1, 0.3, 0.9, 0.2, 0.7]):
+                for _ in range(3):
+                    histogram.observe(1.5)
+
+            histogram.set_sample_rate(None)
+            histogram.observe(0.5)
+            assert prom.REGISTRY.output() == (
+                '# HELP test_histogram Histogram documentation\n'
+                '# TYPE test_histogram histogram\n'
+                'test_histogram_bucket{le="1"} 1\n'
+                'test_histogram_bucket{le="2"} 6\n'
+                'test_histogram_count 6\n'
+                'test_histogram_sum 8'
+            )
+            with pytest.raises(ValueError):
+                histogram.set_sample_rate(0)
+
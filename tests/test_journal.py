@@ -0,0 +1,89 @@
+import time
+from unittest.mock import patch
+
+from .helpers import MetricEnvironment
+import prometheus_redis_client as prom
+from prometheus_redis_client.journal import Journal
+
+
+class TestJournal(object):
+
+    def test_annotate(self):
+        journal = Journal(interval=10)
+        commands = journal.annotate([
+            ('sadd', 'test_group', 'a', 'b'),
+            ('incrby', 'a', 1),
+            ('srem', 'test_group', 'c'),
+        ])
+        journal_key = 'test_group_journal:{}'.format(journal.current_number())
+        assert commands[:3] == [
+            ('sadd', 'test_group', 'a', 'b'),
+            ('incrby', 'a', 1),
+            ('srem', 'test_group', 'c'),
+        ]
+        assert commands[3][:2] == ('sadd', journal_key)
+        assert sorted(commands[3][2:]) == ['a', 'b', 'c']
+        assert commands[4] == ('expire', journal_key, 81)
+        assert journal.annotate([('incrby', 'a', 1)]) == [('incrby', 'a', 1)]
+
+    @patch('prometheus_redis_client.journal.time.time')
+    def test_snapshot(self, time_mock):
+        with MetricEnvironment() as redis:
+            time_mock.return_value = 6000
+            prom.REGISTRY.enable_journal(interval=60)
+            counter = prom.Counter("test_counter", "Counter Documentation", ['name'])
+            counter.labels('a').inc()
+            counter.labels('b').inc()
+            expected = (
+                "# HELP test_counter Counter Documentation\n"
+                "# TYPE test_counter counter\n"
+                "test_counter{{name=\"a\"}} {}\n"
+                "test_counter{{name=\"b\"}} {}"
+            )
+            assert prom.REGISTRY.output() == expected.format(1, 1)
+            time_mock.return_value += 60 * 2
+            assert prom.REGISTRY.output() == expected.format(1, 1)
+
+            # value changed without journal is not read, series changed in later interval is read
+            redis.set(counter.get_metric_key({'name': 'b'}), 10)
+            time_mock.return_value += 60
+            counter.labels('a').inc()
+            assert prom.REGISTRY.output() == expected.format(2, 1)
+
+            # removed series
+            pipeline = prom.REGISTRY.pipeline()
+            pipeline.srem(counter.get_metric_group_key(), counter.get_metric_key({'name': 'a'}))
+            pipeline.delete(counter.get_metric_key({'name': 'a'}))
+            pipeline.execute()
+            assert prom.REGISTRY.output() == (
+                "# HELP test_counter Counter Documentation\n"
+                "# TYPE test_counter counter\n"
+                "test_counter{name=\"b\"} 1"
+            )
+
+            # full resync
+            prom.REGISTRY.snapshot.full_resync = 0
+            assert prom.REGISTRY.output() == (
+                "# HELP test_counter Counter Documentation\n"
+                "# TYPE test_counter counter\n"
+                "test_counter{name=\"b\"} 10"
+            )
+
+    def test_snapshot_expire(self):
+        with MetricEnvironment() as redis:
+            prom.REGISTRY.enable_journal(interval=0.1)
+            counter = prom.Counter("test_counter", "Counter Documentation", ['name'])
+            counter.labels('a').inc()
+            counter.labels('b').inc()
+            redis.pexpire(counter.get_metric_key({'name': 'a'}), 500)
+            assert 'test_counter{name="a"} 1' in prom.REGISTRY.output()
+            time.sleep(0.3)
+            assert 'test_counter{name="a"} 1' in prom.REGISTRY.output()
+
+            # key is expired by Redis without journal
+            time.sleep(0.3)
+            assert prom.REGISTRY.output() == (
+                "# HELP test_counter Counter Documentation\n"
+                "# TYPE test_counter counter\n"
+                "test_counter{name=\"b\"} 1"
+            )
@@ -0,0 +1,96 @@
+import asyncio
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+
+from .helpers import MetricEnvironment
+from prometheus_redis_client.middleware import ASGIMiddleware, WSGIMiddleware
+
+
+def wsgi_request(app, path: str) -> (list, bytes):
+    environ = {'PATH_INFO': path}
+    setup_testing_defaults(environ)
+    response = []
+
+    def start_response(status, headers, exc_info=None):
+        response.append(status)
+
+    result = app(environ, start_response)
+    body = b''.join(result)
+    if hasattr(result, 'close'):
+        result.close()
+    return response, body
+
+
+class TestMiddleware(object):
+
+    def test_wsgi(self):
+        with MetricEnvironment() as redis:
+            in_progress = []
+
+            def app(environ, start_response):
+                gauge = middleware.metrics.in_progress
+                in_progress.append(float(redis.get(gauge.get_metric_key(
+                    {'method': 'GET', 'gauge_index': gauge.index}
+                ))))
+                if environ['PATH_INFO'] == '/error':
+                    raise ValueError()
+                start_response('404 Not Found', [])
+                return [b'not found']
+
+            middleware = WSGIMiddleware(app, route_resolver=lambda environ: environ['PATH_INFO'])
+
+            assert wsgi_request(middleware, '/') == (['404 Not Found'], b'not found')
+            with pytest.raises(ValueError):
+                wsgi_request(middleware, '/error')
+            assert in_progress == [1, 1]
+
+            requests = middleware.metrics.requests
+            assert int(redis.get(requests.get_metric_key(
+                {'method': 'GET', 'route': '/', 'status': '404'}
+            ))) == 1
+            assert int(redis.get(requests.get_metric_key(
+                {'method': 'GET', 'route': '/error', 'status': '500'}
+            ))) == 1
+            in_progress_gauge = middleware.metrics.in_progress
+            assert float(redis.get(in_progress_gauge.get_metric_key(
+                {'method': 'GET', 'gauge_index': in_progress_gauge.index}
+            ))) == 0
+
+            status, body = wsgi_request(middleware, '/metrics')
+            assert status == ['200 OK']
+            assert b'http_requests_total{method="GET",route="/",status="404"} 1' in body
+            assert b'http_request_duration_seconds_count{method="GET",route="/"} 1' in body
+
+            # output is cached
+            wsgi_request(middleware, '/')
+            assert wsgi_request(middleware, '/metrics')[1] == body
+
+    def test_asgi(self):
+        with MetricEnvironment() as redis:
+
+            async def app(scope, receive, send):
+                await send({'type': 'http.response.start', 'status': 201, 'headers': []})
+                await send({'type': 'http.response.body', 'body': b'ok'})
+
+            middleware = ASGIMiddleware(app, route_resolver=lambda scope: '/items/{id}', cache_ttl=0)
+            messages = []
+
+            async def send(message):
+                messages.append(message)
+
+            async def receive():
+                return {'type': 'http.request'}
+
+            loop = asyncio.new_event_loop()
+            try:
+                scope = {'type': 'http', 'method': 'POST', 'path': '/items/1'}
+                loop.run_until_complete(middleware(scope, receive, send))
+                scope = {'type': 'http', 'method': 'GET', 'path': '/metrics'}
+                loop.run_until_complete(middleware(scope, receive, send))
+            finally:
+                loop.close()
+
+            assert messages[0]['status'] == 201
+            assert messages[2]['status'] == 200
+            assert b'http_requests_total{method="POST",route="/items/{id}",status="201"} 1' in messages[3]['body']
@@ -0,0 +1,271 @@
+import threading
+from unittest.mock import patch
+
+import pytest
+import redis
+
+import prometheus_redis_client as prom
+from prometheus_redis_client.pipeline import CommandBuffer
+
+from .helpers import MetricEnvironment
+
+
+class TestCommandBuffer(object):
+
+    def test_merge(self):
+        buffer = CommandBuffer()
+        buffer.extend([
+            ('sadd', 'group', 'a'),
+            ('incrby', 'a', 1),
+            ('sadd', 'group', 'a', 'b'),
+            ('incrby', 'a', 2),
+            ('hincrbyfloat', 'b', 'sum', 0.5),
+            ('hincrbyfloat', 'b', 'sum', 1.0),
+            ('expire', 'b', 10),
+            ('expire', 'b', 20),
+        ])
+        assert buffer.commands == [
+            ('sadd', 'group', 'a', 'b'),
+            ('incrby', 'a', 3),
+            ('hincrbyfloat', 'b', 'sum', 1.5),
+            ('expire', 'b', 20),
+        ]
+
+    def test_set_stop_merge(self):
+        buffer = CommandBuffer()
+        buffer.extend([
+            ('incrbyfloat', 'a', 1.0),
+            ('set', 'a', 5, None),
+            ('incrbyfloat', 'a', 2.0),
+            ('incrbyfloat', 'a', 3.0),
+        ])
+        assert buffer.commands == [
+            ('incrbyfloat', 'a', 1.0),
+            ('set', 'a', 5, None),
+            ('incrbyfloat', 'a', 5.0),
+        ]
+
+
+class TestBatch(object):
+
+    def test_batch(self):
+        with MetricEnvironment() as redis:
+            counter = prom.Counter("test_counter", "Counter documentation")
+            summary = prom.Summary("test_summary", "Summary documentation")
+
+            with patch.object(prom.REGISTRY.redis, "pipeline", wraps=redis.pipeline) as mock:
+                with prom.REGISTRY.batch():
+                    counter.inc()
+                    counter.inc(2)
+                    summary.observe(1.5)
+                    summary.observe(2)
+                    # nothing is sent until exit
+                    assert redis.get("test_counter:e30=") is None
+                assert mock.call_count == 1
+
+            assert int(redis.get("test_counter:e30=")) == 3
+            assert prom.REGISTRY.output() == (
+                "# HELP test_counter Counter documentation\n"
+                "# TYPE test_counter counter\n"
+                "test_counter 3\n"
+                "# HELP test_summary Summary documentation\n"
+                "# TYPE test_summary summary\n"
+                "test_summary_count 2\n"
+                "test_summary_sum 3.5"
+            )
+
+    def test_decorator_and_nested(self):
+        with MetricEnvironment() as redis:
+            counter = prom.Counter("test_counter", "Counter documentation")
+
+            @prom.REGISTRY.batch()
+            def func():
+                before = redis.get("test_counter:e30=")
+                counter.inc()
+                with prom.REGISTRY.batch():
+                    counter.inc()
+                assert redis.get("test_counter:e30=") == before
+
+            func()
+            assert int(redis.get("test_counter:e30=")) == 2
+            func()
+            assert int(redis.get("test_counter:e30=")) == 4
+
+    def test_send_on_exception(self):
+        with MetricEnvironment() as redis:
+            counter = prom.Counter("test_counter", "Counter documentation")
+
+            with pytest.raises(ValueError):
+                with prom.REGISTRY.batch():
+                    counter.inc()
+                    raise ValueError()
+            assert int(redis.get("test_counter:e30=")) == 1
+
+    def test_batch_per_thread(self):
+        with MetricEnvironment() as redis:
+            counter = prom.Counter("test_counter", "Counter documentation")
+
+            with prom.REGISTRY.batch():
+                thread = threading.Thread(target=counter.inc)
+                thread.start()
+                thread.join()
+                assert int(redis.get("test_counter:e30=")) == 1
+                counter.inc()
+                assert int(redis.get("test_counter:e30=")) == 1
+            assert int(redis.get("test_counter:e30=")) == 2
+
+
+class TestParallelCollect(object):
+
+    def test_output(self):
+        with MetricEnvironment():
+            counters = [
+                prom.Counter("test_counter_{}".format(i), "Counter documentation", ['name'])
+                for i in range(4)
+            ]
+            for i, counter in enumerate(counters):
+                for name in ('a', 'b', 'c'):
+                    counter.labels(name).inc(i + 1)
+            expected = prom.REGISTRY.output()
+
+            prom.REGISTRY.set_collect_workers(4)
+            barrier = threading.Barrier(4, timeout=5)
+            collect = prom.Counter.collect
+
+            def parallel_collect(metric):
+                # fails if families are collected one after another
+                barrier.wait()
+                return collect(metric)
+
+            with patch.object(prom.Counter, 'collect', parallel_collect):
+                assert prom.REGISTRY.output() == expected
+
+            prom.REGISTRY.set_collect_workers(None)
+            assert prom.REGISTRY.output() == expected
+
+
+class TestInstrumentation(object):
+
+    def test_instrumentation(self):
+        with MetricEnvironment():
+            prom.REGISTRY.enable_instrumentation()
+            counter = prom.Counter("test_counter", "Counter documentation")
+            counter.inc()
+            with prom.REGISTRY.batch():
+                counter.inc()
+                counter.inc()
+
+            with patch("prometheus_redis_client.REGISTRY.redis.pipeline") as mock:
+                mock.side_effect = ConnectionError()
+                counter.inc()
+
+            prom.REGISTRY.output()
+            output = prom.REGISTRY.output().split("\n")
+
+            assert 'prometheus_redis_client_write_duration_seconds_count{metric_type="counter"} 4' in output
+            assert 'prometheus_redis_client_pipeline_commands_bucket{le="2"} 3' in output
+            assert 'prometheus_redis_client_pipeline_commands_count 3' in output
+            assert 'prometheus_redis_client_write_errors_total 1' in output
+            assert 'prometheus_redis_client_swallowed_exceptions_total{metric_type="counter"} 1' in output
+            assert 'prometheus_redis_client_circuit_breaker_skipped_total 0' in output
+            assert 'prometheus_redis_client_series{metric="test_counter"} 1' in output
+            assert any(
+                line.startswith('prometheus_redis_client_collect_duration_seconds{metric="test_counter"} ')
+                for line in output
+            )
+
+
+class TestReadReplica(object):
+
+    def test_output_from_replica(self):
+        with MetricEnvironment() as redis_client:
+            replica = redis.from_url("redis://redis:6379/1")
+            replica.flushdb()
+            counter = prom.Counter("test_counter", "Counter documentation", ['name'])
+            counter.labels('a').inc()
+            counter.labels('b').inc(2)
+
+            group_key = counter.get_metric_group_key()
+            key_a = counter.get_metric_key({'name': 'a'})
+            key_b = counter.get_metric_key({'name': 'b'})
+            key_c = counter.get_metric_key({'name': 'c'})
+            # expired series `c` and replica which has no value of `b` yet
+            redis_client.sadd(group_key, key_c)
+            replica.sadd(group_key, key_a, key_b, key_c)
+            replica.set(key_a, 5)
+
+            prom.REGISTRY.set_read_redis(replica)
+            assert prom.REGISTRY.output().split("\n")[2:] == [
+                'test_counter{name="a"} 5',
+            ]
+            # only members without keys on primary are removed
+            assert redis_client.smembers(group_key) == {key_a.encode(), key_b.encode()}
+
+            prom.REGISTRY.set_read_redis(None)
+            assert prom.REGISTRY.output().split("\n")[2:] == [
+                'test_counter{name="a"} 1',
+                'test_counter{name="b"} 2',
+            ]
+
+
+class TestIndex(object):
+
+    def test_get_and_unregister(self):
+        with MetricEnvironment():
+            counter = prom.Counter("test_counter", "Counter documentation")
+            gauge = prom.Gauge("test_gauge", "Gauge documentation")
+            gauge.set(1)
+            assert prom.REGISTRY.get("test_counter") is counter
+            assert prom.REGISTRY.get("test_other") is None
+            with pytest.raises(ValueError):
+                prom.Counter("test_counter", "Counter documentation")
+
+            prom.REGISTRY.unregister(counter, gauge)
+            assert prom.REGISTRY.get("test_counter") is None
+            assert prom.REGISTRY.output() == ""
+            assert gauge.refresh_values not in prom.REGISTRY.refresher._refresh_functions
+            # name can be registered again
+            assert prom.Counter("test_counter", "Counter documentation") is not counter
+
+    def test_get_or_create(self):
+        with MetricEnvironment():
+            barrier = threading.Barrier(8, timeout=5)
+            created = []
+
+            def create():
+                barrier.wait()
+                created.append(prom.REGISTRY.get_or_create(
+                    prom.Counter, "test_counter", "Counter documentation", ['name'],
+                ))
+
+            threads = [threading.Thread(target=create) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert len(created) == 8
+            assert all(metric is created[0] for metric in created)
+
+            with pytest.raises(ValueError):
+                prom.REGISTRY.get_or_create(prom.Gauge, "test_counter", "Counter documentation", ['name'])
+            with pytest.raises(ValueError):
+                prom.REGISTRY.get_or_create(prom.Counter, "test_counter", "Counter documentation", ['host'])
+
+    def test_scope(self):
+        with MetricEnvironment() as redis_client:
+            tenant = prom.REGISTRY.scope("tenant_a")
+            counter = tenant.get_or_create(prom.Counter, "requests", "Requests of tenant")
+            counter.inc()
+            assert counter.name == "tenant_a_requests"
+            assert tenant.get("requests") is counter
+            assert prom.REGISTRY.get("tenant_a_requests") is counter
+            assert redis_client.get(counter.get_metric_key({})) == b'1'
+
+            plugin = tenant.scope("plugin")
+            gauge = plugin.get_or_create(prom.CommonGauge, "size", "Size of plugin")
+            assert gauge.name == "tenant_a_plugin_size"
+
+            tenant.unregister_all()
+            assert tenant.metrics() == []
+            assert prom.REGISTRY.get("tenant_a_requests") is None
+            assert prom.REGISTRY.get("tenant_a_plugin_size") is gauge
@@ -0,0 +1,130 @@
+import os
+import multiprocessing
+
+import pytest
+
+import prometheus_redis_client as prom
+from prometheus_redis_client.shared_memory import SharedMemoryWriter, SharedTable, ADD, REPLACE, CLEAR
+
+from .helpers import MetricEnvironment
+
+
+@pytest.fixture
+def table_path(tmp_path):
+    return str(tmp_path / 'table')
+
+
+def write_metrics(counter, histogram):
+    for _ in range(100):
+        counter.inc()
+        histogram.observe(0.5)
+    os._exit(0)
+
+
+class TestSharedMemoryWriter(object):
+
+    def test_processes(self, table_path):
+        with MetricEnvironment() as redis:
+            writer = SharedMemoryWriter(table_path, flush_interval=60)
+            prom.REGISTRY.set_writer(writer)
+            counter = prom.Counter("test_counter", "Counter documentation")
+            histogram = prom.Histogram("test_histogram", "Histogram documentation", buckets=[1])
+
+            context = multiprocessing.get_context('fork')
+            processes = [
+                context.Process(target=write_metrics, args=(counter, histogram)) for _ in range(4)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+                assert process.exitcode == 0
+            # workers do not write to Redis
+            assert redis.get("test_counter:e30=") is None
+
+            writer.flush()
+            assert int(redis.get("test_counter:e30=")) == 400
+            output = prom.REGISTRY.output()
+            assert 'test_histogram_bucket{le="1"} 400\n' in output
+            assert 'test_histogram_count 400\n' in output
+            assert output.endswith('test_histogram_sum 200')
+
+    def test_ordered_commands(self, table_path):
+        with MetricEnvironment() as redis:
+            writer = SharedMemoryWriter(table_path, flush_interval=60)
+            prom.REGISTRY.set_writer(writer)
+            counter = prom.Counter("test_counter", "Counter documentation", ['name'])
+            gauge = prom.Gauge("test_gauge", "Gauge documentation")
+
+            counter.labels('a').inc(5)
+            counter.labels('b').inc(5)
+            # `set` replaces increments before it
+            counter.labels('a').set(1)
+            counter.labels('a').inc(2)
+            gauge.inc(3)
+            gauge.set(1.5)
+            assert redis.get(counter.get_metric_key({'name': 'a'})) is None
+            writer.flush()
+            assert int(redis.get(counter.get_metric_key({'name': 'a'}))) == 3
+            assert float(redis.get(gauge.get_metric_key({'gauge_index': gauge.index}))) == 1.5
+            assert 0 < redis.ttl(gauge.get_metric_key({'gauge_index': gauge.index})) <= gauge.expire
+
+            # table is sent before `remove`
+            counter.labels('b').inc(1)
+            counter.remove('b')
+            assert redis.get(counter.get_metric_key({'name': 'b'})) is None
+            counter.labels('b').inc(2)
+            writer.flush()
+            assert int(redis.get(counter.get_metric_key({'name': 'b'}))) == 2
+
+    def test_full_table(self, table_path):
+        with MetricEnvironment() as redis:
+            writer = SharedMemoryWriter(table_path, slots=4, stripes=1, flush_interval=60)
+            prom.REGISTRY.set_writer(writer)
+            counter = prom.Counter("test_counter", "Counter documentation", ['name'])
+            for name in 'abcd':
+                counter.labels(name).inc()
+
+            # group members and values of two series fill table
+            assert int(redis.get(counter.get_metric_key({'name': 'c'}))) == 1
+            assert int(redis.get(counter.get_metric_key({'name': 'd'}))) == 1
+            assert redis.get(counter.get_metric_key({'name': 'a'})) is None
+            # sadd and incrby of two series
+            assert 'prometheus_redis_client_shared_direct_total 4' in prom.REGISTRY.output()
+            writer.flush()
+            assert int(redis.get(counter.get_metric_key({'name': 'a'}))) == 1
+
+
+class TestSharedTable(object):
+
+    def test_put_and_take(self, table_path):
+        table = SharedTable(table_path, slots=8, key_size=16, stripes=2)
+        assert table.put(b'a', [(b'a', 1, ADD)])
+        assert table.put(b'a', [(b'a', 2.5, ADD)])
+        assert table.put(b'b', [(b'b', 5, REPLACE)])
+        assert table.put(b'b', [(b'b', 6, REPLACE)])
+        assert table.put(b'c', [(b'c', 1, ADD), (b'd', 1, ADD)])
+        assert table.put(b'c', [(b'c', 0, CLEAR), (b'd', 2, REPLACE), (b'e', 0, CLEAR)])
+        assert not table.put(b'x', [(b'x' * 17, 1, ADD)])
+        assert sorted(table.take()) == [(b'a', 3.5), (b'b', 6), (b'd', 2)]
+        assert table.take() == []
+        table.close()
+
+        with pytest.raises(ValueError):
+            SharedTable(table_path, slots=16, key_size=16, stripes=2)
+
+    def test_election(self, table_path):
+        table = SharedTable(table_path, slots=8, key_size=16, stripes=2)
+        assert table.try_elect()
+
+        def try_elect(queue):
+            queue.put(SharedTable(table_path, slots=8, key_size=16, stripes=2).try_elect())
+
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        process = context.Process(target=try_elect, args=(queue, ))
+        process.start()
+        process.join()
+        assert queue.get() is False
+        table.resign()
+        table.close()
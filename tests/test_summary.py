@@ -126,3 +126,217 @@ class TestSummary(object):
                 'test_summary_count{name="Hi!"} 1\n'
                 'test_summary_sum{name="Hi!"} 0.01'
             )
+
+    def test_time_with_labels(self):
+        with MetricEnvironment() as redis:
+            summary = prom.Summary(
+                name="test_summary",
+                documentation="Summary documentation",
+                labelnames=['name'],
+            )
+
+            @summary.labels(name='test').time()
+            def simple_func():
+                raise ValueError()
+
+            for _ in range(2):
+                with pytest.raises(ValueError):
+                    simple_func()
+
+            assert int(redis.get(summary.get_metric_key({'name': 'test'}, '_count'))) == 2
+            with pytest.raises(ValueError):
+                summary.time()
+
+    def test_quantiles(self):
+        with MetricEnvironment() as redis:
+
+            summary = prom.Summary(
+                name="test_summary",
+                documentation="Summary documentation",
+                labelnames=["name"],
+                quantiles=[0.5, 0.99],
+            )
+
+            for value in range(1, 101):
+                summary.labels(name="test").observe(value)
+
+            # quantiles available only after flush
+            assert redis.smembers(summary.get_sketch_group_key()) == set()
+            summary.flush()
+
+            output = prom.REGISTRY.output().split("\n")
+            assert output[:4] == [
+                '# HELP test_summary Summary documentation',
+                '# TYPE test_summary summary',
+                'test_summary_count{name="test"} 100',
+                'test_summary_sum{name="test"} 5050',
+            ]
+            p50, p99 = [
+                float(line.rsplit(" ", 1)[1]) for line in output[4:]
+            ]
+            assert output[4].startswith('test_summary{name="test",quantile="0.5"} ')
+            assert output[5].startswith('test_summary{name="test",quantile="0.99"} ')
+            assert abs(p50 - 50) <= 50 * 0.01
+            assert abs(p99 - 99) <= 99 * 0.01
+
+    def test_quantiles_merge(self):
+        """Sketches of different processes merge in Redis."""
+        with MetricEnvironment():
+
+            summary = prom.Summary(
+                name="test_summary",
+                documentation="Summary documentation",
+                quantiles=[0.5],
+            )
+
+            for value in range(1, 51):
+                summary.observe(value)
+            summary.flush()
+            for value in range(51, 101):
+                summary.observe(value)
+            summary.flush()
+
+            p50 = float(prom.REGISTRY.output().split("\n")[-1].rsplit(" ", 1)[1])
+            assert abs(p50 - 50) <= 50 * 0.01
+
+    def test_wrong_quantile(self):
+        with MetricEnvironment():
+            with pytest.raises(ValueError, match=r"Quantile should be between 0 and 1"):
+                prom.Summary(
+                    name="test_summary",
+                    documentation="Summary documentation",
+                    quantiles=[50],
+                )
+
+    def test_window(self):
+        with MetricEnvironment() as redis:
+
+            summary = prom.Summary(
+                name="test_summary",
+                documentation="Summary documentation",
+                labelnames=["name"],
+                quantiles=[0.5],
+                window=10,
+                window_slices=5,
+            )
+
+            with patch("prometheus_redis_client.metrics.time.time") as mock_time:
+                mock_time.return_value = 1000
+                summary.labels(name="test").observe(1)
+                summary.labels(name="test").observe(2)
+                summary.flush()
+
+                slice_key = "test_summary_window:eyJuYW1lIjogInRlc3QifQ==:500"
+                assert 0 < redis.ttl(slice_key) <= 12
+                output = prom.REGISTRY.output().split("\n")
+                assert output[:4] == [
+                    '# HELP test_summary Summary documentation',
+                    '# TYPE test_summary summary',
+                    'test_summary_count{name="test"} 2',
+                    'test_summary_sum{name="test"} 3.0',
+                ]
+                assert output[4].startswith('test_summary{name="test",quantile="0.5"} ')
+                assert abs(float(output[4].rsplit(" ", 1)[1]) - 1) <= 0.01
+
+                # first slice is out of window
+                mock_time.return_value = 1010
+                summary.labels(name="test").observe(5)
+                summary.flush()
+                output = prom.REGISTRY.output()
+                assert 'test_summary_count{name="test"} 1\n' in output
+                assert 'test_summary_sum{name="test"} 5.0\n' in output
+
+                # no live slices
+                mock_time.return_value = 1100
+                assert prom.REGISTRY.output() == (
+                    '# HELP test_summary Summary documentation\n'
+                    '# TYPE test_summary summary'
+                )
+                assert redis.smembers(summary.get_window_group_key()) == set()
+
+    def test_window_flush_to_observation_slice(self):
+        with MetricEnvironment() as redis:
+
+            summary = prom.Summary(
+                name="test_summary",
+                documentation="Summary documentation",
+                quantiles=[0.5],
+                window=10,
+                window_slices=5,
+            )
+
+            with patch("prometheus_redis_client.metrics.time.time") as mock_time:
+                mock_time.return_value = 1000
+                summary.observe(1)
+                mock_time.return_value = 1004
+                summary.observe_many([3, 3])
+                summary.flush()
+
+                window_key = summary.get_metric_key({}, "_window")
+                first, last = redis.hgetall(window_key + ":500"), redis.hgetall(window_key + ":502")
+                assert int(first.pop(b'count')) == 1 and float(first.pop(b'sum')) == 1
+                assert int(last.pop(b'count')) == 2 and float(last.pop(b'sum')) == 6
+                # sketch bins are in slices of sum and count
+                assert sum(int(v) for v in first.values()) == 1
+                assert sum(int(v) for v in last.values()) == 2
+
+    def test_observe_many(self):
+        with MetricEnvironment():
+
+            summary = prom.Summary(
+                name="test_summary",
+                documentation="Summary documentation",
+                labelnames=["name"],
+            )
+
+            summary.labels(name="test").observe_many([1, 2, 3.5])
+            summary.labels(name="test").observe(1)
+
+            assert prom.REGISTRY.output() == (
+                '# HELP test_summary Summary documentation\n'
+                '# TYPE test_summary summary\n'
+                'test_summary_count{name="test"} 4\n'
+                'test_summary_sum{name="test"} 7.5'
+            )
+
+    def test_remove_and_clear(self):
+        with MetricEnvironment() as redis:
+            summary = prom.Summary("test_summary", "Summary documentation", ['name'], quantiles=[0.5])
+            window = prom.Summary("test_window", "Summary documentation", ['name'], window=60)
+            for name in ('a', 'b'):
+                summary.labels(name).observe(1)
+                window.labels(name).observe(1)
+            summary.flush()
+
+            summary.remove('a')
+            window.remove('a')
+            assert prom.REGISTRY.output().split("\n") == [
+                "# HELP test_summary Summary documentation",
+                "# TYPE test_summary summary",
+                'test_summary_count{name="b"} 1',
+                'test_summary_sum{name="b"} 1',
+                'test_summary{name="b",quantile="0.5"} 0.9900000000000001',
+                "# HELP test_window Summary documentation",
+                "# TYPE test_window summary",
+                'test_window_count{name="b"} 1',
+                'test_window_sum{name="b"} 1.0',
+            ]
+
+            summary.clear()
+            window.clear()
+            assert redis.keys('test_*') == []
+
+    def test_sample_rate(self):
+        with MetricEnvironment():
+            summary = prom.Summary(
+                "test_summary", "Summary documentation", quantiles=[0.5], sample_rate=0.5,
+            )
+            with patch('prometheus_redis_client.metrics._random', side_effect=[0.1, 0.7, 0.3]):
+                for value in (2, 3, 4):
+                    summary.observe(value)
+            summary.flush()
+            output = prom.REGISTRY.output().split("\n")[2:]
+            assert output[:2] == ['test_summary_count 4', 'test_summary_sum 12']
+            # sampled values 2 and 4 with weight 2
+            assert float(output[2].split()[1]) == pytest.approx(2, rel=0.01)
+
@@ -0,0 +1,92 @@
+import time
+import threading
+from unittest.mock import patch
+
+import pytest
+
+import prometheus_redis_client as prom
+
+from .helpers import MetricEnvironment
+
+
+class TestBackgroundWriter(object):
+
+    def test_write(self):
+        with MetricEnvironment() as redis:
+            writer = prom.BackgroundWriter()
+            prom.REGISTRY.set_writer(writer)
+            try:
+                counter = prom.Counter("test_counter", "Counter documentation")
+                histogram = prom.Histogram(
+                    "test_histogram", "Histogram documentation", buckets=[1],
+                )
+
+                assert counter.inc() is None
+                counter.inc(2)
+                histogram.observe(0.5)
+                writer.flush()
+
+                assert int(redis.get("test_counter:e30=")) == 3
+                output = prom.REGISTRY.output()
+                assert (
+                    "# HELP prometheus_redis_client_writer_queue_size Count of metric operations in writer queue\n"
+                    "# TYPE prometheus_redis_client_writer_queue_size gauge\n"
+                    "prometheus_redis_client_writer_queue_size 0\n"
+                ) in output
+                assert "prometheus_redis_client_writer_flush_duration_seconds_count " in output
+                assert "test_histogram_bucket{le=\"1\"} 1\n" in output
+            finally:
+                prom.REGISTRY.set_writer(None)
+
+    @pytest.mark.parametrize("overflow, expected", [
+        (prom.BackgroundWriter.DROP_NEWEST, 2),
+        (prom.BackgroundWriter.DROP_OLDEST, 4),
+    ])
+    def test_overflow(self, overflow, expected):
+        with MetricEnvironment() as redis:
+            writer = prom.BackgroundWriter(maxsize=1, max_batch=1, overflow=overflow)
+            prom.REGISTRY.set_writer(writer)
+            try:
+                counter = prom.Counter("test_counter", "Counter documentation")
+                send_commands = prom.REGISTRY.send_commands
+                started, release = threading.Event(), threading.Event()
+
+                def slow_send(commands):
+                    started.set()
+                    release.wait()
+                    return send_commands(commands)
+
+                with patch.object(prom.REGISTRY, "send_commands", side_effect=slow_send):
+                    counter.inc(1)
+                    started.wait()
+                    # first operation is in progress, queue has one place
+                    counter.inc(1)
+                    counter.inc(3)
+                    release.set()
+                    writer.flush()
+
+                assert int(redis.get("test_counter:e30=")) == expected
+                assert "prometheus_redis_client_writer_dropped_total 1" in prom.REGISTRY.output()
+            finally:
+                prom.REGISTRY.set_writer(None)
+
+    def test_wrong_overflow(self):
+        with pytest.raises(ValueError, match=r"overflow should be one of"):
+            prom.BackgroundWriter(overflow="unknown")
+
+    def test_flush_interval(self):
+        with MetricEnvironment() as redis:
+            writer = prom.BackgroundWriter(flush_interval=0.2)
+            prom.REGISTRY.set_writer(writer)
+            try:
+                counter = prom.Counter("test_counter", "Counter documentation")
+                with patch.object(prom.REGISTRY, 'send_commands', wraps=prom.REGISTRY.send_commands) as send:
+                    for _ in range(5):
+                        counter.inc()
+                    time.sleep(0.05)
+                    assert redis.get("test_counter:e30=") is None
+                    writer.flush()
+                    assert send.call_count == 1
+                assert int(redis.get("test_counter:e30=")) == 5
+            finally:
+                prom.REGISTRY.set_writer(None)